@@ -0,0 +1,63 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Report end-to-end alert latency (image capture to alert delivered) percentiles
+per alert channel and per camera
+
+"""
+
+import os, sys
+from firecam.lib import settings
+from firecam.lib import collect_args
+from firecam.lib import db_manager
+from firecam.lib import alert_timings
+
+import logging
+import time
+
+
+def printStats(title, stats):
+    logging.warning('%s:', title)
+    for (groupVal, groupStats) in sorted(stats.items()):
+        fmt = lambda x: ('%.1f' % x) if x != None else '-'
+        logging.warning('  %-20s count %4d ; p50 %7ss ; p95 %7ss ; p99 %7ss ; capture->fetch %6ss ; fetch->detect %6ss',
+                        groupVal, groupStats['count'], fmt(groupStats['p50']), fmt(groupStats['p95']),
+                        fmt(groupStats['p99']), fmt(groupStats['capture']), fmt(groupStats['detect']))
+
+
+def main():
+    optArgs = [
+        ["d", "days", "(optional) number of days of alerts to include (default 7)", int],
+        ["c", "cameraID", "(optional) only include alerts from given camera"],
+    ]
+    args = collect_args.collectArgs([], optionalArgs=optArgs)
+    dbManager = db_manager.DbManager(sqliteFile=settings.db_file,
+                                     psqlHost=settings.psqlHost, psqlDb=settings.psqlDb,
+                                     psqlUser=settings.psqlUser, psqlPasswd=settings.psqlPasswd)
+    days = args.days or 7
+    sqlStr = 'SELECT * FROM alert_timings WHERE Timestamp > %d' % (time.time() - days*24*60*60)
+    if args.cameraID:
+        sqlStr += " AND CameraName = '%s'" % args.cameraID
+    timingRows = dbManager.query(sqlStr)
+    logging.warning('Found %d alert channel timings in last %d days', len(timingRows), days)
+    if not timingRows:
+        return
+    printStats('Latency by channel', alert_timings.getLatencyStats(timingRows, 'channel'))
+    printStats('Latency by camera', alert_timings.getLatencyStats(timingRows, 'cameraname'))
+
+
+if __name__=="__main__":
+    main()
@@ -14,7 +14,7 @@
 # ==============================================================================
 """
 
-add, delete, enable, disable, stats, or list cameras in detection system
+add, delete, enable, disable, stats, health, or list cameras in detection system
 
 """
 
@@ -48,9 +48,22 @@ def getTime(dbResult):
     return datetime.datetime.fromtimestamp(timeVal).isoformat()
 
 
+def printHealth(healthRow):
+    """Print the given camera_health row in easy to read format
+
+    Args:
+        healthRow (dict): row from camera_health table
+    """
+    timeStr = lambda x: datetime.datetime.fromtimestamp(x).isoformat() if x else 'never'
+    logging.warning('Camera %s: %s (%d failures) %s ; last success: %s ; last failure: %s ; next check: %s',
+                    healthRow['cameraname'], healthRow['status'], healthRow['failures'], healthRow['reason'],
+                    timeStr(healthRow['lastsuccess']), timeStr(healthRow['lastfailure']),
+                    timeStr(healthRow['nextcheck']))
+
+
 def main():
     reqArgs = [
-        ["m", "mode", "add, delete, enable, disable, stats, or list"],
+        ["m", "mode", "add, delete, enable, disable, stats, health, or list"],
     ]
     optArgs = [
         ["c", "cameraID", "ID of the camera (e.g., mg-n-mobo-c)"],
@@ -66,6 +79,12 @@ def main():
     if args.mode == 'list':
         logging.warning('All cameras: %s', list(map(lambda x: x['name'], cameraInfos)))
         return
+    if args.mode == 'health' and not args.cameraID:
+        healthRows = dbManager.query("SELECT * FROM camera_health WHERE Status != 'healthy' ORDER BY CameraName")
+        logging.warning('Num cameras with failures: %d', len(healthRows))
+        for healthRow in healthRows:
+            printHealth(healthRow)
+        return
     matchingCams = list(filter(lambda x: x['name'] == args.cameraID, cameraInfos))
     logging.warning('Found %d matching cams for ID %s', len(matchingCams), args.cameraID)
 
@@ -81,6 +100,7 @@ def main():
             'last_date': datetime.datetime.now().isoformat()
         }
         dbManager.add_data('sources', dbRow)
+        dbManager.bumpConfigVersion()
         logging.warning('Successfully added camera %s', args.cameraID)
         return
 
@@ -93,6 +113,7 @@ def main():
     if args.mode == 'delete':
         sqlTemplate = """DELETE FROM sources WHERE name = '%s' """
         execCameraSql(dbManager, sqlTemplate, args.cameraID, isQuery=False)
+        dbManager.bumpConfigVersion()
         return
 
     if args.mode == 'enable':
@@ -101,6 +122,7 @@ def main():
             exit(1)
         sqlTemplate = """UPDATE sources SET dormant=0 WHERE name = '%s' """
         execCameraSql(dbManager, sqlTemplate, args.cameraID, isQuery=False)
+        dbManager.bumpConfigVersion()
         return
 
     if args.mode == 'disable':
@@ -109,6 +131,7 @@ def main():
             exit(1)
         sqlTemplate = """UPDATE sources SET dormant=1 WHERE name = '%s' """
         execCameraSql(dbManager, sqlTemplate, args.cameraID, isQuery=False)
+        dbManager.bumpConfigVersion()
         return
 
     if args.mode == 'stats':
@@ -121,6 +144,15 @@ def main():
         sqlTemplate = """SELECT max(timestamp) as maxtime FROM alerts WHERE CameraName = '%s' """
         dbResult = execCameraSql(dbManager, sqlTemplate, args.cameraID, isQuery=True)
         logging.warning('Most recent smoke alert: %s', getTime(dbResult))
+        args.mode = 'health' # also show health information
+
+    if args.mode == 'health':
+        sqlTemplate = """SELECT * FROM camera_health WHERE CameraName = '%s' """
+        dbResult = execCameraSql(dbManager, sqlTemplate, args.cameraID, isQuery=True)
+        if dbResult:
+            printHealth(dbResult[0])
+        else:
+            logging.warning('No health information for camera %s', args.cameraID)
         return
 
     logging.error('Unexpected mode: %s', args.mode)
@@ -27,11 +27,11 @@ from firecam.lib import settings
 from firecam.lib import collect_args
 from firecam.lib import rect_to_squares
 from firecam.lib import tf_helper
+from firecam.lib import annotate
 
 import logging
-import pathlib
 import tkinter as tk
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import Image, ImageTk, ImageDraw
 
 
 def imageDisplay(imgOrig, title=''):
@@ -85,11 +85,6 @@ def displayImageWithScores(imgOrig, segments):
     rootTk.mainloop()
 
 
-def drawRect(imgDraw, x0, y0, x1, y1, width, color):
-    for i in range(width):
-        imgDraw.rectangle((x0+i,y0+i,x1-i,y1-i),outline=color)
-
-
 def drawBoxesAndScores(imgOrig, segments):
     imgDraw = ImageDraw.Draw(imgOrig)
     for counter, segmentInfo in enumerate(segments):
@@ -100,17 +95,15 @@ def drawBoxesAndScores(imgOrig, segments):
         y1 = segmentInfo['MaxY'] + offset
         color = colors[counter % len(colors)]
         lineWidth=3
-        drawRect(imgDraw, x0, y0, x1, y1, lineWidth, color)
+        annotate.drawRect(imgDraw, x0, y0, x1, y1, lineWidth, color)
         centerX = (x0 + x1)/2
         centerY = (y0 + y1)/2
         fontSize=60
-        fontPath = os.path.join(str(pathlib.Path(__file__).parent.parent), 'firecam/data/Roboto-Regular.ttf')
-        font = ImageFont.truetype(fontPath, size=fontSize)
         scoreStr = '%.2f' % segmentInfo['score']
-        textSize = imgDraw.textsize(scoreStr, font=font)
+        textSize = annotate.getTextSize(scoreStr, fontSize)
         centerX -= textSize[0]/2
         centerY -= textSize[1]/2
-        imgDraw.text((centerX,centerY), scoreStr, font=font, fill=color)
+        annotate.drawText(imgOrig, (centerX, centerY), scoreStr, fontSize, color)
 
 
 def main():
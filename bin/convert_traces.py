@@ -0,0 +1,40 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Convert tracing spans written by detect_fire (JSONL) into Chrome trace event
+format for viewing in chrome://tracing or ui.perfetto.dev
+
+"""
+
+import os, sys
+from firecam.lib import collect_args
+from firecam.lib import tracing
+
+import logging
+
+
+def main():
+    reqArgs = [
+        ["i", "inputFile", "JSONL file with spans written by detect_fire"],
+        ["o", "outputFile", "output JSON file in Chrome trace format"],
+    ]
+    args = collect_args.collectArgs(reqArgs)
+    tracing.convertToChromeTrace(args.inputFile, args.outputFile)
+    logging.warning('Wrote %s', args.outputFile)
+
+
+if __name__=="__main__":
+    main()
@@ -158,9 +158,6 @@ def main():
         endTimeDT = startTimeDT + durationDelta
     else:
         endTimeDT = startTimeDT
-    assert startTimeDT.year == endTimeDT.year
-    assert startTimeDT.month == endTimeDT.month
-    assert startTimeDT.day == endTimeDT.day
     assert endTimeDT >= startTimeDT
     if args.cameraID:
         assert (not args.latitude) and (not args.longitude)
@@ -174,13 +171,12 @@ def main():
         logging.warning('Matched cmaeras: %s', cameras)
 
     camArchives = img_archive.getHpwrenCameraArchives(settings.hpwrenArchives)
-    allFiles = []
-    for cameraID in cameras:
-        camFiles = img_archive.getHpwrenImages(googleServices, settings, outputDir, camArchives, cameraID, startTimeDT, endTimeDT, gapMinutes)
-        if camFiles:
-            allFiles += camFiles
-    if allFiles:
-        logging.warning('Found %d files.', len(allFiles))
+    numFiles = 0
+    for (cameraID, unixTime, imgPath) in img_archive.iterateHpwrenImages(googleServices, settings, outputDir, camArchives,
+                                                                         cameras, startTimeDT, endTimeDT, gapMinutes):
+        numFiles += 1
+    if numFiles:
+        logging.warning('Found %d files.', numFiles)
     else:
         logging.error('No filed matched')
 
@@ -59,15 +59,17 @@ def getLocationMatches(dbManager, longitude, latitude, startTime):
 
 
 def isCamArchiveAvailable(camArchives, cameraID, timeDT):
-    matchingCams = list(filter(lambda x: cameraID == x['id'], camArchives))
-    for matchingCam in matchingCams:
-        # logging.warning('Searching for files in dir %s', matchingCam['dir'])
+    for matchingDir in camArchives.getDirs(cameraID):
+        # logging.warning('Searching for files in dir %s', matchingDir)
         hpwrenSource = {
             'cameraID': cameraID,
-            'dirName': matchingCam['dir'],
+            'dirName': matchingDir,
             'startTimeDT': timeDT,
             'endTimeDT': timeDT
         }
+        dirSource = camArchives.getDirSource(matchingDir)
+        if dirSource:
+            (hpwrenSource['server'], hpwrenSource['subdir']) = dirSource
         found = img_archive.downloadFilesHpwren(None, None, img_archive.outputDirCheckOnly, hpwrenSource, 1, False)
         if found:
             return True
@@ -105,7 +107,7 @@ def main():
     outputFile = open(args.outputFile, 'w', newline='')
     outputCsv = csv.writer(outputFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
 
-    camArchives = img_archive.getHpwrenCameraArchives(googleServices['sheet'], settings)
+    camArchives = img_archive.getHpwrenCameraArchives(settings.hpwrenArchives)
 
     locMatches = getLocationMatches(dbManager, args.longitude, args.latitude, args.startTime)
     totalMatches = len(locMatches)
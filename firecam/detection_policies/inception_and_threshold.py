@@ -21,11 +21,13 @@ historical scores.
 
 """
 
-import os, sys
+import os, sys, io
 from firecam.lib import settings
 from firecam.lib import goog_helper
+from firecam.lib import img_archive
 from firecam.lib import tf_helper
 from firecam.lib import rect_to_squares
+from firecam.lib import metrics
 
 import pathlib
 from PIL import Image, ImageFile, ImageDraw, ImageFont
@@ -69,47 +71,56 @@ class InceptionV3AndHistoricalThreshold:
             self.model = tf_helper.loadModel(modelLocation)
 
 
-    def _segmentImage(self, imgPath):
+    def _segmentImage(self, imgFile):
         """Segment the given image into sections to for smoke classificaiton
 
         Args:
-            imgPath (str): filepath of the image
+            imgFile: filepath or file object (e.g. BytesIO) of the image
 
         Returns:
             List of dictionary containing information on each segment
         """
-        img = Image.open(imgPath)
-        crops, segments = rect_to_squares.cutBoxesArray(img)
+        with metrics.stageTimer('decode'):
+            img = Image.open(imgFile)
+            img.load()
+        with metrics.stageTimer('tile'):
+            crops, segments = rect_to_squares.cutBoxesArray(img)
         img.close()
         return crops, segments
 
 
-    def _segmentAndClassify(self, imgPath):
+    def _segmentAndClassify(self, imgFile, tileStride=1, tileOffset=0):
         """Segment the given image into squares and classify each square
 
         Args:
-            imgPath (str): filepath of the image to segment and clasify
+            imgFile: filepath or file object of the image to segment and clasify
+            tileStride (int): only classify every tileStride'th square (used when shedding load)
+            tileOffset (int): index of first square to classify when tileStride > 1
 
         Returns:
             list of segments with scores sorted by decreasing score
         """
-        crops, segments = self._segmentImage(imgPath)
+        crops, segments = self._segmentImage(imgFile)
+        if tileStride > 1:
+            crops = crops[tileOffset::tileStride]
+            segments = segments[tileOffset::tileStride]
         if len(crops) == 0:
             return []
-        # testMode fakes all scores
-        if testMode:
-            for segmentInfo in segments:
-                segmentInfo['score'] = random.random()
-        elif useFrozen:
-            tf_helper.classifyFrozenTf2(self.model, crops, segments)
-        else:
-            tf_helper.classifySegments(self.model, crops, segments)
+        with metrics.stageTimer('infer'):
+            # testMode fakes all scores
+            if testMode:
+                for segmentInfo in segments:
+                    segmentInfo['score'] = random.random()
+            elif useFrozen:
+                tf_helper.classifyFrozenTf2(self.model, crops, segments)
+            else:
+                tf_helper.classifySegments(self.model, crops, segments)
 
         segments.sort(key=lambda x: -x['score'])
         return segments
 
 
-    def _collectPositves(self, imgPath, segments):
+    def _collectPositves(self, imgPath, segments, imgFile=None):
         """Collect all positive scoring segments
 
         Copy the images for all segments that score highter than > .5 to folder
@@ -119,6 +130,7 @@ class InceptionV3AndHistoricalThreshold:
         Args:
             imgPath (str): path name for main image
             segments (list): List of dictionary containing information on each segment
+            imgFile: optional file object with image data (if not available at imgPath)
         """
         positiveSegments = 0
         ppath = pathlib.PurePath(imgPath)
@@ -131,7 +143,7 @@ class InceptionV3AndHistoricalThreshold:
                     cropImgName = imgNameNoExt + '_Crop_' + segmentInfo['coordStr'] + '.jpg'
                     cropImgPath = os.path.join(str(ppath.parent), cropImgName)
                     if not imgObj:
-                        imgObj = Image.open(imgPath)
+                        imgObj = Image.open(imgFile or imgPath)
                     cropped_img = imgObj.crop(segmentInfo['coords'])
                     cropped_img.save(cropImgPath, format='JPEG')
                     cropped_img.close()
@@ -285,20 +297,26 @@ class InceptionV3AndHistoricalThreshold:
         imgPath = last_image_spec['path']
         timestamp = last_image_spec['timestamp']
         cameraID = last_image_spec['cameraID']
+        # live images are kept in memory and only written to imgPath when needed
+        imgData = last_image_spec.get('data')
         detectionResult = {
             'fireSegment': None
         }
-        segments = self._segmentAndClassify(imgPath)
+        (tileStride, tileOffset) = last_image_spec.get('tileSampling', (1, 0))
+        segments = self._segmentAndClassify(io.BytesIO(imgData) if imgData else imgPath, tileStride, tileOffset)
         detectionResult['segments'] = segments
         detectionResult['timeMid'] = time.time()
         if len(segments) == 0: # happens sometimes when camera is malfunctioning
             return detectionResult
         if getattr(self.args, 'collectPositves', None):
-            self._collectPositves(imgPath, segments)
+            self._collectPositves(imgPath, segments, io.BytesIO(imgData) if imgData else None)
         if not self.stateless:
-            self._recordScores(cameraID, timestamp, segments)
-            fireSegment = self._postFilter(cameraID, timestamp, segments)
+            with metrics.stageTimer('dbWrite'):
+                self._recordScores(cameraID, timestamp, segments)
+            with metrics.stageTimer('postFilter'):
+                fireSegment = self._postFilter(cameraID, timestamp, segments)
             if fireSegment:
+                img_archive.saveImageData(imgPath, imgData)
                 self._recordDetection(cameraID, timestamp, imgPath, fireSegment)
                 detectionResult['fireSegment'] = fireSegment
         logging.warning('Highest score for camera %s: %f' % (cameraID, segments[0]['score']))
@@ -0,0 +1,197 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Shared cache of the historical images attached to alerts (clips and emails).
+The images from the minutes before an alert are fetched once, one minute per
+worker thread, and then served to every consumer until the time budget
+expires.  Minutes already covered by recent frames in the local ring buffer
+are written from memory without any archive download.
+
+"""
+
+import os
+import logging
+import threading
+import tempfile
+import shutil
+import time
+import datetime
+import collections
+import concurrent.futures
+
+from firecam.lib import img_archive
+
+# minutes before the alert covered by the cached history (all consumers need subsets of this)
+HISTORY_START_MINUTES = 5
+HISTORY_END_MINUTES = 1
+# maximum distance (seconds) between a ring buffer frame and the desired minute
+RING_TOLERANCE_SECONDS = 30
+
+
+class FrameRingBuffer(object):
+    def __init__(self, maxSeconds):
+        """In memory buffer of the recent images from every camera
+
+        Args:
+            maxSeconds (int): frames older than this many seconds are dropped
+        """
+        self.maxSeconds = maxSeconds
+        self.lock = threading.Lock()
+        self.frames = {}
+
+
+    def add(self, cameraID, timestamp, imgData):
+        """Add the given image to buffer of given camera
+
+        Args:
+            cameraID (str): camera name
+            timestamp (int): time.time() value when image was taken
+            imgData (bytes): image data
+        """
+        with self.lock:
+            cameraFrames = self.frames.setdefault(cameraID, collections.deque())
+            cameraFrames.append((timestamp, imgData))
+            while cameraFrames and (cameraFrames[0][0] < timestamp - self.maxSeconds):
+                cameraFrames.popleft()
+
+
+    def getClosest(self, cameraID, desiredTime, toleranceSeconds=RING_TOLERANCE_SECONDS):
+        """Get the buffered frame of given camera closest to desired time
+
+        Args:
+            cameraID (str): camera name
+            desiredTime (int): desired timestamp
+            toleranceSeconds (int): maximum difference from desired time
+
+        Returns:
+            Tuple (timestamp, imgData), or None if no frame is close enough
+        """
+        with self.lock:
+            cameraFrames = list(self.frames.get(cameraID, []))
+        if not cameraFrames:
+            return None
+        closest = min(cameraFrames, key=lambda x: abs(x[0] - desiredTime))
+        if abs(closest[0] - desiredTime) > toleranceSeconds:
+            return None
+        return closest
+
+
+class AlertAssetCache(object):
+    def __init__(self, fetchFunc, ringBuffer=None, budgetSeconds=30*60, maxWorkers=4):
+        """Cache of historical images for alerts
+
+        Args:
+            fetchFunc: function(outputDir, cameraID, desiredDT) returning list of
+                       downloaded paths for the archive image closest to desired time
+            ringBuffer (FrameRingBuffer): optional buffer of recent frames
+            budgetSeconds (int): seconds the images of each alert are kept
+            maxWorkers (int): number of parallel archive downloads
+        """
+        self.fetchFunc = fetchFunc
+        self.ringBuffer = ringBuffer
+        self.budgetSeconds = budgetSeconds
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+
+
+    def _fetchMinute(self, entryDir, cameraID, desiredTime):
+        try:
+            downloaded = self.fetchFunc(entryDir, cameraID, datetime.datetime.fromtimestamp(desiredTime))
+        except Exception as e:
+            logging.error('Error fetching archive image %s %s: %s', cameraID, desiredTime, str(e))
+            return None
+        return downloaded[0] if downloaded else None
+
+
+    def prefetch(self, cameraID, timestamp):
+        """Start fetching the history of given alert in the background (if not already cached)
+
+        Args:
+            cameraID (str): camera name
+            timestamp (int): time.time() value when alert image was taken
+
+        Returns:
+            cache entry for the alert
+        """
+        self.evict()
+        key = (cameraID, timestamp)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                return entry
+            entry = {
+                'created': time.time(),
+                'dir': tempfile.mkdtemp(dir=self.tmpDir.name),
+                'minutes': {}
+            }
+            numBuffered = 0
+            for minutes in range(HISTORY_END_MINUTES, HISTORY_START_MINUTES + 1):
+                desiredTime = timestamp - minutes*60
+                frame = self.ringBuffer.getClosest(cameraID, desiredTime) if self.ringBuffer else None
+                if frame:
+                    imgPath = img_archive.getImgPath(entry['dir'], cameraID, frame[0])
+                    with open(imgPath, 'wb') as f:
+                        f.write(frame[1])
+                    future = concurrent.futures.Future()
+                    future.set_result(imgPath)
+                    numBuffered += 1
+                else:
+                    future = self.executor.submit(self._fetchMinute, entry['dir'], cameraID, desiredTime)
+                entry['minutes'][minutes] = future
+            self.entries[key] = entry
+        logging.warning('Alert assets %s: %d minutes from ring buffer', cameraID, numBuffered)
+        return entry
+
+
+    def getImages(self, cameraID, timestamp, startMinutes, endMinutes):
+        """Get the cached history images of given alert, waiting for pending fetches
+
+        Args:
+            cameraID (str): camera name
+            timestamp (int): time.time() value when alert image was taken
+            startMinutes (int): minutes before timestamp of the earliest image
+            endMinutes (int): minutes before timestamp of the latest image
+
+        Returns:
+            List of local filesystem paths sorted by time
+        """
+        assert HISTORY_END_MINUTES <= endMinutes <= startMinutes <= HISTORY_START_MINUTES
+        entry = self.prefetch(cameraID, timestamp)
+        imgPaths = []
+        for minutes in range(startMinutes, endMinutes - 1, -1):
+            imgPath = entry['minutes'][minutes].result()
+            if imgPath and (imgPath not in imgPaths) and os.path.isfile(imgPath):
+                imgPaths.append(imgPath)
+        return imgPaths
+
+
+    def evict(self, timeNow=None):
+        """Remove the images of alerts older than the time budget
+
+        Args:
+            timeNow (float): optional current time (for testing)
+        """
+        timeNow = timeNow or time.time()
+        with self.lock:
+            expired = list(filter(lambda x: timeNow - x[1]['created'] > self.budgetSeconds, self.entries.items()))
+            for (key, entry) in expired:
+                del self.entries[key]
+        for (key, entry) in expired:
+            # let pending downloads finish before deleting their directory
+            concurrent.futures.wait(entry['minutes'].values())
+            shutil.rmtree(entry['dir'], ignore_errors=True)
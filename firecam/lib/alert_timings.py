@@ -0,0 +1,185 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Track end-to-end latency of alerts, from the time the camera captured the
+image to the time each alert channel (DB, pubsub, email, sms) completed.
+Timings are stored in the alert_timings table, one row per channel.
+
+"""
+
+import io
+import logging
+import time
+import datetime
+import email.utils
+import exifread
+import concurrent.futures
+
+from firecam.lib import metrics
+
+
+def getCaptureTime(imgData=None, lastModified=None):
+    """Get the time the camera captured the image
+
+    The HTTP Last-Modified header is preferred because it includes the timezone.
+    EXIF timestamps are assumed to be in local time of this machine.
+
+    Args:
+        imgData (bytes): optional image data to check for EXIF timestamps
+        lastModified (str): optional HTTP Last-Modified header value
+
+    Returns:
+        Tuple of capture time (seconds since epoch) and its source ('http', 'exif'),
+        or (None, None) if unknown
+    """
+    if lastModified:
+        try:
+            return (email.utils.parsedate_to_datetime(lastModified).timestamp(), 'http')
+        except (TypeError, ValueError) as e:
+            logging.warning('Invalid Last-Modified header %s: %s', lastModified, str(e))
+    if imgData:
+        tags = exifread.process_file(io.BytesIO(imgData), details=False, stop_tag='DateTimeOriginal')
+        for tagName in ['EXIF DateTimeOriginal', 'Image DateTime']:
+            if tagName in tags:
+                try:
+                    captureDT = datetime.datetime.strptime(str(tags[tagName]), '%Y:%m:%d %H:%M:%S')
+                    return (captureDT.timestamp(), 'exif')
+                except ValueError:
+                    pass
+    return (None, None)
+
+
+class AlertTimer(object):
+    def __init__(self, cameraID, timestamp, captureTime, captureSource, fetchTime, detectTime):
+        """Record of the timings for one alert
+
+        Args:
+            cameraID (str): camera name
+            timestamp (int): time.time() value when image was fetched (key for alerts table)
+            captureTime (float): time image was captured by camera (None if unknown)
+            captureSource (str): where captureTime came from
+            fetchTime (float): time image download completed
+            detectTime (float): time detection completed
+        """
+        self.cameraID = cameraID
+        self.timestamp = timestamp
+        self.captureTime = captureTime
+        self.captureSource = captureSource
+        self.fetchTime = fetchTime
+        self.detectTime = detectTime
+        self.channels = []
+        self.pending = []
+
+
+    def addPending(self, futures):
+        """Add futures of notifications still being sent in the background
+
+        Args:
+            futures (list): list of concurrent.futures.Future
+        """
+        self.pending += futures
+
+
+    def isDone(self):
+        """Check if all pending notifications have completed
+        """
+        return all(future.done() for future in self.pending)
+
+
+    def markChannel(self, channel):
+        """Record that given alert channel just completed (may be called from background threads)
+
+        Args:
+            channel (str): name of channel (e.g., 'email')
+        """
+        completedTime = time.time()
+        self.channels.append((channel, completedTime))
+        startTime = self.captureTime or self.fetchTime
+        metrics.registry.histogram('firecam_alert_latency_seconds', 'Seconds from image capture to alert').observe(
+            completedTime - startTime, {'channel': channel})
+
+
+    def save(self, dbManager):
+        """Write the timings of all completed channels to alert_timings table
+
+        Args:
+            dbManager (DbManager):
+        """
+        if not self.channels:
+            return
+        dbRows = []
+        for (channel, completedTime) in self.channels:
+            dbRows.append({
+                'CameraName': self.cameraID,
+                'Timestamp': self.timestamp,
+                'Channel': channel,
+                'CaptureTime': self.captureTime or 0,
+                'CaptureSource': self.captureSource or '',
+                'FetchTime': self.fetchTime,
+                'DetectTime': self.detectTime,
+                'CompletedTime': completedTime,
+            })
+        dbManager.add_data('alert_timings', dbRows)
+
+
+def savePendingTimers(alertTimers, dbManager, timeout=10):
+    """Wait briefly for the background notifications of given alerts, then save their timings
+       (e.g., at shutdown, so slow alerts are not missing from the latency report)
+
+    Args:
+        alertTimers (list): AlertTimer objects not saved yet
+        dbManager (DbManager):
+        timeout (int): maximum seconds to wait for pending notifications
+    """
+    pending = [future for alertTimer in alertTimers for future in alertTimer.pending]
+    concurrent.futures.wait(pending, timeout=timeout)
+    for alertTimer in alertTimers:
+        if not alertTimer.isDone():
+            logging.warning('Saving partial alert timings for %s', alertTimer.cameraID)
+        alertTimer.save(dbManager)
+    alertTimers.clear()
+
+
+def getLatencyStats(timingRows, groupKey):
+    """Compute latency percentiles from alert_timings rows grouped by given column
+
+    Latency is measured from capture time when known, otherwise from fetch time.
+
+    Args:
+        timingRows (list): rows from alert_timings table
+        groupKey (str): column to group by (e.g., 'channel' or 'cameraname')
+
+    Returns:
+        Dictionary mapping group value to dictionary with count, p50, p95, p99,
+        and median capture->fetch and fetch->detect times
+    """
+    groups = {}
+    for row in timingRows:
+        groups.setdefault(row[groupKey], []).append(row)
+    stats = {}
+    for (groupVal, rows) in groups.items():
+        latencies = sorted(row['completedtime'] - (row['capturetime'] or row['fetchtime']) for row in rows)
+        captureDelays = sorted(row['fetchtime'] - row['capturetime'] for row in rows if row['capturetime'])
+        detectDelays = sorted(row['detecttime'] - row['fetchtime'] for row in rows)
+        stats[groupVal] = {
+            'count': len(rows),
+            'p50': metrics.getPercentile(latencies, 50),
+            'p95': metrics.getPercentile(latencies, 95),
+            'p99': metrics.getPercentile(latencies, 99),
+            'capture': metrics.getPercentile(captureDelays, 50),
+            'detect': metrics.getPercentile(detectDelays, 50),
+        }
+    return stats
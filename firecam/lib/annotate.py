@@ -0,0 +1,119 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Draw annotations (boxes, scores, timestamps, watermark) on images.  Fonts
+are loaded once, and text is rendered into RGBA layers that are cached and
+alpha composited onto the images, so repeated text (e.g. the watermark on
+every frame of an alert clip) is only rendered once.
+
+"""
+
+import os
+import pathlib
+import datetime
+import functools
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+
+FONT_PATH = os.path.join(str(pathlib.Path(__file__).parent.parent), 'data', 'Roboto-Regular.ttf')
+WATERMARK_TEXT = 'Open Climate Tech - Wildfire'
+WATERMARK_FONT_SIZE = 32
+TIMESTAMP_FONT_SIZE = 32
+# width of the black outline around timestamps
+TIMESTAMP_OUTLINE = 2
+
+
+@functools.lru_cache(maxsize=None)
+def getFont(fontSize):
+    """Get the standard font in given size (cached)
+    """
+    return ImageFont.truetype(FONT_PATH, size=fontSize)
+
+
+def getTextSize(text, fontSize):
+    """Get (width, height) of given text from its origin (replacement for ImageDraw.textsize)
+    """
+    bbox = getFont(fontSize).getbbox(text)
+    return (bbox[2], bbox[3])
+
+
+@functools.lru_cache(maxsize=64)
+def getTextLayer(text, fontSize, color, outlineColor=None, outlineWidth=0):
+    """Render given text into a transparent RGBA layer (cached, so callers must not modify it)
+
+    The optional outline is made by dilating the text mask with a max filter,
+    which is much cheaper than rendering the text at every offset.
+
+    Args:
+        text (str): text to render
+        fontSize (int): font size
+        color: fill color of the text
+        outlineColor: optional color of the outline
+        outlineWidth (int): width of the outline in pixels
+
+    Returns:
+        RGBA Image with text drawn at offset (outlineWidth, outlineWidth)
+    """
+    (width, height) = getTextSize(text, fontSize)
+    mask = Image.new('L', (width + 2*outlineWidth, height + 2*outlineWidth), 0)
+    ImageDraw.Draw(mask).text((outlineWidth, outlineWidth), text, font=getFont(fontSize), fill=255)
+    if outlineColor and outlineWidth:
+        layer = Image.new('RGBA', mask.size, outlineColor)
+        layer.putalpha(mask.filter(ImageFilter.MaxFilter(2*outlineWidth + 1)))
+        layer.paste(color, mask=mask)
+    else:
+        layer = Image.new('RGBA', mask.size, color)
+        layer.putalpha(mask)
+    return layer
+
+
+def drawText(img, xy, text, fontSize, color, outlineColor=None, outlineWidth=0):
+    """Draw text on given image with top left of the text origin at given position
+
+    Args:
+        img (Image): image to draw on
+        xy (tuple): (x, y) position
+        text (str): text to draw
+        fontSize (int): font size
+        color: fill color of the text
+        outlineColor: optional color of the outline
+        outlineWidth (int): width of the outline in pixels
+    """
+    layer = getTextLayer(text, fontSize, color, outlineColor, outlineWidth)
+    img.paste(layer, (int(xy[0]) - outlineWidth, int(xy[1]) - outlineWidth), layer)
+
+
+def drawRect(imgDraw, x0, y0, x1, y1, width, color):
+    """Draw rectangle outline of given width
+    """
+    imgDraw.rectangle((x0, y0, x1, y1), outline=color, width=width)
+
+
+def drawTimestamp(img, timestamp):
+    """Draw given time in top left corner of image in orange with black outline
+
+    Args:
+        img (Image): image to draw on
+        timestamp (int): time.time() value
+    """
+    timeStr = datetime.datetime.fromtimestamp(timestamp).isoformat()
+    drawText(img, (TIMESTAMP_OUTLINE, TIMESTAMP_OUTLINE), timeStr, TIMESTAMP_FONT_SIZE, 'orange',
+             outlineColor='black', outlineWidth=TIMESTAMP_OUTLINE)
+
+
+def drawWatermark(img):
+    """Draw the watermark in bottom left corner of image
+    """
+    drawText(img, (20, img.size[1] - WATERMARK_FONT_SIZE - 20), WATERMARK_TEXT, WATERMARK_FONT_SIZE, 'orange')
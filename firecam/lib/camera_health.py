@@ -0,0 +1,253 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Track the health of camera feeds (fetch errors, frozen, black/uniform, or
+wrong size images) in the camera_health SQL table, and back off exponentially
+from checking cameras that keep failing so they don't waste sweep time
+
+"""
+
+import logging
+import time
+from PIL import Image, ImageStat
+
+# number of consecutive failures before camera is considered unhealthy
+UNHEALTHY_FAILURES = 3
+# wait time before retrying unhealthy camera doubles with every failure up to the max
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6*60*60
+# camera images unchanged for this long are considered frozen
+FROZEN_SECONDS = 30*60
+# images smaller than one segment cannot be checked for smoke (see rect_to_squares)
+MIN_IMAGE_SIZE = 299
+# standard deviation of pixel values below this indicates black or uniform image
+UNIFORM_STDDEV = 2
+# mean brightness below this at night is just darkness, not a malfunction
+DARK_MEAN = 30
+# seconds between reloads of the health state written by other processes
+REFRESH_SECONDS = 60
+
+
+def getImageStats(imgFile):
+    """Get size, mean brightness, and brightness standard deviation of given image
+
+    Uses JPEG draft mode to decode a 1/8 scale grayscale version of the image,
+    which is much cheaper than a full decode
+
+    Args:
+        imgFile: filepath or file object (e.g. BytesIO) of the image
+
+    Returns:
+        Dictionary with size, mean, and stddev
+    """
+    img = Image.open(imgFile)
+    size = img.size
+    img.draft('L', (int(size[0]/8), int(size[1]/8)))
+    stat = ImageStat.Stat(img.convert('L'))
+    img.close()
+    return {
+        'size': size,
+        'mean': stat.mean[0],
+        'stddev': stat.stddev[0]
+    }
+
+
+def checkImageStats(imgStats):
+    """Check given image stats for signs of malfunctioning camera
+
+    Args:
+        imgStats (dict): result of getImageStats()
+
+    Returns:
+        Failure reason string, or None if image looks valid
+    """
+    if min(imgStats['size']) < MIN_IMAGE_SIZE:
+        return 'resolution %dx%d' % imgStats['size']
+    if imgStats['stddev'] < UNIFORM_STDDEV:
+        return 'uniform image (mean %d)' % imgStats['mean']
+    return None
+
+
+def isDarkNightImage(imgStats, isNight):
+    """Check if given image is just dark because it was taken at night (expected, so not a failure)
+
+    Args:
+        imgStats (dict): result of getImageStats()
+        isNight (bool): whether it is night at the camera
+
+    Returns:
+        True if image is dark at night
+    """
+    return bool(isNight) and (imgStats['mean'] < DARK_MEAN)
+
+
+def getBackoffSeconds(failures):
+    """Get the number of seconds to wait before checking camera with given failures
+
+    Args:
+        failures (int): number of consecutive failures
+
+    Returns:
+        Number of seconds (0 if camera is still considered healthy)
+    """
+    if failures < UNHEALTHY_FAILURES:
+        return 0
+    return min(BACKOFF_BASE_SECONDS * 2**(failures - UNHEALTHY_FAILURES), BACKOFF_MAX_SECONDS)
+
+
+def _getUpdateKey(state):
+    return (max(state['lastSuccess'], state['lastFailure']), state['failures'])
+
+
+class CameraHealth(object):
+    def __init__(self, dbManager):
+        """Tracker for health of all cameras
+
+        Loads the current health state of all cameras from camera_health table.
+        The table is only updated when a camera's state changes, so healthy
+        cameras don't cost any DB writes.  Since the table is shared by all
+        detection processes, the loaded state is refreshed every REFRESH_SECONDS,
+        and a camera's row is re-read before recording another failure.  Processes
+        writing the same camera at the same time may lose a failure count or leave
+        duplicate rows, so the row with the latest update is the one that counts.
+
+        Args:
+            dbManager (DbManager):
+        """
+        self.dbManager = dbManager
+        self.states = {}
+        self.refresh()
+
+
+    def _rowToState(self, row):
+        return {
+            'status': row['status'],
+            'reason': row['reason'] or '',
+            'failures': row['failures'] or 0,
+            'lastSuccess': row['lastsuccess'] or 0,
+            'lastFailure': row['lastfailure'] or 0,
+            'nextCheck': row['nextcheck'] or 0,
+        }
+
+
+    def _latestStates(self, rows):
+        # pick the most recently updated row of every camera (concurrent writers may leave duplicates)
+        states = {}
+        for row in rows:
+            state = self._rowToState(row)
+            latest = states.get(row['cameraname'])
+            if (not latest) or (_getUpdateKey(state) > _getUpdateKey(latest)):
+                states[row['cameraname']] = state
+        return states
+
+
+    def refresh(self):
+        """Reload the health state of all cameras (including changes by other processes)
+        """
+        self.states = self._latestStates(self.dbManager.query('SELECT * FROM camera_health'))
+        self.lastRefresh = time.time()
+
+
+    def _readState(self, cameraID):
+        sqlStr = "SELECT * FROM camera_health WHERE CameraName = '%s'" % cameraID
+        states = self._latestStates(self.dbManager.query(sqlStr))
+        if cameraID in states:
+            self.states[cameraID] = states[cameraID]
+        else:
+            self.states.pop(cameraID, None)
+        return self.states.get(cameraID)
+
+
+    def _writeState(self, cameraID):
+        state = self.states[cameraID]
+        dbRow = {
+            'CameraName': cameraID,
+            'Status': state['status'],
+            'Reason': state['reason'],
+            'Failures': state['failures'],
+            'LastSuccess': state['lastSuccess'],
+            'LastFailure': state['lastFailure'],
+            'NextCheck': state['nextCheck'],
+        }
+        # replace the camera's rows (including any duplicates left by concurrent writers)
+        sqlStr = "DELETE FROM camera_health WHERE CameraName = '%s'" % cameraID
+        self.dbManager.execute(sqlStr, commit=False)
+        self.dbManager.add_data('camera_health', dbRow)
+
+
+    def isDue(self, cameraID, timestamp):
+        """Check if given camera should be checked at given time (i.e. not backing off)
+
+        Args:
+            cameraID (str): camera name
+            timestamp (int): time.time() value for current time
+
+        Returns:
+            True if camera should be checked
+        """
+        if time.time() - self.lastRefresh >= REFRESH_SECONDS:
+            self.refresh()
+        state = self.states.get(cameraID)
+        return (not state) or (timestamp >= state['nextCheck'])
+
+
+    def recordSuccess(self, cameraID, timestamp):
+        """Record that given camera returned a valid new image
+
+        Args:
+            cameraID (str): camera name
+            timestamp (int): time.time() value when image was fetched
+        """
+        state = self.states.get(cameraID)
+        if state and (state['failures'] == 0):
+            return # no change, so skip DB write
+        if state and state['status'] == 'unhealthy':
+            logging.warning('Camera %s recovered after %d failures', cameraID, state['failures'])
+        self.states[cameraID] = {
+            'status': 'healthy',
+            'reason': '',
+            'failures': 0,
+            'lastSuccess': timestamp,
+            'lastFailure': state['lastFailure'] if state else 0,
+            'nextCheck': 0,
+        }
+        self._writeState(cameraID)
+
+
+    def recordFailure(self, cameraID, timestamp, reason):
+        """Record that given camera failed to return a valid image
+
+        Args:
+            cameraID (str): camera name
+            timestamp (int): time.time() value when image was fetched
+            reason (str): description of the failure
+        """
+        state = self._readState(cameraID) # other processes may have recorded failures
+        reason = reason.replace("'", '').replace('"', '')[:200] # safe for SQL string
+        failures = (state['failures'] if state else 0) + 1
+        backoff = getBackoffSeconds(failures)
+        self.states[cameraID] = {
+            'status': 'unhealthy' if backoff else 'failing',
+            'reason': reason,
+            'failures': failures,
+            'lastSuccess': state['lastSuccess'] if state else 0,
+            'lastFailure': timestamp,
+            'nextCheck': timestamp + backoff,
+        }
+        if backoff:
+            logging.warning('Camera %s unhealthy (%d failures, %s).  Next check in %d seconds',
+                            cameraID, failures, reason, backoff)
+        self._writeState(cameraID)
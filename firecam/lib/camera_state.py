@@ -0,0 +1,134 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Persist per-camera runtime state of detection processes (last image hash,
+HTTP validators, night schedule) in a local sqlite file, so restarts don't
+treat the first image from every camera as new
+
+"""
+
+import logging
+import sqlite3
+import threading
+import json
+import time
+
+# camera dict keys that are saved across restarts
+PERSISTED_KEYS = [
+    'md5',
+    'md5Time',
+    'etag',
+    'lastModified',
+    'contentLength',
+    'nextNightScan',
+]
+
+
+class CameraStateStore(object):
+    def __init__(self, stateFile, flushSeconds=10):
+        """Store for runtime state of cameras backed by given sqlite file
+
+        Camera state is loaded lazily the first time each camera is tracked.
+        Changes to tracked camera dicts are written by a background thread
+        every flushSeconds, so the detection loop never waits on disk writes.
+
+        Args:
+            stateFile (str): local file path for the sqlite DB
+            flushSeconds (int): seconds between background flushes
+        """
+        self.stateFile = stateFile
+        self.flushSeconds = flushSeconds
+        self.lock = threading.Lock()
+        self.conn = None
+        self.tracked = {}
+        self.written = {}
+        self.flushThread = None
+
+
+    def _getConn(self):
+        if not self.conn:
+            # connection is shared with flush thread, but all access is serialized by self.lock
+            self.conn = sqlite3.connect(self.stateFile, timeout=30, check_same_thread=False)
+            self.conn.execute('create table if not exists camera_state (CameraName TEXT PRIMARY KEY, State TEXT, Updated INT)')
+            self.conn.commit()
+        return self.conn
+
+
+    def track(self, camera):
+        """Start tracking given camera dict, loading its saved state on first call
+
+        Args:
+            camera (dict): camera information (keyed by 'name')
+        """
+        cameraID = camera['name']
+        if self.tracked.get(cameraID) is camera:
+            return
+        with self.lock:
+            cursor = self._getConn().execute('SELECT State FROM camera_state WHERE CameraName = ?', (cameraID,))
+            row = cursor.fetchone()
+            cursor.close()
+            state = json.loads(row[0]) if row else {}
+            for (key, val) in state.items():
+                camera.setdefault(key, val)
+            self.tracked[cameraID] = camera
+            self.written[cameraID] = state
+        if not self.flushThread:
+            self.flushThread = threading.Thread(target=self._flushLoop, daemon=True)
+            self.flushThread.start()
+
+
+    def untrack(self, cameraID):
+        """Stop tracking given camera (e.g. because it was removed)
+
+        Args:
+            cameraID (str): camera name
+        """
+        with self.lock:
+            self.tracked.pop(cameraID, None)
+            self.written.pop(cameraID, None)
+
+
+    def flush(self):
+        """Write state of all tracked cameras that changed since last flush
+        """
+        with self.lock:
+            changed = []
+            for (cameraID, camera) in list(self.tracked.items()):
+                state = {}
+                for key in PERSISTED_KEYS:
+                    val = camera.get(key)
+                    if val != None:
+                        state[key] = val
+                if state != self.written.get(cameraID):
+                    changed.append((cameraID, state))
+            if not changed:
+                return
+            timeNow = int(time.time())
+            conn = self._getConn()
+            conn.executemany('INSERT OR REPLACE INTO camera_state (CameraName, State, Updated) VALUES (?, ?, ?)',
+                             [(cameraID, json.dumps(state), timeNow) for (cameraID, state) in changed])
+            conn.commit()
+            for (cameraID, state) in changed:
+                self.written[cameraID] = state
+
+
+    def _flushLoop(self):
+        while True:
+            time.sleep(self.flushSeconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error('Error saving camera state to %s: %s', self.stateFile, str(e))
@@ -176,6 +176,38 @@ class DbManager(object):
             ('PhoneEndTime', 'INT'),
         ]
 
+        # health of camera feeds as tracked by detection processes
+        camera_health_schema = [
+            ('CameraName', 'TEXT'),
+            ('Status', 'TEXT'),
+            ('Reason', 'TEXT'),
+            ('Failures', 'INT'),
+            ('LastSuccess', 'INT'),
+            ('LastFailure', 'INT'),
+            ('NextCheck', 'INT'),
+        ]
+
+        # timings of each alert channel to measure end-to-end latency from image capture
+        alert_timings_schema = [
+            ('CameraName', 'TEXT'),
+            ('Timestamp', 'INT'),
+            ('Channel', 'TEXT'),
+            ('CaptureTime', 'REAL'),
+            ('CaptureSource', 'TEXT'),
+            ('FetchTime', 'REAL'),
+            ('DetectTime', 'REAL'),
+            ('CompletedTime', 'REAL'),
+        ]
+
+        # detection workers sharing the cameras (see sharding.py)
+        workers_schema = [
+            ('WorkerID', 'TEXT'),
+            ('Hostname', 'TEXT'),
+            ('Pid', 'INT'),
+            ('StartTime', 'INT'),
+            ('Heartbeat', 'INT'),
+        ]
+
         self.tables = {
             'sources': sources_schema,
             'counters': counters_schema,
@@ -186,6 +218,9 @@ class DbManager(object):
             'detections': detections_schema,
             'alerts': alerts_schema,
             'notifications': notifications_schema,
+            'camera_health': camera_health_schema,
+            'alert_timings': alert_timings_schema,
+            'workers': workers_schema,
         }
 
         self.sources_table_name = 'sources'
@@ -318,6 +353,22 @@ class DbManager(object):
         return self.query(sqlStr)
 
 
+    def getCameraLocations(self):
+        """Get the latitude and longitude of every camera ID listed in cameras table
+
+        Returns:
+            Dictionary mapping camera ID to (latitude, longitude) tuple
+        """
+        sqlStr = "SELECT cameraIDs, Latitude, Longitude FROM cameras"
+        locations = {}
+        for row in self.query(sqlStr):
+            if not row['cameraids'] or (row['latitude'] == None) or (row['longitude'] == None):
+                continue
+            for cameraID in row['cameraids'].split(','):
+                locations[cameraID.strip()] = (row['latitude'], row['longitude'])
+        return locations
+
+
     def add_url(self, url, urlname):
         date = datetime.datetime.utcnow().isoformat()
         self.add_data('sources', {'name': urlname, 'url': url, 'last_date': date})
@@ -390,6 +441,27 @@ class DbManager(object):
         return self.incrementCounter('sources')
 
 
+    def getConfigVersion(self):
+        """Get the version of the camera configuration, which is incremented whenever cameras are changed
+
+        Returns:
+            version number (0 if never changed)
+        """
+        dbResult = self.query("SELECT counter FROM counters WHERE name = 'config_version'")
+        return dbResult[0]['counter'] if dbResult else 0
+
+
+    def bumpConfigVersion(self):
+        """Increment the camera configuration version so detection processes reload cameras
+
+        Returns:
+            new version number
+        """
+        if not self.query("SELECT counter FROM counters WHERE name = 'config_version'"):
+            self.add_data('counters', {'name': 'config_version', 'counter': 0})
+        return self.incrementCounter('config_version') + 1
+
+
     def getNotifications(self, filterActiveEmail = False, filterActivePhone = False):
         """Get all the notifications matching optinal active email and phone filters
 
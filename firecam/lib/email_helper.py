@@ -72,7 +72,7 @@ def createMimeMsg(fromAddr, toAddrs, bccAddrs, subject, body):
     return msg
 
 
-def sendEmail(mailService, toAddrs, bccAddrs, subject, body, attachments=[]):
+def sendEmail(mailService, toAddrs, bccAddrs, subject, body, attachments=[], retries=5, retrySeconds=5):
     """Send an email using GMail API and oauth2 service authentication
        to given visible and bcc recepients with given subject,body, and attachments
 
@@ -83,6 +83,11 @@ def sendEmail(mailService, toAddrs, bccAddrs, subject, body, attachments=[]):
         subject (str): subject of the email
         body (str): body of the email
         attachments (list): optional list of attachements files
+        retries (int): number of attempts before giving up
+        retrySeconds (int): seconds to wait between attempts
+
+    Returns:
+        Gmail API result (None if all attempts failed)
     """
     if isinstance(toAddrs, str):
         toAddrs = [toAddrs]
@@ -92,7 +97,7 @@ def sendEmail(mailService, toAddrs, bccAddrs, subject, body, attachments=[]):
     msg = createMimeMsg('me', toAddrs, bccAddrs, subject, body)
     addAttachments(msg, attachments)
 
-    retriesLeft = 5
+    retriesLeft = retries
     while retriesLeft > 0:
         retriesLeft -= 1
         try:
@@ -100,11 +105,11 @@ def sendEmail(mailService, toAddrs, bccAddrs, subject, body, attachments=[]):
             # succeed using the simple method
             media = MediaIoBaseUpload(BytesIO(msg.as_bytes()), mimetype='message/rfc822', resumable=True)
             result = mailService.users().messages().send(userId='me', body={}, media_body=media).execute()
-            return
+            return result
         except Exception as e:
             logging.error('Error sending email. %d retries left. %s', retriesLeft, str(e))
             if retriesLeft > 0:
-                time.sleep(5) # wait 5 seconds before retrying
+                time.sleep(retrySeconds)
     logging.error('Too many email send failures')
 
 
@@ -27,6 +27,9 @@ import pathlib
 import logging
 import time, datetime, dateutil.parser
 import json
+import threading
+import collections
+import concurrent.futures
 
 from googleapiclient.discovery import build
 from httplib2 import Http
@@ -379,23 +382,71 @@ def copyFile(srcFilePath, destDir):
     return destPath
 
 
+class FilePublisher(object):
+    def __init__(self, filePath):
+        """Local stand-in for pubsub PublisherClient that appends messages to a file.
+           Useful for testing and benchmarking without GCP
+
+        Args:
+            filePath (str): local file path for the messages (one JSON per line)
+        """
+        self.filePath = filePath
+        self.lock = threading.Lock()
+        self.numPublished = 0
+
+    def topic_path(self, project, topic):
+        return 'projects/%s/topics/%s' % (project, topic)
+
+    def publish(self, topicPath, data):
+        future = concurrent.futures.Future()
+        try:
+            with self.lock:
+                with open(self.filePath, 'a') as f:
+                    f.write(json.dumps({'topic': topicPath, 'time': time.time(), 'data': data.decode('utf-8')}) + '\n')
+                self.numPublished += 1
+                future.set_result(str(self.numPublished))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
 def getPubsubClient():
     """Get an authenticated GCP pubsub client (caches result for performance)
 
+    Uses client side batching per optional settings pubsubBatchMaxMessages and
+    pubsubBatchMaxLatency.  If settings.pubsubFile is set, returns a FilePublisher
+    writing to that file instead.
+
     Returns:
         Authenticated GCP pubsub client
     """
     if getPubsubClient.cachedClient:
         return getPubsubClient.cachedClient
-    if settings.gcpServiceKey:
-        pubsubClient = pubsub_v1.PublisherClient.from_service_account_json(settings.gcpServiceKey)
+    if getattr(settings, 'pubsubFile', None):
+        pubsubClient = FilePublisher(settings.pubsubFile)
     else:
-        pubsubClient = pubsub_v1.PublisherClient()
+        batchSettings = pubsub_v1.types.BatchSettings(
+            max_messages=getattr(settings, 'pubsubBatchMaxMessages', 100),
+            max_latency=getattr(settings, 'pubsubBatchMaxLatency', 0.05), # seconds
+        )
+        if settings.gcpServiceKey:
+            pubsubClient = pubsub_v1.PublisherClient.from_service_account_json(settings.gcpServiceKey, batch_settings=batchSettings)
+        else:
+            pubsubClient = pubsub_v1.PublisherClient(batch_settings=batchSettings)
     getPubsubClient.cachedClient = pubsubClient
     return pubsubClient
 getPubsubClient.cachedClient = None
 
 
+def getPubsubTopicPath():
+    """Get the full path of settings.pubsubTopic (cached)
+    """
+    if not getPubsubTopicPath.cachedPath:
+        getPubsubTopicPath.cachedPath = getPubsubClient().topic_path(settings.gcpProject, settings.pubsubTopic)
+    return getPubsubTopicPath.cachedPath
+getPubsubTopicPath.cachedPath = None
+
+
 def publish(data):
     """Publish given data wrapped as JSON on GCP pubsub topic
 
@@ -409,6 +460,168 @@ def publish(data):
         return
 
     pubsubClient = getPubsubClient()
-    topic_path = pubsubClient.topic_path(settings.gcpProject, settings.pubsubTopic)
-    future = pubsubClient.publish(topic_path, json.dumps(data).encode('utf-8'))
+    future = pubsubClient.publish(getPubsubTopicPath(), json.dumps(data).encode('utf-8'))
     return future.result()
+
+
+class AsyncPublisher(object):
+    def __init__(self, pubsubClient, topicPath, maxInFlight=100, retrySeconds=30, maxFailed=1000):
+        """Non-blocking publisher.  Messages are sent in the background (batched by the client),
+           and messages that fail are retried every retrySeconds by a daemon thread
+
+        Args:
+            pubsubClient: PublisherClient or FilePublisher
+            topicPath (str): full path of the topic
+            maxInFlight (int): publish() blocks when this many messages are unacknowledged
+            retrySeconds (int): minimum seconds between retries of failed messages
+            maxFailed (int): maximum number of failed messages kept for retry
+        """
+        self.pubsubClient = pubsubClient
+        self.topicPath = topicPath
+        self.retrySeconds = retrySeconds
+        self.inFlight = threading.BoundedSemaphore(maxInFlight)
+        self.maxInFlight = maxInFlight
+        self.lock = threading.Lock()
+        self.failed = collections.deque(maxlen=maxFailed)
+        self.numPublished = 0
+        self.retryThread = None
+        self.stopped = threading.Event()
+
+
+    def publish(self, data):
+        """Publish given data wrapped as JSON without waiting for the result
+
+        Args:
+            data (dict): message data
+
+        Returns:
+            Future that completes once the message is delivered (including retries),
+            or fails if the message is dropped
+        """
+        delivered = concurrent.futures.Future()
+        self._publishBytes(json.dumps(data).encode('utf-8'), delivered)
+        return delivered
+
+
+    def _publishBytes(self, msgBytes, delivered):
+        self.inFlight.acquire()
+        try:
+            future = self.pubsubClient.publish(self.topicPath, msgBytes)
+        except Exception as e:
+            self.inFlight.release()
+            self._recordFailure(msgBytes, delivered, e)
+            return
+        future.add_done_callback(lambda x: self._onDone(x, msgBytes, delivered))
+
+
+    def _onDone(self, future, msgBytes, delivered):
+        self.inFlight.release()
+        error = future.exception()
+        if error:
+            self._recordFailure(msgBytes, delivered, error)
+        else:
+            with self.lock:
+                self.numPublished += 1
+            delivered.set_result(True)
+
+
+    def _recordFailure(self, msgBytes, delivered, error):
+        logging.error('Error publishing to %s: %s', self.topicPath, str(error))
+        with self.lock:
+            if len(self.failed) == self.failed.maxlen:
+                self.failed[0][1].set_exception(Exception('Too many failed pubsub messages'))
+            self.failed.append((msgBytes, delivered))
+            if not self.retryThread:
+                self.retryThread = threading.Thread(target=self._retryLoop, daemon=True)
+                self.retryThread.start()
+
+
+    def _retryLoop(self):
+        while not self.stopped.wait(self.retrySeconds):
+            if self.failed:
+                self.retryFailed()
+
+
+    def retryFailed(self):
+        """Republish all messages that previously failed
+        """
+        with self.lock:
+            retries = list(self.failed)
+            self.failed.clear()
+        if retries:
+            logging.warning('Retrying %d failed pubsub messages', len(retries))
+        for (msgBytes, delivered) in retries:
+            self._publishBytes(msgBytes, delivered)
+
+
+    def flush(self, timeout=60):
+        """Wait until all in flight messages are acknowledged
+
+        Args:
+            timeout (int): maximum seconds to wait
+
+        Returns:
+            True if all messages completed (successfully or not)
+        """
+        deadline = time.time() + timeout
+        acquired = 0
+        while acquired < self.maxInFlight:
+            if not self.inFlight.acquire(timeout=max(deadline - time.time(), 0)):
+                break
+            acquired += 1
+        for i in range(acquired):
+            self.inFlight.release()
+        return acquired == self.maxInFlight
+
+
+    def close(self, timeout=60):
+        """Stop background retries, then wait for in flight messages and retry failed ones a final time
+
+        Args:
+            timeout (int): maximum seconds to wait for each round of messages
+        """
+        self.stopped.set()
+        self.flush(timeout)
+        if self.failed:
+            self.retryFailed()
+            self.flush(timeout)
+        if self.failed:
+            logging.error('Dropping %d failed pubsub messages', len(self.failed))
+            for (msgBytes, delivered) in self.failed:
+                delivered.set_exception(Exception('Failed pubsub message dropped at shutdown'))
+
+
+def getAsyncPublisher():
+    """Get the shared AsyncPublisher for settings.pubsubTopic (None if no topic is configured)
+
+    The in flight window is configurable via optional settings.pubsubMaxInFlight
+    """
+    if not settings.pubsubTopic:
+        return None
+    if not getAsyncPublisher.cachedPublisher:
+        getAsyncPublisher.cachedPublisher = AsyncPublisher(getPubsubClient(), getPubsubTopicPath(),
+                                                           getattr(settings, 'pubsubMaxInFlight', 100))
+    return getAsyncPublisher.cachedPublisher
+getAsyncPublisher.cachedPublisher = None
+
+
+def closeAsyncPublisher():
+    """Deliver the pending messages of the shared AsyncPublisher (e.g., at shutdown)
+    """
+    if getAsyncPublisher.cachedPublisher:
+        getAsyncPublisher.cachedPublisher.close()
+
+
+def publishAsync(data):
+    """Publish given data wrapped as JSON on GCP pubsub topic without blocking
+
+    Args:
+        data (dict): message data
+
+    Returns:
+        Future that completes once the message is delivered (None if no topic is configured)
+    """
+    publisher = getAsyncPublisher()
+    if not publisher:
+        return None
+    return publisher.publish(data)
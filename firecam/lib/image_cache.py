@@ -0,0 +1,156 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Local disk cache of archive images keyed by camera ID and image time, shared
+by all tools and processes on the machine.  Files are written atomically, and
+the least recently used images are deleted once the cache exceeds its size cap.
+
+"""
+
+import os
+import logging
+import threading
+import shutil
+
+# cache is trimmed to this fraction of its cap when it gets too big
+LOW_WATER_FRACTION = 0.9
+
+
+class ImageCache(object):
+    def __init__(self, cacheDir, maxBytes, fileExt='.jpg'):
+        """Cache of images in given directory
+
+        Args:
+            cacheDir (str): local directory for cached images
+            maxBytes (int): maximum total size of the cached images
+            fileExt (str): extension of the cached files (e.g. '.mp4' for videos)
+        """
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.fileExt = fileExt
+        self.lock = threading.Lock()
+        self.totalBytes = None # computed on first write
+
+
+    def getPath(self, cameraID, unixTime):
+        return os.path.join(self.cacheDir, cameraID, '%d%s' % (unixTime, self.fileExt))
+
+
+    def get(self, cameraID, unixTime):
+        """Get the path of the cached image (marking it as recently used)
+
+        Args:
+            cameraID (str): ID of camera
+            unixTime (int): timestamp of image
+
+        Returns:
+            Local file path of the cached image, or None if not cached
+        """
+        cachePath = self.getPath(cameraID, unixTime)
+        try:
+            os.utime(cachePath)
+        except OSError:
+            return None
+        return cachePath
+
+
+    def put(self, cameraID, unixTime, fetchFunc):
+        """Fetch the image into the cache, unless already cached
+
+        Args:
+            cameraID (str): ID of camera
+            unixTime (int): timestamp of image
+            fetchFunc: function(filePath) that writes the image to given path
+                       and returns False if the image could not be fetched
+
+        Returns:
+            Local file path of the cached image, or None if fetch failed
+        """
+        cachePath = self.get(cameraID, unixTime)
+        if cachePath:
+            return cachePath
+        cachePath = self.getPath(cameraID, unixTime)
+        os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+        tmpPath = '%s.%d.%d.tmp' % (cachePath, os.getpid(), threading.get_ident())
+        try:
+            if fetchFunc(tmpPath) == False:
+                return None
+            os.replace(tmpPath, cachePath)
+        finally:
+            if os.path.isfile(tmpPath):
+                os.remove(tmpPath)
+        self._addBytes(os.path.getsize(cachePath))
+        return cachePath
+
+
+    def copyTo(self, cameraID, unixTime, fetchFunc, destPath):
+        """Copy the cached image (fetching it first if needed) to given path
+
+        Args:
+            cameraID (str): ID of camera
+            unixTime (int): timestamp of image
+            fetchFunc: see put()
+            destPath (str): local file path for the copy
+
+        Returns:
+            destPath, or None if fetch failed
+        """
+        cachePath = self.put(cameraID, unixTime, fetchFunc)
+        if not cachePath:
+            return None
+        shutil.copyfile(cachePath, destPath)
+        return destPath
+
+
+    def _listFiles(self):
+        entries = []
+        for (dirPath, dirNames, fileNames) in os.walk(self.cacheDir):
+            for fileName in fileNames:
+                if not fileName.endswith(self.fileExt):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirPath, fileName))
+                except OSError:
+                    continue # deleted by another process
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(dirPath, fileName)))
+        return entries
+
+
+    def _addBytes(self, numBytes):
+        with self.lock:
+            if self.totalBytes == None:
+                self.totalBytes = sum(map(lambda x: x[1], self._listFiles()))
+            else:
+                self.totalBytes += numBytes
+            if self.totalBytes > self.maxBytes:
+                self._evict()
+
+
+    def _evict(self):
+        # rescan since other processes may share the cache directory
+        entries = sorted(self._listFiles())
+        self.totalBytes = sum(map(lambda x: x[1], entries))
+        numRemoved = 0
+        for (mtime, size, filePath) in entries:
+            if self.totalBytes <= self.maxBytes * LOW_WATER_FRACTION:
+                break
+            try:
+                os.remove(filePath)
+            except OSError:
+                continue
+            self.totalBytes -= size
+            numRemoved += 1
+        logging.warning('Evicted %d images from cache %s', numRemoved, self.cacheDir)
@@ -19,15 +19,53 @@ Library code to manage image archives
 """
 
 from firecam.lib import goog_helper
+from firecam.lib import image_cache
 
 import os
 import logging
 import urllib.request
+import urllib.error
 import time, datetime, dateutil.parser
 from html.parser import HTMLParser
 import requests
+import requests.adapters
+import urllib3.util.retry
+import urllib.parse
+import threading
+import concurrent.futures
 import re
-from PIL import Image, ImageMath
+import tempfile
+import shutil
+import subprocess
+import hashlib
+import json
+import bisect
+import array
+import collections
+import numpy as np
+from PIL import Image
+
+# local directory for cached HPWREN directory listings (None disables the cache)
+listingCacheDir = os.path.join(tempfile.gettempdir(), 'firecam_hpwren_listings')
+# seconds before cached listings are refetched. Listings of past days don't change,
+# but today's directories get new files all the time (yesterday's too around midnight)
+LISTING_TTL_PAST = 30*24*60*60
+LISTING_TTL_RECENT = 5*60
+# downloaded archive images shared by all tools (None disables the cache)
+imageCache = image_cache.ImageCache(os.path.join(tempfile.gettempdir(), 'firecam_image_cache'), 2*1024*1024*1024)
+# number of parallel image downloads, and limit of concurrent requests to each HPWREN server
+DOWNLOAD_WORKERS = 8
+MAX_REQUESTS_PER_HOST = 4
+# retries (with exponential backoff) of failed requests
+DOWNLOAD_RETRIES = 3
+# Q MP4 videos for local frame extraction (which is only done when ffmpeg is installed,
+# otherwise the ffmpeg Google Cloud Function is used)
+mp4Cache = image_cache.ImageCache(os.path.join(tempfile.gettempdir(), 'firecam_mp4_cache'), 4*1024*1024*1024, fileExt='.mp4')
+ffmpegPath = shutil.which('ffmpeg')
+# Q MP4 videos have one frame per minute of their 3 hour period
+MP4_FRAMES_PER_Q = 3*60
+# time ranges are fetched in chunks of at most this many minutes (and never across days)
+CHUNK_MINUTES = 60
 
 
 def getImgPath(outputDir, cameraID, timestamp, cropCoords=None, diffMinutes=0):
@@ -55,6 +93,18 @@ def getImgPath(outputDir, cameraID, timestamp, cropCoords=None, diffMinutes=0):
     return imgPath
 
 
+def saveImageData(imgPath, imgData):
+    """Write the given in-memory image data to given filepath if not already there
+
+    Args:
+        imgPath (str): filepath of the image
+        imgData (bytes): image data (None if image was never in memory)
+    """
+    if imgData and not os.path.isfile(imgPath):
+        with open(imgPath, 'wb') as f:
+            f.write(imgData)
+
+
 def repackFileName(parsedName):
     """Generate properly formatted image filename following Firecam conventions
        based on information from parsedName dictionary
@@ -187,10 +237,15 @@ def fetchImgOrDir(url, verboseLogs):
         verboseLogs (bool): Write verbose logs for debugging
 
     Returns:
-        Tuple indicating image or directory and the data
+        Tuple indicating image or directory and the data.  On failure, tuple of None
+        and the HTTP error code (None for other errors such as timeouts)
     """
     try:
         resp = urllib.request.urlopen(url)
+    except urllib.error.HTTPError as e:
+        if verboseLogs:
+            logging.error('Result of fetch from %s: %s', url, str(e))
+        return (None, e.code)
     except Exception as e:
         if verboseLogs:
             logging.error('Result of fetch from %s: %s', url, str(e))
@@ -201,9 +256,86 @@ def fetchImgOrDir(url, verboseLogs):
         return ('dir', resp)
 
 
+def getListingTtl(url):
+    """Get the number of seconds the listing of given directory URL can be cached
+
+    Args:
+        url (str): HPWREN directory URL
+
+    Returns:
+        TTL in seconds (long for directories of days before yesterday)
+    """
+    match = re.search(r'/(\d{8})(/|$)', url)
+    if match:
+        try:
+            dirDate = datetime.datetime.strptime(match.group(1), '%Y%m%d').date()
+        except ValueError:
+            return LISTING_TTL_RECENT
+        if dirDate < datetime.date.today() - datetime.timedelta(days=1):
+            return LISTING_TTL_PAST
+    return LISTING_TTL_RECENT
+
+
+def getListingCachePath(url, fileType):
+    """Get the local file path for the cached listing of given URL
+    """
+    urlHash = hashlib.md5((url + ' ' + fileType).encode('utf-8')).hexdigest()
+    return os.path.join(listingCacheDir, urlHash + '.json')
+
+
+def readListingCache(url, fileType):
+    """Read the cached listing of given directory URL if it has not expired
+
+    Args:
+        url (str): HPWREN directory URL
+        fileType (str): File extension (e.g.: '.jpg')
+
+    Returns:
+        Dictionary with list of files (or None for failed fetch), or None if not cached
+    """
+    if not listingCacheDir:
+        return None
+    cachePath = getListingCachePath(url, fileType)
+    try:
+        if time.time() - os.path.getmtime(cachePath) > getListingTtl(url):
+            return None
+        with open(cachePath, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('url') != url:
+        return None
+    return cached
+
+
+def writeListingCache(url, fileType, files):
+    """Save the listing of given directory URL in the cache (atomically)
+
+    Args:
+        url (str): HPWREN directory URL
+        fileType (str): File extension (e.g.: '.jpg')
+        files (list): file names in the directory (None if fetch failed)
+    """
+    if not listingCacheDir:
+        return
+    cachePath = getListingCachePath(url, fileType)
+    tmpPath = '%s.%d.tmp' % (cachePath, os.getpid())
+    try:
+        os.makedirs(listingCacheDir, exist_ok=True)
+        with open(tmpPath, 'w') as f:
+            json.dump({'url': url, 'files': files}, f)
+        os.replace(tmpPath, cachePath)
+    except OSError as e:
+        logging.error('Error caching listing of %s: %s', url, str(e))
+
+
 def readUrlDir(urlPartsQ, verboseLogs, fileType):
     """Get the files of given fileType from the given HPWREN Q directory URL
 
+    Listings are cached on local disk (see listingCacheDir).  Directories of past
+    days that don't exist (HTTP 404, e.g. when checking for year directories) are
+    cached too, but other failures (timeouts, server errors) are not cached.
+
     Args:
         urlPartsQ (list): HPWREN Q directory URL as list of string parts
         verboseLogs (bool): Write verbose logs for debugging
@@ -215,12 +347,19 @@ def readUrlDir(urlPartsQ, verboseLogs, fileType):
     # logging.warning('Dir URLparts %s', urlPartsQ)
     url = '/'.join(urlPartsQ)
     # logging.warning('Dir URL %s', url)
+    cached = readListingCache(url, fileType)
+    if cached:
+        return cached['files']
     (imgOrDir, resp) = fetchImgOrDir(url, verboseLogs)
     if not imgOrDir:
+        if (resp == 404) and (getListingTtl(url) == LISTING_TTL_PAST):
+            writeListingCache(url, fileType, None)
         return None
     assert imgOrDir == 'dir'
     dirHtml = resp.read().decode('utf-8')
-    return parseDirHtml(dirHtml, fileType)
+    files = parseDirHtml(dirHtml, fileType)
+    writeListingCache(url, fileType, files)
+    return files
 
 
 def listTimesinQ(urlPartsQ, verboseLogs):
@@ -231,17 +370,94 @@ def listTimesinQ(urlPartsQ, verboseLogs):
         verboseLogs (bool): Write verbose logs for debugging
 
     Returns:
-        List of timestamps
+        List of timestamps sorted by time
     """
     files = readUrlDir(urlPartsQ, verboseLogs, '.jpg')
     if files:
-        return list(map(lambda x: {'time': int(x[:-4])}, files))
+        return sorted(map(lambda x: {'time': int(x[:-4])}, files), key=lambda x: x['time'])
     return None
 
 
+def getClosestIndex(sortedTimes, desiredTime):
+    """Find the index of the time closest to desired time using binary search
+
+    Args:
+        sortedTimes (array): sorted timestamps
+        desiredTime (float): desired timestamp
+
+    Returns:
+        Index into sortedTimes (earlier time wins ties)
+    """
+    index = bisect.bisect_left(sortedTimes, desiredTime)
+    if index == 0:
+        return 0
+    if index == len(sortedTimes):
+        return index - 1
+    if sortedTimes[index] - desiredTime < desiredTime - sortedTimes[index - 1]:
+        return index
+    return index - 1
+
+
+def getHttpSession():
+    """Get the HTTP session shared by all downloads (pooled connections with retries)
+
+    Returns:
+        requests.Session object
+    """
+    if not getHttpSession.session:
+        retries = urllib3.util.retry.Retry(total=DOWNLOAD_RETRIES, backoff_factor=1,
+                                           status_forcelist=[429, 500, 502, 503, 504])
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=DOWNLOAD_WORKERS, max_retries=retries)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        getHttpSession.session = session
+    return getHttpSession.session
+getHttpSession.session = None
+
+
+def getHostSemaphore(url):
+    """Get the semaphore limiting concurrent requests to the host of given URL
+
+    Args:
+        url (str): URL
+
+    Returns:
+        threading.BoundedSemaphore object
+    """
+    host = urllib.parse.urlparse(url).netloc
+    with getHostSemaphore.lock:
+        if host not in getHostSemaphore.semaphores:
+            getHostSemaphore.semaphores[host] = threading.BoundedSemaphore(MAX_REQUESTS_PER_HOST)
+        return getHostSemaphore.semaphores[host]
+getHostSemaphore.lock = threading.Lock()
+getHostSemaphore.semaphores = {}
+
+
+def fetchFromCache(cameraID, unixTime, fetchFunc, imgPath):
+    """Fetch image through the shared image cache (if enabled) into given path
+
+    Args:
+        cameraID (str): ID of camera
+        unixTime (int): timestamp of image
+        fetchFunc: function(filePath) downloading the image (returns False on failure)
+        imgPath (str): local file path for the image
+
+    Returns:
+        imgPath, or None if download failed
+    """
+    if imageCache:
+        return imageCache.copyTo(cameraID, unixTime, fetchFunc, imgPath)
+    if fetchFunc(imgPath) == False:
+        return None
+    return imgPath
+
+
 def downloadHttpFileAtTime(outputDir, urlPartsQ, cameraID, closestTime, verboseLogs):
     """Download HPWREN image from given HPWREN Q directory URL at given time
 
+    Images are downloaded through the shared image cache
+
     Args:
         outputDir (str): Output directory path
         urlPartsQ (list): HPWREN Q directory URL as list of string parts
@@ -266,19 +482,27 @@ def downloadHttpFileAtTime(outputDir, urlPartsQ, cameraID, closestTime, verboseL
     url = '/'.join(urlParts)
     logging.warning('File URL %s', url)
 
-    # urllib.request.urlretrieve(url, imgPath)
-    resp = requests.get(url, stream=True)
-    with open(imgPath, 'wb') as f:
-        for chunk in resp.iter_content(chunk_size=8192):
-            if chunk: # filter out keep-alive new chunks
-                f.write(chunk)
-    resp.close()
-    return imgPath
+    def fetchFunc(filePath):
+        # urllib.request.urlretrieve(url, imgPath)
+        with getHostSemaphore(url):
+            resp = getHttpSession().get(url, stream=True)
+            if resp.status_code != 200:
+                logging.error('Error %d fetching %s', resp.status_code, url)
+                resp.close()
+                return False
+            with open(filePath, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=8192):
+                    if chunk: # filter out keep-alive new chunks
+                        f.write(chunk)
+            resp.close()
+    return fetchFromCache(cameraID, closestTime, fetchFunc, imgPath)
 
 
 def downloadGCSFileAtTime(outputDir, closestEntry):
     """Download HPWREN image from GCS folder from ffmpeg Google Cloud Function
 
+    Images are downloaded through the shared image cache
+
     Args:
         outputDir (str): Output directory path
         closestEntry (dict): Desired timestamp and GCS file
@@ -293,8 +517,9 @@ def downloadGCSFileAtTime(outputDir, closestEntry):
         return imgPath
 
     parsedPath = goog_helper.parseGCSPath(closestEntry['id'])
-    goog_helper.downloadBucketFile(parsedPath['bucket'], parsedPath['name'], imgPath)
-    return imgPath
+    fetchFunc = lambda filePath: goog_helper.downloadBucketFile(parsedPath['bucket'], parsedPath['name'], filePath)
+    cameraID = parseFilename(closestEntry['name'])['cameraID']
+    return fetchFromCache(cameraID, closestEntry['time'], fetchFunc, imgPath)
 
 
 def getMp4Url(urlPartsDate, qNum, verboseLogs):
@@ -384,11 +609,175 @@ def getGCSMp4(googleServices, settings, hpwrenSource, qNum):
     return imgTimes
 
 
+def runDownloads(downloads, verboseLogs):
+    """Run the given downloads in parallel
+
+    Failed downloads are logged and skipped, so callers get partial results.  Rerunning
+    the same downloads later only fetches the missing images (see imageCache).
+
+    Args:
+        downloads (list): list of (closestTime, download function) tuples.  Functions
+                          for the same closestTime are only run once
+        verboseLogs (bool): Write verbose logs for debugging
+
+    Returns:
+        List of local filesystem paths to downloaded images in order of given downloads
+    """
+    def runDownload(closestTime, downloadFunc):
+        try:
+            downloaded = downloadFunc()
+        except Exception as e:
+            logging.error('Error downloading image for time %s: %s', str(datetime.datetime.fromtimestamp(closestTime)), str(e))
+            return None
+        if downloaded and verboseLogs:
+            logging.warning('Successful download for time %s', str(datetime.datetime.fromtimestamp(closestTime)))
+        return downloaded
+
+    futures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        for (closestTime, downloadFunc) in downloads:
+            if closestTime not in futures:
+                futures[closestTime] = executor.submit(runDownload, closestTime, downloadFunc)
+    downloaded_files = []
+    for (closestTime, downloadFunc) in downloads:
+        downloaded = futures[closestTime].result()
+        if downloaded:
+            downloaded_files.append(downloaded)
+    return downloaded_files
+
+
+def getQStartTime(dateDT, qNum):
+    """Get the timestamp of the start of given Q on given date
+
+    Args:
+        dateDT (datetime): any time on the date
+        qNum (int): Q number (1-8) where each Q represents 3 hour period
+
+    Returns:
+        Timestamp (time.time() value)
+    """
+    qStartDT = dateDT.replace(hour=(qNum-1)*3, minute=0, second=0, microsecond=0)
+    return int(time.mktime(qStartDT.timetuple()))
+
+
+def getMp4FrameRate(mp4Path):
+    """Get the frame rate of given MP4 video from the stream info printed by ffmpeg
+
+    Args:
+        mp4Path (str): local file path of MP4 video
+
+    Returns:
+        Frames per second (float), or None if it could not be determined
+    """
+    result = subprocess.run([ffmpegPath or 'ffmpeg', '-hide_banner', '-i', mp4Path],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    match = re.search(r'Video:.* ([\d.]+) fps', result.stderr.decode('utf-8', 'replace'))
+    return float(match.group(1)) if match else None
+
+
+def extractMp4Frames(mp4Path, frameIndexes, outputDir):
+    """Extract the given frames from MP4 video as jpeg files with one run of ffmpeg
+
+    The video is opened once per frame with input seeking (-ss before -i), so
+    ffmpeg only decodes from the keyframe preceding each requested frame rather
+    than every frame from the start of the video.  If the frame rate cannot be
+    determined, falls back to selecting the frames by number, which decodes all
+    frames up to the last requested one.
+
+    Args:
+        mp4Path (str): local file path of MP4 video
+        frameIndexes (list): frame numbers (0 based)
+        outputDir (str): local directory for the jpeg files
+
+    Returns:
+        Dictionary mapping frame index to local file path (missing frames are skipped)
+    """
+    frameIndexes = sorted(set(frameIndexes))
+    outputSpec = os.path.join(outputDir, 'frame-%04d.jpg')
+    cmd = [ffmpegPath or 'ffmpeg', '-loglevel', 'error']
+    fps = getMp4FrameRate(mp4Path)
+    if fps:
+        # seek half a frame early, since accurate seeking returns the first frame at or after the given time
+        for frameIndex in frameIndexes:
+            cmd += ['-ss', '%.3f' % max((frameIndex - 0.5) / fps, 0), '-i', mp4Path]
+        for i in range(len(frameIndexes)):
+            cmd += ['-map', '%d:v' % i, '-frames:v', '1', '-qscale:v', '2', outputSpec % (i + 1)]
+    else:
+        selectExpr = '+'.join(map(lambda x: 'eq(n,%d)' % x, frameIndexes))
+        cmd += ['-i', mp4Path, '-vf', "select='%s'" % selectExpr,
+                '-vsync', 'vfr', '-frames:v', str(len(frameIndexes)), '-qscale:v', '2', outputSpec]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+    frames = {}
+    for (i, frameIndex) in enumerate(frameIndexes):
+        framePath = outputSpec % (i + 1)
+        if os.path.isfile(framePath):
+            frames[frameIndex] = framePath
+    return frames
+
+
+def getMp4Frames(outputDir, cameraID, mp4Url, qStartTime, frameTimes):
+    """Get the images at given times from the Q MP4 video extracted locally
+
+    The video is downloaded into mp4Cache, and frames are looked up with the
+    fixed layout of one frame per minute starting at qStartTime.  Images that
+    are already available (in outputDir or imageCache) are not extracted again.
+
+    Args:
+        outputDir (str): Output directory path
+        cameraID (str): ID of camera
+        mp4Url (str): URL of the Q MP4 video
+        qStartTime (int): timestamp of the start of the Q
+        frameTimes (list): timestamps of the desired frames
+
+    Returns:
+        Dictionary mapping frame time to local filesystem path
+    """
+    images = {}
+    missingTimes = []
+    for frameTime in set(frameTimes):
+        imgPath = getImgPath(outputDir, cameraID, frameTime)
+        # fetch function that always fails only copies images that are already cached
+        if os.path.isfile(imgPath) or fetchFromCache(cameraID, frameTime, lambda filePath: False, imgPath):
+            images[frameTime] = imgPath
+        else:
+            missingTimes.append(frameTime)
+    if not missingTimes:
+        return images
+
+    def fetchMp4(filePath):
+        with getHostSemaphore(mp4Url):
+            resp = getHttpSession().get(mp4Url, stream=True)
+            if resp.status_code != 200:
+                logging.error('Error %d fetching %s', resp.status_code, mp4Url)
+                resp.close()
+                return False
+            with open(filePath, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=65536):
+                    f.write(chunk)
+            resp.close()
+    mp4Path = mp4Cache.put(cameraID, qStartTime, fetchMp4)
+    if not mp4Path:
+        return images
+
+    frameIndexes = {round((x - qStartTime)/60): x for x in missingTimes}
+    with tempfile.TemporaryDirectory() as tmpDirName:
+        frames = extractMp4Frames(mp4Path, list(frameIndexes.keys()), tmpDirName)
+        for (frameIndex, framePath) in frames.items():
+            frameTime = frameIndexes[frameIndex]
+            imgPath = getImgPath(outputDir, cameraID, frameTime)
+            images[frameTime] = fetchFromCache(cameraID, frameTime, lambda filePath: shutil.move(framePath, filePath), imgPath)
+    logging.warning('Extracted %d of %d frames from %s', len(frames), len(frameIndexes), mp4Url)
+    return images
+
+
 outputDirCheckOnly = '/CHECK:WITHOUT:DOWNLOAD'
 def downloadFilesForDate(googleServices, settings, outputDir, hpwrenSource, gapMinutes, verboseLogs):
     """Download HPWREN images from given given date time range with specified gaps
 
-    If outputDir is special value outputDirCheckOnly, then just check if files are retrievable
+    If outputDir is special value outputDirCheckOnly, then just check if files are retrievable.
+    The directory listings are scanned first, and then the images are downloaded in parallel.
+    Q directories without images are extracted from their MP4 video, locally if ffmpeg
+    is installed, and otherwise using the ffmpeg Google Cloud Function.
 
     Args:
         googleServices (): Google services and credentials
@@ -414,6 +803,9 @@ def downloadFilesForDate(googleServices, settings, outputDir, hpwrenSource, gapM
     lastQNum = 0 # 0 never matches because Q numbers start with 1
     curTimeDT = startTimeDT
     downloaded_files = []
+    downloads = []
+    mp4Requests = {} # Q number -> (MP4 URL, Q start time, list of frame times)
+    mp4Frames = {} # Q number -> (frame time -> path)
     while curTimeDT <= endTimeDT:
         qNum = 1 + int(curTimeDT.hour/3)
         urlPartsQ = urlPartsDate[:] # copy URL
@@ -421,36 +813,54 @@ def downloadFilesForDate(googleServices, settings, outputDir, hpwrenSource, gapM
         if qNum != lastQNum:
             # List times of files in Q dir and cache
             useHttp = True
+            useLocalMp4 = False
             imgTimes = listTimesinQ(urlPartsQ, verboseLogs)
             if not imgTimes:
                 if verboseLogs:
                     logging.error('No images in Q dir %s', '/'.join(urlPartsQ))
                 mp4Url = getMp4Url(urlPartsDate, qNum, verboseLogs)
                 if not mp4Url:
-                    return downloaded_files
-                if outputDir != outputDirCheckOnly:
+                    break
+                if (outputDir != outputDirCheckOnly) and ffmpegPath:
+                    qStartTime = getQStartTime(startTimeDT, qNum)
+                    imgTimes = list(map(lambda x: {'time': qStartTime + x*60}, range(MP4_FRAMES_PER_Q)))
+                    mp4Requests[qNum] = (mp4Url, qStartTime, [])
+                    useHttp = False
+                    useLocalMp4 = True
+                elif outputDir != outputDirCheckOnly:
                     imgTimes = getGCSMp4(googleServices, settings, hpwrenSource, qNum)
+                    imgTimes.sort(key=lambda x: x['time'])
                     useHttp = False
                     # logging.warning('imgTimes %d %s', len(imgTimes), imgTimes)
+            sortedTimes = array.array('q', map(lambda x: x['time'], imgTimes or []))
             lastQNum = qNum
 
         if outputDir == outputDirCheckOnly:
             downloaded_files.append(outputDirCheckOnly)
         else:
             desiredTime = time.mktime(curTimeDT.timetuple())
-            closestEntry = min(imgTimes, key=lambda x: abs(x['time']-desiredTime))
+            closestEntry = imgTimes[getClosestIndex(sortedTimes, desiredTime)]
             closestTime = closestEntry['time']
-            downloaded = None
             if useHttp:
-                downloaded = downloadHttpFileAtTime(outputDir, urlPartsQ, hpwrenSource['cameraID'], closestTime, verboseLogs)
+                downloadFunc = lambda urlPartsQ=urlPartsQ, closestTime=closestTime: \
+                    downloadHttpFileAtTime(outputDir, urlPartsQ, hpwrenSource['cameraID'], closestTime, verboseLogs)
+            elif useLocalMp4:
+                # all frames of the Q are extracted together below
+                mp4Requests[qNum][2].append(closestTime)
+                downloadFunc = lambda qNum=qNum, closestTime=closestTime: mp4Frames[qNum].get(closestTime)
             else:
-                downloaded = downloadGCSFileAtTime(outputDir, closestEntry)
-            if downloaded and verboseLogs:
-                logging.warning('Successful download for time %s', str(datetime.datetime.fromtimestamp(closestTime)))
-            if downloaded:
-                downloaded_files.append(downloaded)
+                downloadFunc = lambda closestEntry=closestEntry: downloadGCSFileAtTime(outputDir, closestEntry)
+            downloads.append((closestTime, downloadFunc))
 
         curTimeDT += timeGapDelta
+    for (qNum, (mp4Url, qStartTime, frameTimes)) in mp4Requests.items():
+        try:
+            mp4Frames[qNum] = getMp4Frames(outputDir, hpwrenSource['cameraID'], mp4Url, qStartTime, frameTimes)
+        except Exception as e:
+            logging.error('Error extracting frames from %s: %s', mp4Url, str(e))
+            mp4Frames[qNum] = {}
+    if downloads:
+        downloaded_files = runDownloads(downloads, verboseLogs)
     return downloaded_files
 
 
@@ -471,13 +881,14 @@ def downloadFilesHpwren(googleServices, settings, outputDir, hpwrenSource, gapMi
     Returns:
         List of local filesystem paths to downloaded images
     """
-    regexDir = '(c[12])/([^/]+)/large/?'
-    matches = re.findall(regexDir, hpwrenSource['dirName'])
-    if len(matches) != 1:
-        logging.error('Could not parse dir: %s', hpwrenSource['dirName'])
-        return None
-    match = matches[0]
-    (server, subdir) = match
+    if hpwrenSource.get('subdir'): # already parsed by CameraArchiveRegistry
+        (server, subdir) = (hpwrenSource['server'], hpwrenSource['subdir'])
+    else:
+        parsedDir = parseArchiveDir(hpwrenSource['dirName'])
+        if not parsedDir:
+            logging.error('Could not parse dir: %s', hpwrenSource['dirName'])
+            return None
+        (server, subdir) = parsedDir
     hpwrenBase = 'http://{server}.hpwren.ucsd.edu/archive'.format(server=server)
     hpwrenSource['server'] = server
     urlParts = [hpwrenBase, subdir, 'large']
@@ -495,79 +906,178 @@ def downloadFilesHpwren(googleServices, settings, outputDir, hpwrenSource, gapMi
     return downloadFilesForDate(googleServices, settings, outputDir, hpwrenSource, gapMinutes, verboseLogs)
 
 
-def getHpwrenCameraArchives(hpwrenArchivesPath):
-    """Get the HPWREN camera archive directories from given file
+def parseArchiveDir(dirName):
+    """Parse the HPWREN server and camera subdirectory from given archive directory
 
     Args:
-        hpwrenArchivesPath (str): path (local of GCS) to file with archive info
+        dirName (str): archive directory (e.g. 'c1/rm-w-mobo-c/large/')
 
     Returns:
-        List of archive directories
+        Tuple (server, subdir), or None if dirName doesn't match
     """
-    archiveData = goog_helper.readFile(hpwrenArchivesPath)
-    camArchives = []
-    for line in archiveData.split('\n'):
+    regexDir = '(c[12])/([^/]+)/large/?'
+    matches = re.findall(regexDir, dirName)
+    if len(matches) != 1:
+        return None
+    return matches[0]
+
+
+class CameraArchiveRegistry(object):
+    def __init__(self):
+        """Index of the HPWREN camera archive directories by camera ID and name
+        """
+        self.cameras = [] # list of dicts with id, name, and dirs (in file order)
+        self.byID = {}
+        self.byName = {}
+        self.dirSources = {} # archive dir -> (server, subdir)
+
+
+    def addLine(self, line):
+        """Add the archive entry from given line of the archives file ("<name> <dir>")
+
+        Lines for IDs that are already known add their dir to that camera.  Lines for
+        names with 'pre' suffixes (older archives) add their dir to the camera with the
+        base name, or to all cameras containing the base name if there is no exact match.
+        """
         camInfo = line.split(' ')
         # logging.warning('info %d, %s', len(camInfo), camInfo)
         if len(camInfo) != 2:
             logging.warning('Ignoring archive entry without two columns %s', camInfo)
-            continue
-        dirInfo = camInfo[1].split('/')
+            return
+        (camName, dirName) = camInfo
+        dirInfo = dirName.split('/')
         if len(dirInfo) < 2:
             logging.warning('Ignoring archive entry without proper ID %s', dirInfo)
-            continue
+            return
+        parsedDir = parseArchiveDir(dirName)
+        if parsedDir:
+            self.dirSources[dirName] = tuple(parsedDir)
         cameraID = dirInfo[1]
-        matchesID = list(filter(lambda x: cameraID == x['id'], camArchives))
-        if matchesID:
-            if camInfo[1] not in matchesID[0]['dirs']:
-                matchesID[0]['dirs'].append(camInfo[1])
-                # logging.warning('Merging duplicate ID dir %s, %s', camInfo[1], matchesID[0])
-            continue
-        preIndex = camInfo[0].find('pre')
+        if cameraID in self.byID:
+            if dirName not in self.byID[cameraID]['dirs']:
+                self.byID[cameraID]['dirs'].append(dirName)
+            return
+        preIndex = camName.find('pre')
         if preIndex > 0:
-            searchName = camInfo[0][:(preIndex-1)]
-            matchesName = list(filter(lambda x: searchName in x['name'], camArchives))
+            searchName = camName[:(preIndex-1)]
+            if searchName in self.byName:
+                matchesName = [self.byName[searchName]]
+            else:
+                matchesName = list(filter(lambda x: searchName in x['name'], self.cameras))
             for match in matchesName:
-                if camInfo[1] not in match['dirs']:
-                    match['dirs'].append(camInfo[1])
-                    # logging.warning('Mergig pre dir %s to %s', camInfo[1], match)
-            continue
-        camData = {'id': cameraID, 'name': camInfo[0], 'dirs': [camInfo[1]]}
-        # logging.warning('data %s', camData)
-        camArchives.append(camData)
-    logging.warning('Discovered total %d camera archive dirs', len(camArchives))
-    return camArchives
+                if dirName not in match['dirs']:
+                    match['dirs'].append(dirName)
+            return
+        self._addCamera({'id': cameraID, 'name': camName, 'dirs': [dirName]})
+
+
+    def _addCamera(self, camData):
+        self.cameras.append(camData)
+        self.byID[camData['id']] = camData
+        self.byName.setdefault(camData['name'], camData)
+
+
+    def getDirs(self, cameraID):
+        """Get the archive dirs of given camera (empty list for unknown cameras)
+        """
+        camData = self.byID.get(cameraID)
+        return camData['dirs'] if camData else []
+
+
+    def getDirSource(self, dirName):
+        """Get the (server, subdir) tuple for given archive dir (None if not parsable)
+        """
+        return self.dirSources.get(dirName)
+
+
+    def __len__(self):
+        return len(self.cameras)
+
+
+    def toDict(self):
+        return {'cameras': self.cameras, 'dirSources': self.dirSources}
+
+
+    @classmethod
+    def fromDict(cls, data):
+        registry = cls()
+        for camData in data['cameras']:
+            registry._addCamera(camData)
+        registry.dirSources = {dirName: tuple(dirSource) for (dirName, dirSource) in data['dirSources'].items()}
+        return registry
+
+
+# local directory for parsed archive files, and seconds before cached copies of GCS files expire
+archivesCacheDir = os.path.join(tempfile.gettempdir(), 'firecam_archives')
+ARCHIVES_CACHE_TTL = 60*60
+
+def getHpwrenCameraArchives(hpwrenArchivesPath):
+    """Get the HPWREN camera archive directories from given file
+
+    The parsed registry is cached locally (until the local file is modified,
+    or for ARCHIVES_CACHE_TTL for files on GCS) so it loads in milliseconds.
+
+    Args:
+        hpwrenArchivesPath (str): path (local of GCS) to file with archive info
+
+    Returns:
+        CameraArchiveRegistry object
+    """
+    cachePath = os.path.join(archivesCacheDir, hashlib.md5(hpwrenArchivesPath.encode('utf-8')).hexdigest() + '.json')
+    try:
+        cacheTime = os.path.getmtime(cachePath)
+        if goog_helper.parseGCSPath(hpwrenArchivesPath):
+            isFresh = time.time() - cacheTime < ARCHIVES_CACHE_TTL
+        else:
+            isFresh = os.path.getmtime(hpwrenArchivesPath) < cacheTime
+        if isFresh:
+            with open(cachePath, 'r') as f:
+                cached = json.load(f)
+            if cached['path'] == hpwrenArchivesPath:
+                return CameraArchiveRegistry.fromDict(cached)
+    except (OSError, ValueError, KeyError):
+        pass # parse the file below
+
+    archiveData = goog_helper.readFile(hpwrenArchivesPath)
+    registry = CameraArchiveRegistry()
+    for line in archiveData.split('\n'):
+        registry.addLine(line)
+    logging.warning('Discovered total %d camera archive dirs', len(registry))
+    try:
+        os.makedirs(archivesCacheDir, exist_ok=True)
+        tmpPath = '%s.%d.tmp' % (cachePath, os.getpid())
+        with open(tmpPath, 'w') as f:
+            json.dump(dict(registry.toDict(), path=hpwrenArchivesPath), f)
+        os.replace(tmpPath, cachePath)
+    except OSError as e:
+        logging.error('Error caching camera archives %s: %s', hpwrenArchivesPath, str(e))
+    return registry
 
 
 def findCameraInArchive(camArchives, cameraID):
     """Find the entries in the camera archive directories for the given camera
 
     Args:
-        camArchives (list): Result of getHpwrenCameraArchives() above
+        camArchives (CameraArchiveRegistry): Result of getHpwrenCameraArchives() above
         cameraID (str): ID of camera to fetch images from
 
     Returns:
         List of archive dirs that matching camera
     """
-    matchingCams = list(filter(lambda x: cameraID == x['id'], camArchives))
-    # logging.warning('Found %d match(es): %s', len(matchingCams), matchingCams)
-    if matchingCams:
-        return matchingCams[0]['dirs']
-    else:
-        return []
+    return camArchives.getDirs(cameraID)
 
 
 def getHpwrenImages(googleServices, settings, outputDir, camArchives, cameraID, startTimeDT, endTimeDT, gapMinutes):
     """Download HPWREN images from given camera and date time range with specified gaps
 
     Iterates over all directories for given camera in the archives and then downloads the images
-    by calling downloadFilesHpwren
+    by calling downloadFilesHpwren.  Images already in the shared image cache are not downloaded again
 
     Args:
         googleServices (): Google services and credentials
         settings (): settings module
         outputDir (str): Output directory path
-        camArchives (list): Result of getHpwrenCameraArchives() above
+        camArchives (CameraArchiveRegistry): Result of getHpwrenCameraArchives() above
         cameraID (str): ID of camera to fetch images from
         startTimeDT (datetime): starting time of time range
         endTimeDT (datetime): ending time of time range
@@ -584,6 +1094,9 @@ def getHpwrenImages(googleServices, settings, outputDir, camArchives, cameraID,
             'startTimeDT': startTimeDT,
             'endTimeDT': endTimeDT
         }
+        dirSource = camArchives.getDirSource(matchingDir)
+        if dirSource:
+            (hpwrenSource['server'], hpwrenSource['subdir']) = dirSource
         logging.warning('Searching for files in dir %s', hpwrenSource['dirName'])
         found = downloadFilesHpwren(googleServices, settings, outputDir, hpwrenSource, gapMinutes, False)
         if found:
@@ -591,26 +1104,148 @@ def getHpwrenImages(googleServices, settings, outputDir, camArchives, cameraID,
     return None
 
 
-def diffImages(imgA, imgB):
+def getTimeChunks(startTimeDT, endTimeDT, gapMinutes, chunkMinutes=CHUNK_MINUTES):
+    """Split the given time range into chunks within single days that keep the gaps between images
+
+    Args:
+        startTimeDT (datetime): starting time of time range
+        endTimeDT (datetime): ending time of time range
+        gapMinutes (int): Number of minutes of gap between images
+        chunkMinutes (int): maximum length of chunk
+
+    Returns:
+        List of (start datetime, end datetime) tuples
+    """
+    gapDelta = datetime.timedelta(seconds=60*gapMinutes)
+    chunks = []
+    chunkStartDT = startTimeDT
+    while chunkStartDT <= endTimeDT:
+        dayEndDT = datetime.datetime.combine(chunkStartDT.date(), datetime.time.max, tzinfo=chunkStartDT.tzinfo)
+        chunkLimitDT = chunkStartDT + datetime.timedelta(seconds=60*chunkMinutes) - datetime.timedelta(microseconds=1)
+        limitDT = min(endTimeDT, dayEndDT, chunkLimitDT)
+        chunkEndDT = chunkStartDT + int((limitDT - chunkStartDT) / gapDelta) * gapDelta
+        chunks.append((chunkStartDT, chunkEndDT))
+        chunkStartDT = chunkEndDT + gapDelta
+    return chunks
+
+
+def iterateHpwrenImages(googleServices, settings, outputDir, camArchives, cameraIDs, startTimeDT, endTimeDT, gapMinutes,
+                        maxPending=4):
+    """Download HPWREN images from given cameras and date time range (can span many days)
+
+    The range is split into chunks (see getTimeChunks) that are downloaded concurrently
+    up to maxPending chunks ahead of the caller, and results are yielded in order as
+    each chunk completes.
+
+    Args:
+        googleServices (): Google services and credentials
+        settings (): settings module
+        outputDir (str): Output directory path
+        camArchives (CameraArchiveRegistry): Result of getHpwrenCameraArchives() above
+        cameraIDs (list): IDs of cameras to fetch images from
+        startTimeDT (datetime): starting time of time range
+        endTimeDT (datetime): ending time of time range
+        gapMinutes (int): Number of minutes of gap between images for downloading
+        maxPending (int): number of chunks downloading concurrently
+
+    Yields:
+        Tuples (cameraID, unixTime, local filesystem path) for each downloaded image
+    """
+    timeChunks = getTimeChunks(startTimeDT, endTimeDT, gapMinutes)
+    chunks = iter([(cameraID, chunkStartDT, chunkEndDT) for cameraID in cameraIDs for (chunkStartDT, chunkEndDT) in timeChunks])
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxPending)
+    pending = collections.deque()
+    def submitNext():
+        chunk = next(chunks, None)
+        if chunk:
+            (cameraID, chunkStartDT, chunkEndDT) = chunk
+            pending.append((cameraID, executor.submit(getHpwrenImages, googleServices, settings, outputDir, camArchives,
+                                                      cameraID, chunkStartDT, chunkEndDT, gapMinutes)))
+    try:
+        for i in range(maxPending):
+            submitNext()
+        while pending:
+            (cameraID, future) = pending.popleft()
+            submitNext()
+            for imgPath in future.result() or []:
+                yield (cameraID, parseFilename(imgPath)['unixTime'], imgPath)
+    finally:
+        for (cameraID, future) in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def getRgbArray(img):
+    """Get the pixels of given image as HxWx3 uint8 array
+
+    Args:
+        img: Pillow image object (or uint8 numpy array, which is returned as is)
+
+    Returns:
+        numpy array
+    """
+    if isinstance(img, np.ndarray):
+        return img
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.asarray(img, dtype=np.uint8)
+
+
+def diffArrays(arrA, arrB):
+    """Subtract two uint8 pixel arrays and add 128, clipping to 0-255.  Works on
+       single images (HxWx3) and batches of same sized images (NxHxWx3) alike
+
+    Args:
+        arrA: uint8 numpy array to subtract from
+        arrB: uint8 numpy array to subtract
+
+    Returns:
+        uint8 numpy array of the same shape
+    """
+    diff = arrA.astype(np.int16)
+    diff -= arrB
+    diff += 128
+    np.clip(diff, 0, 255, out=diff)
+    return diff.astype(np.uint8)
+
+
+def diffImages(imgA, imgB, asArray=False):
     """Subtract two images (r-r, g-g, b-b).  Also add 128 to reduce negative values
        If a pixel is exactly same in both images, then the result will be 128,128,128 gray
-       Out of range values (<0 and > 255) are moved to 0 and 255 by the convert('L') function
+       Out of range values (<0 and > 255) are clipped to 0 and 255
 
     Args:
-        imgA: Pillow image object to subtract from
-        imgB: Pillow image object to subtract
+        imgA: Pillow image object (or uint8 array) to subtract from
+        imgB: Pillow image object (or uint8 array) to subtract
+        asArray (bool): return uint8 numpy array (e.g. for rect_to_squares.cutBoxesArray)
+                        instead of image object
 
     Returns:
         Pillow image object containing the results of the subtraction with 128 mean
     """
-    bandsImgA = imgA.split()
-    bandsImgB = imgB.split()
-    bandsImgOut = []
+    diff = diffArrays(getRgbArray(imgA), getRgbArray(imgB))
+    if asArray:
+        return diff
+    return Image.fromarray(diff)
+
 
-    for bandNum in range(len(bandsImgA)):
-        # out = ImageMath.eval("convert((128+a/2)-b/2,'L')", a=bandsImgA[bandNum], b=bandsImgB[bandNum])
-        out = ImageMath.eval("convert(128+a-b,'L')", a=bandsImgA[bandNum], b=bandsImgB[bandNum])
-        bandsImgOut.append(out)
+def diffImagesBatch(imgPairs, asArray=False):
+    """Subtract many pairs of images (e.g. crops) at once.  See diffImages()
 
-    return Image.merge('RGB', bandsImgOut)
+    Args:
+        imgPairs (list): list of (imgA, imgB) tuples
+        asArray (bool): return uint8 numpy arrays instead of image objects
 
+    Returns:
+        List of difference images (or arrays) in same order as given pairs
+    """
+    arraysA = list(map(lambda x: getRgbArray(x[0]), imgPairs))
+    arraysB = list(map(lambda x: getRgbArray(x[1]), imgPairs))
+    if arraysA and all(map(lambda x: x.shape == arraysA[0].shape, arraysA + arraysB)):
+        # same sized images are subtracted in single vectorized operation
+        diffs = list(diffArrays(np.stack(arraysA), np.stack(arraysB)))
+    else:
+        diffs = list(map(lambda x: diffArrays(x[0], x[1]), zip(arraysA, arraysB)))
+    if asArray:
+        return diffs
+    return list(map(lambda x: Image.fromarray(x), diffs))
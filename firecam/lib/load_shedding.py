@@ -0,0 +1,145 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Load shedding for detection processes that fall behind.  When the time to
+check every camera once (sweep time) exceeds the interval at which cameras
+upload new images, the shedder escalates through these levels:
+  1. drop stale frames (captured more than STALE_INTERVALS intervals ago)
+  2. also revisit low risk cameras only every other sweep
+  3. also classify only every other tile of low risk cameras (alternating
+     tiles on each visit, so every tile is still checked every two visits)
+Cameras are low risk when their recent (decaying) max score is low.
+
+"""
+
+import logging
+
+from firecam.lib import metrics
+
+NONE = 0
+DROP_STALE = 1
+REDUCE_REVISITS = 2
+SUBSAMPLE_TILES = 3
+# sweep time (as multiple of camera interval) above which each level is entered
+LEVEL_THRESHOLDS = [0, 1.0, 1.5, 2.0]
+# to leave a level, sweep time must drop this fraction below its threshold
+HYSTERESIS = 0.1
+# frames captured more than this many camera intervals ago are stale
+STALE_INTERVALS = 2
+# cameras whose decayed max score is below this are low risk
+LOW_RISK_SCORE = 0.3
+# weight of previous risk score when new score is lower
+RISK_DECAY = 0.9
+
+
+class LoadShedder(object):
+    def __init__(self, intervalSeconds=60):
+        """Decide which work to shed based on how far behind the detection process is
+
+        Args:
+            intervalSeconds (int): seconds between new images from each camera
+        """
+        self.intervalSeconds = intervalSeconds
+        self.level = NONE
+
+
+    def _countAction(self, action, cameraID):
+        metrics.registry.counter('firecam_shed_total', 'Work skipped by load shedding').inc({'action': action, 'camera': cameraID})
+
+
+    def updateSweep(self, sweepSeconds, cameras):
+        """Update shedding level given latest estimate of sweep time
+
+        Args:
+            sweepSeconds (float): estimated seconds to check every camera once
+            cameras (list): list of camera dicts (deferred revisits are cleared when no longer needed)
+
+        Returns:
+            current shedding level
+        """
+        ratio = sweepSeconds / self.intervalSeconds
+        newLevel = self.level
+        while (newLevel < SUBSAMPLE_TILES) and (ratio > LEVEL_THRESHOLDS[newLevel + 1]):
+            newLevel += 1
+        while (newLevel > NONE) and (ratio < LEVEL_THRESHOLDS[newLevel] * (1 - HYSTERESIS)):
+            newLevel -= 1
+        if newLevel != self.level:
+            logging.warning('Load shedding level %d -> %d (sweep %.1fs, camera interval %ds)',
+                            self.level, newLevel, sweepSeconds, self.intervalSeconds)
+            self.level = newLevel
+            metrics.registry.gauge('firecam_shed_level', 'Current load shedding level').set(newLevel)
+            if newLevel < REDUCE_REVISITS:
+                for camera in cameras:
+                    camera.pop('nextShedScan', None)
+        return self.level
+
+
+    def isStale(self, cameraID, captureTime, timestamp):
+        """Check if frame should be dropped because it is too old to be worth scoring
+
+        Args:
+            cameraID (str): camera name
+            captureTime (float): time camera captured the image (None if unknown)
+            timestamp (int): current time
+
+        Returns:
+            True if frame should be dropped
+        """
+        if (self.level < DROP_STALE) or not captureTime:
+            return False
+        if timestamp - captureTime <= STALE_INTERVALS * self.intervalSeconds:
+            return False
+        logging.warning('Load shedding: dropping stale frame from %s (%ds old)', cameraID, timestamp - captureTime)
+        self._countAction('dropStale', cameraID)
+        return True
+
+
+    def isLowRisk(self, camera):
+        return camera.get('riskScore', 0) < LOW_RISK_SCORE
+
+
+    def getTileSampling(self, camera):
+        """Get which tiles of given camera's image to classify
+
+        Args:
+            camera (dict): camera information
+
+        Returns:
+            Tuple of tile stride and offset ((1, 0) means all tiles)
+        """
+        if (self.level < SUBSAMPLE_TILES) or not self.isLowRisk(camera):
+            return (1, 0)
+        camera['tileOffset'] = 1 - camera.get('tileOffset', 1)
+        logging.warning('Load shedding: subsampling tiles for %s', camera['name'])
+        self._countAction('subsampleTiles', camera['name'])
+        return (2, camera['tileOffset'])
+
+
+    def afterFrame(self, camera, timestamp, maxScore, sweepSeconds):
+        """Update risk of camera after its frame was scored and defer next visit if shedding
+
+        Args:
+            camera (dict): camera information
+            timestamp (int): time of the frame
+            maxScore (float): highest segment score of the frame
+            sweepSeconds (float): estimated seconds to check every camera once
+        """
+        camera['riskScore'] = max(maxScore, camera.get('riskScore', 0) * RISK_DECAY)
+        if (self.level >= REDUCE_REVISITS) and self.isLowRisk(camera):
+            # skip the next sweep for this camera (checked by isCameraDue)
+            camera['nextShedScan'] = timestamp + int(sweepSeconds * 2)
+            logging.warning('Load shedding: reducing revisits of %s', camera['name'])
+            self._countAction('reduceRevisits', camera['name'])
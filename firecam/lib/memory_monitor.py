@@ -0,0 +1,150 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Memory monitor for long running loops (e.g. detect_fire).  Tracks process RSS
+and the memory growth attributed to each pipeline stage, and runs a full
+garbage collection only when RSS crosses a configurable budget.  Optionally
+uses tracemalloc to periodically log the source lines with the most growth.
+
+Usage:
+    monitor.startIteration()
+    fetch()
+    monitor.markStage('fetch')
+    detect()
+    monitor.markStage('detect')
+    monitor.endIteration()
+
+"""
+
+import os
+import logging
+import gc
+import resource
+import tracemalloc
+
+from firecam.lib import metrics
+
+# iterations between logs of top allocators (when tracing is enabled)
+TRACE_REPORT_ITERATIONS = 100
+# when GC does not bring RSS under budget, raise the trigger by this fraction to avoid GC on every iteration
+BUDGET_HEADROOM = 0.1
+
+
+def getRssBytes():
+    """Get the current resident set size of this process
+
+    Returns:
+        RSS in bytes
+    """
+    try:
+        with open('/proc/self/statm') as statmFile:
+            residentPages = int(statmFile.read().split()[1])
+        return residentPages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # no /proc (e.g. MacOS), fallback to peak RSS, which is in bytes on MacOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class MemoryMonitor(object):
+    def __init__(self, budgetMB=0, traceTop=0):
+        """Monitor memory of the current process
+
+        Args:
+            budgetMB (int): RSS (in MB) above which to run GC.  0 means never force GC
+            traceTop (int): if non-zero, use tracemalloc and log given number of top allocators
+        """
+        self.budgetBytes = budgetMB * 1024 * 1024
+        self.gcTriggerBytes = self.budgetBytes
+        self.traceTop = traceTop
+        self.numIterations = 0
+        self.lastSnapshot = None
+        self.lastMark = None
+        self.iterationStart = None
+        self.stageGrowth = {}
+        if traceTop:
+            tracemalloc.start()
+            self.lastSnapshot = tracemalloc.take_snapshot()
+
+
+    def _getUsage(self):
+        # tracemalloc numbers are precise for python allocations, but RSS also covers native (TF, PIL) memory
+        if self.traceTop:
+            return tracemalloc.get_traced_memory()[0]
+        return getRssBytes()
+
+
+    def startIteration(self):
+        """Call at the start of each loop iteration
+        """
+        self.lastMark = self._getUsage()
+        self.iterationStart = self.lastMark
+        self.stageGrowth = {}
+
+
+    def markStage(self, stage):
+        """Attribute memory growth since the previous mark to given stage
+
+        Args:
+            stage (str): name of the stage that just completed
+        """
+        if self.lastMark == None:
+            return
+        usage = self._getUsage()
+        self.stageGrowth[stage] = self.stageGrowth.get(stage, 0) + usage - self.lastMark
+        self.lastMark = usage
+
+
+    def endIteration(self):
+        """Call at the end of each loop iteration.  Exports growth metrics and runs GC if over budget
+
+        Returns:
+            True if GC was run
+        """
+        self.numIterations += 1
+        growthGauge = metrics.registry.gauge('firecam_memory_growth_bytes', 'Memory growth during last iteration by stage')
+        for (stage, growth) in self.stageGrowth.items():
+            growthGauge.set(growth, {'stage': stage})
+        if self.iterationStart != None:
+            growthGauge.set(self._getUsage() - self.iterationStart, {'stage': 'total'})
+        rss = getRssBytes()
+        metrics.registry.gauge('firecam_rss_bytes', 'Resident set size of the process').set(rss)
+
+        if self.traceTop and (self.numIterations % TRACE_REPORT_ITERATIONS == 0):
+            self._logTopAllocators()
+
+        if not self.gcTriggerBytes or (rss < self.gcTriggerBytes):
+            return False
+        gc.collect()
+        metrics.registry.counter('firecam_gc_runs_total', 'Garbage collections forced by memory budget').inc()
+        rssAfter = getRssBytes()
+        if rssAfter >= self.budgetBytes:
+            # collection did not help, so wait for more growth before collecting again
+            self.gcTriggerBytes = int(rssAfter * (1 + BUDGET_HEADROOM))
+            logging.warning('Memory over budget after GC: RSS %dMB (budget %dMB). Next GC at %dMB',
+                            rssAfter // 2**20, self.budgetBytes // 2**20, self.gcTriggerBytes // 2**20)
+        else:
+            self.gcTriggerBytes = self.budgetBytes
+        return True
+
+
+    def _logTopAllocators(self):
+        snapshot = tracemalloc.take_snapshot()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        topStats = snapshot.compare_to(self.lastSnapshot, 'lineno')[:self.traceTop]
+        self.lastSnapshot = snapshot
+        logging.warning('Top memory growth over last %d iterations:', TRACE_REPORT_ITERATIONS)
+        for stat in topStats:
+            logging.warning('  %s', str(stat))
@@ -0,0 +1,321 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Lightweight metrics (counters, gauges, and latency histograms) for detection
+processes.  Metrics can be served on a local HTTP endpoint in Prometheus text
+format and/or periodically dumped to a JSON file.  Histograms keep a window
+of recent samples to report p50/p95/p99 in addition to Prometheus buckets.
+
+Usage:
+    with metrics.stageTimer('infer'):
+        classify()
+    metrics.registry.counter('firecam_frames_total', 'Frames processed').inc({'camera': cameraID})
+
+"""
+
+import os
+import logging
+import threading
+import time
+import json
+import math
+import collections
+import http.server
+
+from firecam.lib import tracing
+
+# bucket upper bounds (seconds) suitable for pipeline stage latencies
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+# number of recent samples kept by histograms for percentile calculations
+WINDOW_SIZE = 1000
+
+STAGE_METRIC = 'firecam_stage_seconds'
+
+
+def _labelsKey(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _formatLabels(labelsKey, extra=None):
+    items = list(labelsKey) + (extra or [])
+    if not items:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(val).replace('"', '\\"')) for (key, val) in items) + '}'
+
+
+def getPercentile(sortedValues, percent):
+    """Get the given percentile from sorted list of values (nearest rank method)
+
+    Args:
+        sortedValues (list): sorted list of numbers
+        percent (float): percentile (0-100)
+
+    Returns:
+        Value at the percentile (or None for empty list)
+    """
+    if not sortedValues:
+        return None
+    rank = max(math.ceil(percent/100 * len(sortedValues)), 1)
+    return sortedValues[rank - 1]
+
+
+class Counter(object):
+    def __init__(self, name, helpStr):
+        self.name = name
+        self.helpStr = helpStr
+        self.type = 'counter'
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, labels=None, amount=1):
+        key = _labelsKey(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def formatPrometheus(self):
+        with self.lock:
+            return ['%s%s %s' % (self.name, _formatLabels(key), val) for (key, val) in sorted(self.values.items())]
+
+    def toDict(self):
+        with self.lock:
+            return [{'labels': dict(key), 'value': val} for (key, val) in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    def __init__(self, name, helpStr):
+        super().__init__(name, helpStr)
+        self.type = 'gauge'
+
+    def set(self, value, labels=None):
+        key = _labelsKey(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(object):
+    def __init__(self, name, helpStr, buckets=None):
+        self.name = name
+        self.helpStr = helpStr
+        self.type = 'histogram'
+        self.buckets = buckets or DEFAULT_BUCKETS
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, labels=None):
+        key = _labelsKey(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if not series:
+                series = {
+                    'bucketCounts': [0] * len(self.buckets),
+                    'count': 0,
+                    'sum': 0.0,
+                    'window': collections.deque(maxlen=WINDOW_SIZE),
+                }
+                self.series[key] = series
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    series['bucketCounts'][i] += 1
+            series['count'] += 1
+            series['sum'] += value
+            series['window'].append(value)
+
+    def getPercentiles(self, labels=None, percents=(50, 95, 99)):
+        """Get percentiles over the recent window of samples for given labels
+
+        Returns:
+            Dictionary mapping 'p50' style names to values
+        """
+        with self.lock:
+            series = self.series.get(_labelsKey(labels))
+            window = sorted(series['window']) if series else []
+        return {('p%d' % percent): getPercentile(window, percent) for percent in percents}
+
+    def formatPrometheus(self):
+        lines = []
+        with self.lock:
+            for (key, series) in sorted(self.series.items()):
+                for (bound, bucketCount) in zip(self.buckets, series['bucketCounts']):
+                    lines.append('%s_bucket%s %d' % (self.name, _formatLabels(key, [('le', bound)]), bucketCount))
+                lines.append('%s_bucket%s %d' % (self.name, _formatLabels(key, [('le', '+Inf')]), series['count']))
+                lines.append('%s_sum%s %f' % (self.name, _formatLabels(key), series['sum']))
+                lines.append('%s_count%s %d' % (self.name, _formatLabels(key), series['count']))
+        return lines
+
+    def toDict(self):
+        result = []
+        with self.lock:
+            items = [(key, series['count'], series['sum'], sorted(series['window']))
+                     for (key, series) in sorted(self.series.items())]
+        for (key, count, total, window) in items:
+            entry = {'labels': dict(key), 'count': count, 'sum': total}
+            for percent in (50, 95, 99):
+                entry['p%d' % percent] = getPercentile(window, percent)
+            result.append(entry)
+        return result
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        """Collection of named metrics that can be exported together
+        """
+        self.lock = threading.Lock()
+        self.metrics = collections.OrderedDict()
+
+    def _getOrCreate(self, metricClass, name, helpStr):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metricClass(name, helpStr)
+            metric = self.metrics[name]
+        assert isinstance(metric, metricClass)
+        return metric
+
+    def counter(self, name, helpStr=''):
+        return self._getOrCreate(Counter, name, helpStr)
+
+    def gauge(self, name, helpStr=''):
+        return self._getOrCreate(Gauge, name, helpStr)
+
+    def histogram(self, name, helpStr=''):
+        return self._getOrCreate(Histogram, name, helpStr)
+
+    def formatPrometheus(self):
+        """Format all metrics in Prometheus text exposition format
+
+        Returns:
+            string
+        """
+        lines = []
+        with self.lock:
+            metricsList = list(self.metrics.values())
+        for metric in metricsList:
+            lines.append('# HELP %s %s' % (metric.name, metric.helpStr))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines += metric.formatPrometheus()
+        return '\n'.join(lines) + '\n'
+
+    def toDict(self):
+        with self.lock:
+            metricsList = list(self.metrics.values())
+        return {metric.name: metric.toDict() for metric in metricsList}
+
+
+# registry shared by all code in the process
+registry = MetricsRegistry()
+
+
+class stageTimer(object):
+    """Context manager that records the elapsed time of named pipeline stage
+       in the shared firecam_stage_seconds histogram and as a tracing span
+    """
+    def __init__(self, stage):
+        self.stage = stage
+        self.span = tracing.span(stage)
+
+    def __enter__(self):
+        self.span.start()
+        self.timeStart = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        observeStage(self.stage, time.time() - self.timeStart)
+        self.span.__exit__(excType, excValue, traceback)
+        return False
+
+
+def observeStage(stage, seconds):
+    """Record the given number of seconds spent in given pipeline stage
+
+    Args:
+        stage (str): name of the stage (e.g. 'fetch', 'infer')
+        seconds (float): elapsed time
+    """
+    registry.histogram(STAGE_METRIC, 'Time spent in each pipeline stage').observe(seconds, {'stage': stage})
+
+
+def formatStageSummary():
+    """Get a one line summary of recent percentiles of all stages (for logging)
+
+    Returns:
+        string
+    """
+    histogram = registry.histogram(STAGE_METRIC, 'Time spent in each pipeline stage')
+    summaries = []
+    for entry in histogram.toDict():
+        summaries.append('%s p50=%.2f p95=%.2f p99=%.2f' % (entry['labels']['stage'], entry['p50'], entry['p95'], entry['p99']))
+    return ', '.join(summaries)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = registry.formatPrometheus().encode('utf-8')
+            contentType = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(registry.toDict()).encode('utf-8')
+            contentType = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # don't log every scrape
+
+
+def startHttpServer(port):
+    """Serve the shared registry on given local port (/metrics and /metrics.json)
+
+    Args:
+        port (int): TCP port number
+
+    Returns:
+        HTTP server object (or None if port could not be used)
+    """
+    try:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+    except OSError as e:
+        logging.error('Could not start metrics server on port %d: %s', port, str(e))
+        return None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.warning('Serving metrics on http://127.0.0.1:%d/metrics', port)
+    return server
+
+
+def startJsonDump(filePath, intervalSeconds=60):
+    """Periodically write the shared registry as JSON to given file
+
+    Args:
+        filePath (str): local file path (overwritten on every dump)
+        intervalSeconds (int): seconds between dumps
+    """
+    def dumpLoop():
+        while True:
+            time.sleep(intervalSeconds)
+            try:
+                tmpPath = filePath + '.tmp'
+                with open(tmpPath, 'w') as f:
+                    json.dump({'time': int(time.time()), 'metrics': registry.toDict()}, f)
+                os.replace(tmpPath, filePath)
+            except Exception as e:
+                logging.error('Error dumping metrics to %s: %s', filePath, str(e))
+    thread = threading.Thread(target=dumpLoop, daemon=True)
+    thread.start()
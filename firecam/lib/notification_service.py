@@ -0,0 +1,174 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Send alert notifications (email, sms) to all recipients concurrently in
+background threads, retrying failures with jittered exponential backoff, so
+alerts don't block the detection loop.  Active recipients are read from the
+notifications SQL table and cached for a short time.
+
+"""
+
+import logging
+import time
+import random
+import threading
+import concurrent.futures
+
+from firecam.lib import metrics
+
+# maximum attempts to send each notification
+MAX_ATTEMPTS = 5
+# backoff before retry N is random between 0 and min(BACKOFF_BASE_SECONDS * 2^N, BACKOFF_MAX_SECONDS)
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 60
+# parallel senders per channel.  Email is sent as one message with all recipients in bcc
+CHANNEL_WORKERS = {
+    'email': 1,
+    'sms': 10,
+}
+
+
+def getBackoffSeconds(attempt):
+    """Get randomized (full jitter) delay before retrying after given failed attempt
+
+    Args:
+        attempt (int): number of failed attempts so far (1 for first failure)
+
+    Returns:
+        seconds to wait
+    """
+    return random.uniform(0, min(BACKOFF_BASE_SECONDS * 2**attempt, BACKOFF_MAX_SECONDS))
+
+
+def callOnce(func):
+    """Wrap given function so that only its first call (from any thread) runs it.
+       E.g., to record a channel once per alert however many recipients it has
+
+    Args:
+        func: function without arguments
+
+    Returns:
+        function without arguments
+    """
+    lock = threading.Lock()
+    called = []
+    def wrapper():
+        with lock:
+            if called:
+                return
+            called.append(True)
+        func()
+    return wrapper
+
+
+class RecipientCache(object):
+    def __init__(self, dbManager, ttlSeconds=300):
+        """Cache of the notifications table.  Rows are cached with their active time
+           ranges, so recipients become active/inactive on time even when cached
+
+        Args:
+            dbManager (DbManager):
+            ttlSeconds (int): seconds before re-reading the table
+        """
+        self.dbManager = dbManager
+        self.ttlSeconds = ttlSeconds
+        self.rows = None
+        self.expiration = 0
+
+
+    def _getRows(self):
+        timeNow = time.time()
+        if (self.rows == None) or (timeNow >= self.expiration):
+            self.rows = self.dbManager.getNotifications()
+            self.expiration = timeNow + self.ttlSeconds
+        return self.rows
+
+
+    def getEmails(self):
+        """Get currently active email addresses
+        """
+        timeNow = time.time()
+        return [x['email'] for x in self._getRows()
+                if x['email'] and (x['emailstarttime'] or 0) < timeNow < (x['emailendtime'] or 0)]
+
+
+    def getPhones(self):
+        """Get currently active phone numbers
+        """
+        timeNow = time.time()
+        return [x['phone'] for x in self._getRows()
+                if x['phone'] and (x['phonestarttime'] or 0) < timeNow < (x['phoneendtime'] or 0)]
+
+
+class NotificationService(object):
+    def __init__(self, maxAttempts=MAX_ATTEMPTS):
+        """Service sending notifications in background threads (one pool per channel)
+
+        Args:
+            maxAttempts (int): maximum attempts for each notification
+        """
+        self.maxAttempts = maxAttempts
+        self.lock = threading.Lock()
+        self.executors = {}
+
+
+    def _getExecutor(self, channel):
+        with self.lock:
+            if channel not in self.executors:
+                self.executors[channel] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=CHANNEL_WORKERS.get(channel, 4), thread_name_prefix='notify-' + channel)
+            return self.executors[channel]
+
+
+    def _sendWithRetries(self, channel, sendFunc, onSuccess):
+        for attempt in range(1, self.maxAttempts + 1):
+            try:
+                if sendFunc():
+                    metrics.registry.counter('firecam_notifications_total', 'Notifications sent').inc({'channel': channel})
+                    if onSuccess:
+                        onSuccess()
+                    return True
+                error = 'no result'
+            except Exception as e:
+                error = str(e)
+            if attempt < self.maxAttempts:
+                delay = getBackoffSeconds(attempt)
+                logging.error('Error sending %s notification (attempt %d), retrying in %.1fs: %s', channel, attempt, delay, error)
+                time.sleep(delay)
+        logging.error('Giving up on %s notification after %d attempts: %s', channel, self.maxAttempts, error)
+        metrics.registry.counter('firecam_notification_failures_total', 'Notifications that could not be sent').inc({'channel': channel})
+        return False
+
+
+    def submit(self, channel, sendFunc, onSuccess=None, onDone=None):
+        """Send a notification in the background
+
+        Args:
+            channel (str): name of the channel (e.g., 'email')
+            sendFunc: function without arguments that sends the notification and returns truthy value on success
+            onSuccess: optional function called after notification is sent
+            onDone: optional function called after notification is sent or given up (e.g., to delete files)
+
+        Returns:
+            Future with True if notification was sent, False otherwise
+        """
+        def task():
+            try:
+                return self._sendWithRetries(channel, sendFunc, onSuccess)
+            finally:
+                if onDone:
+                    onDone()
+        return self._getExecutor(channel).submit(task)
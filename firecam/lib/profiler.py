@@ -0,0 +1,101 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Sampling profiler for long running loops (e.g. detect_fire).  Runs cProfile
+on a random fraction of loop iterations and saves the results as rotating
+pstats files, which can be viewed with standard tools (e.g. snakeviz, or
+flameprof/gprof2dot for flamegraphs).  Also logs how much time was spent in
+the named pipeline stages.
+
+"""
+
+import os
+import logging
+import random
+import cProfile
+import pstats
+
+# functions that mark the major stages of the detection pipeline
+STAGE_FUNCTIONS = ['getNextImage', '_segmentAndClassify', '_recordScores', '_postFilter', 'alertFire']
+
+
+def getStageTimes(stats, stageFunctions=STAGE_FUNCTIONS):
+    """Get cumulative time spent in each of the given functions
+
+    Args:
+        stats (pstats.Stats): profile statistics
+        stageFunctions (list): names of the functions of interest
+
+    Returns:
+        Dictionary mapping function name to cumulative seconds
+    """
+    stageTimes = {}
+    for ((fileName, lineNum, funcName), funcStats) in stats.stats.items():
+        if funcName in stageFunctions:
+            cumulativeTime = funcStats[3]
+            stageTimes[funcName] = stageTimes.get(funcName, 0) + cumulativeTime
+    return stageTimes
+
+
+class SamplingProfiler(object):
+    def __init__(self, fraction, outputDir, maxFiles=20):
+        """Profiler that profiles only a random fraction of loop iterations
+
+        Args:
+            fraction (float): fraction (0-1) of iterations to profile
+            outputDir (str): local directory for the pstats files
+            maxFiles (int): number of most recent pstats files to keep
+        """
+        self.fraction = fraction
+        self.outputDir = outputDir
+        self.maxFiles = maxFiles
+        self.profile = None
+        self.numProfiled = 0
+        os.makedirs(outputDir, exist_ok=True)
+        logging.warning('Profiling %.1f%% of iterations into %s', fraction*100, outputDir)
+
+
+    def start(self):
+        """Call at start of each loop iteration. Randomly decides whether to profile it
+        """
+        if self.profile or (random.random() >= self.fraction):
+            return
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+
+    def stop(self):
+        """Call at end of each loop iteration. Saves results if iteration was profiled
+        """
+        if not self.profile:
+            return
+        self.profile.disable()
+        stats = pstats.Stats(self.profile)
+        self.profile = None
+        self.numProfiled += 1
+        fileName = 'profile_%d_%06d.pstats' % (os.getpid(), self.numProfiled)
+        stats.dump_stats(os.path.join(self.outputDir, fileName))
+        self._rotateFiles()
+        stageTimes = getStageTimes(stats)
+        stageStr = ', '.join('%s=%.3f' % (name, stageTimes[name]) for name in STAGE_FUNCTIONS if name in stageTimes)
+        logging.warning('Profile %s: total=%.3f %s', fileName, stats.total_tt, stageStr)
+
+
+    def _rotateFiles(self):
+        prefix = 'profile_%d_' % os.getpid()
+        files = sorted(filter(lambda x: x.startswith(prefix), os.listdir(self.outputDir)))
+        for oldFile in files[:-self.maxFiles]:
+            os.remove(os.path.join(self.outputDir, oldFile))
@@ -120,14 +120,19 @@ def cutBoxesArray(imgOrig):
     above to calculate the exact start and end of each square
 
     Args:
-        imgOrig (Image): Image object of the original image
+        imgOrig (Image): Image object of the original image (or HxWx3 uint8 numpy array,
+                         e.g. from img_archive.diffImages(asArray=True))
 
     Returns:
         (list, list): pair of lists (cropped numpy arrays) and (metadata on boundaries)
     """
     segmentSize = 299
-    xRanges = getSegmentRanges(imgOrig.size[0], segmentSize)
-    yRanges = getSegmentRanges(imgOrig.size[1], segmentSize)
+    if isinstance(imgOrig, np.ndarray):
+        (height, width) = imgOrig.shape[:2]
+    else:
+        (width, height) = imgOrig.size
+    xRanges = getSegmentRanges(width, segmentSize)
+    yRanges = getSegmentRanges(height, segmentSize)
 
     crops = []
     segments = []
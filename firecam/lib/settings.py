@@ -43,28 +43,80 @@ def findSettingsFile():
     raise Exception('Could not locate settings file')
 
 
-def readSettingsFile():
-    """Read the settings JSON file and parse into a dict
+def getSettingsPath():
+    """Get the path of the settings file from OCT_FIRE_SETTINGS env or usual locations
 
     Returns:
-        dict with parsed settings JSON
+        (string) path to file
     """
     settingsPath = os.environ['OCT_FIRE_SETTINGS']
     if not settingsPath:
         settingsPath = findSettingsFile()
-    settingsStr = goog_helper.readFile(settingsPath)
+    return settingsPath
+
+
+def readSettingsFile(settingsPath=None):
+    """Read the settings JSON file and parse into a dict
+
+    Args:
+        settingsPath (str): optional path (default: getSettingsPath())
+
+    Returns:
+        dict with parsed settings JSON
+    """
+    settingsStr = goog_helper.readFile(settingsPath or getSettingsPath())
     settingsDict = json.loads(settingsStr)
     # logging.warning('settings %s', settingsDict)
     return settingsDict
 
 
-# set module attributes based on json file data
-settingsJson = readSettingsFile()
-for (key, val) in settingsJson.items():
-    setattr(sys.modules[__name__], key, val)
-    # set environment variable GOOGLE_APPLICATION_CREDENTIALS if value is specified in config
-    if (key == 'gcpServiceKey') and val and not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = val
+def getSettingsMtime(settingsPath):
+    """Get modification time of local settings file (None for GCS files)
+    """
+    if goog_helper.parseGCSPath(settingsPath):
+        return None
+    return os.path.getmtime(settingsPath)
+
+
+def applySettings(settingsDict):
+    # set module attributes based on json file data
+    for (key, val) in settingsDict.items():
+        setattr(sys.modules[__name__], key, val)
+        # set environment variable GOOGLE_APPLICATION_CREDENTIALS if value is specified in config
+        if (key == 'gcpServiceKey') and val and not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
+            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = val
+
+
+def reloadIfChanged():
+    """Re-read the settings file if it was modified since it was last read,
+       and update the module attributes with the new values.  Settings removed
+       from the file keep their old values.
+
+    Returns:
+        list of names of settings whose values changed
+    """
+    global settingsMtime
+    mtime = getSettingsMtime(settingsPath)
+    if (mtime == None) or (mtime == settingsMtime):
+        return []
+    try:
+        newSettings = readSettingsFile(settingsPath)
+    except Exception as e: # e.g., file is being written
+        logging.error('Error reloading settings from %s: %s', settingsPath, str(e))
+        return []
+    settingsMtime = mtime
+    module = sys.modules[__name__]
+    changedKeys = [key for (key, val) in newSettings.items() if getattr(module, key, None) != val]
+    applySettings({key: newSettings[key] for key in changedKeys})
+    if changedKeys:
+        logging.warning('Reloaded settings %s: %s', settingsPath, changedKeys)
+    return changedKeys
+
+
+settingsPath = getSettingsPath()
+settingsMtime = getSettingsMtime(settingsPath)
+settingsJson = readSettingsFile(settingsPath)
+applySettings(settingsJson)
 
 
 # configure logging module to add timestamps and pid, and to silence useless logs
@@ -0,0 +1,232 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Shard cameras across detection workers (possibly on different VMs).  Workers
+register and heartbeat in the workers SQL table, and cameras are assigned to
+the live workers by consistent hashing, so each camera is always processed by
+the same worker (keeping its per-camera state and caches local), and only the
+cameras of workers that join or die move when membership changes.
+
+"""
+
+import os
+import logging
+import socket
+import time
+import hashlib
+import bisect
+import threading
+
+# points on the hash ring per worker.  More points give more even distribution
+RING_REPLICAS = 100
+# seconds between heartbeats (and checks for membership changes)
+HEARTBEAT_SECONDS = 30
+# workers without heartbeat for this long are considered dead
+DEAD_SECONDS = 3*HEARTBEAT_SECONDS
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    def __init__(self, workerIDs, replicas=RING_REPLICAS):
+        """Consistent hash ring mapping keys to given workers
+
+        Args:
+            workerIDs (list): IDs of all live workers
+            replicas (int): points on the ring per worker
+        """
+        self.workerIDs = sorted(workerIDs)
+        points = []
+        for workerID in self.workerIDs:
+            for i in range(replicas):
+                points.append((_hash('%s#%d' % (workerID, i)), workerID))
+        points.sort()
+        self.hashes = [point[0] for point in points]
+        self.owners = [point[1] for point in points]
+
+
+    def getWorker(self, key):
+        """Get the worker assigned to given key (None if there are no workers)
+
+        Args:
+            key (str): key to look up (e.g., camera name)
+        """
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, _hash(key)) % len(self.hashes)
+        return self.owners[index]
+
+
+def getDefaultWorkerID():
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+def _rollback(dbManager):
+    """Roll back the failed transaction (postgres rejects all later statements until then)
+
+    Returns:
+        the given dbManager, or None if the connection is broken and must be recreated
+    """
+    if not dbManager:
+        return None
+    try:
+        dbManager.conn.rollback()
+        return dbManager
+    except Exception as e:
+        logging.error('Rollback failed, reconnecting: %s', str(e))
+        return None
+
+
+class WorkerMembership(object):
+    def __init__(self, dbManager, workerID=None):
+        """Membership of this detection worker in the group of workers sharing the cameras
+
+        Args:
+            dbManager (DbManager):
+            workerID (str): unique ID of this worker (default: hostname-pid)
+        """
+        self.dbManager = dbManager
+        self.workerID = workerID or getDefaultWorkerID()
+        self.startTime = int(time.time())
+        self.nextHeartbeat = 0
+        self.ring = None
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+
+
+    def _heartbeat(self, dbManager, timeNow):
+        sqlStr = "DELETE FROM workers WHERE WorkerID = '%s' OR Heartbeat < %d" % (self.workerID, timeNow - 10*DEAD_SECONDS)
+        dbManager.execute(sqlStr, commit=False)
+        dbRow = {
+            'WorkerID': self.workerID,
+            'Hostname': socket.gethostname(),
+            'Pid': os.getpid(),
+            'StartTime': self.startTime,
+            'Heartbeat': timeNow,
+        }
+        dbManager.add_data('workers', dbRow)
+
+
+    def getLiveWorkers(self, timeNow, dbManager=None):
+        """Get IDs of all workers with recent heartbeats
+
+        Args:
+            timeNow (int): current time
+            dbManager (DbManager): optional DB connection to use instead of the default one
+
+        Returns:
+            sorted list of worker IDs
+        """
+        sqlStr = 'SELECT WorkerID FROM workers WHERE Heartbeat > %d' % (timeNow - DEAD_SECONDS)
+        return sorted(row['workerid'] for row in (dbManager or self.dbManager).query(sqlStr))
+
+
+    def _update(self, dbManager, timeNow):
+        self._heartbeat(dbManager, timeNow)
+        liveWorkers = self.getLiveWorkers(timeNow, dbManager)
+        if self.workerID not in liveWorkers:
+            liveWorkers = sorted(liveWorkers + [self.workerID])
+        if self.ring and (self.ring.workerIDs == liveWorkers):
+            return False
+        logging.warning('Worker %s: rebalancing cameras across %d workers: %s', self.workerID, len(liveWorkers), liveWorkers)
+        self.ring = HashRing(liveWorkers)
+        return True
+
+
+    def refresh(self, timeNow=None):
+        """Heartbeat and check for membership changes, if due
+
+        Args:
+            timeNow (int): current time (default: now)
+
+        Returns:
+            True if the camera assignments (may) have changed
+        """
+        timeNow = timeNow or int(time.time())
+        if timeNow < self.nextHeartbeat:
+            return False
+        self.nextHeartbeat = timeNow + HEARTBEAT_SECONDS
+        with self.lock:
+            return self._update(self.dbManager, timeNow)
+
+
+    def startHeartbeat(self, dbManagerFactory):
+        """Heartbeat and check for membership changes from a daemon thread, so that
+        slow iterations of the detection loop (e.g. sending alerts) don't make
+        this worker look dead.  Use checkChanged() to pick up new assignments.
+
+        Args:
+            dbManagerFactory: function returning a new DbManager for the thread
+                              (DB connections cannot be shared across threads)
+        """
+        thread = threading.Thread(target=self._heartbeatLoop, args=(dbManagerFactory,), daemon=True)
+        thread.start()
+
+
+    def _heartbeatLoop(self, dbManagerFactory):
+        dbManager = None
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            with self.lock:
+                if self.stopped.is_set():
+                    return
+                try:
+                    dbManager = dbManager or dbManagerFactory()
+                    if self._update(dbManager, int(time.time())):
+                        self.changed.set()
+                except Exception as e:
+                    logging.error('Worker %s heartbeat failed: %s', self.workerID, str(e))
+                    dbManager = _rollback(dbManager)
+
+
+    def checkChanged(self):
+        """Check (and clear) whether the heartbeat thread found membership changes
+
+        Returns:
+            True if the camera assignments (may) have changed since last check
+        """
+        if not self.changed.is_set():
+            return False
+        self.changed.clear()
+        return True
+
+
+    def isAssigned(self, cameraID):
+        """Check if given camera is assigned to this worker
+        """
+        return self.ring.getWorker(cameraID) == self.workerID
+
+
+    def filterCameras(self, cameras):
+        """Get the subset of given cameras assigned to this worker
+
+        Args:
+            cameras (list): list of camera dicts (from get_sources)
+
+        Returns:
+            list of the same camera dicts that belong to this worker
+        """
+        return list(filter(lambda x: self.isAssigned(x['name']), cameras))
+
+
+    def leave(self):
+        """Remove this worker from membership so its cameras move to other workers immediately
+        """
+        with self.lock:
+            self.stopped.set()
+            self.dbManager.execute("DELETE FROM workers WHERE WorkerID = '%s'" % self.workerID)
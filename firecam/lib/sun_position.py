@@ -0,0 +1,89 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Approximate position of the sun for given location and time.  Uses the NOAA
+general solar position equations, which are accurate to within a fraction of
+a degree, which is plenty for deciding whether it is day or night at a camera
+
+"""
+
+import math
+import datetime
+
+# Sun elevation (degrees) below which it is considered night.  -6 is the end of
+# civil twilight, after which visible light cameras produce mostly dark images
+NIGHT_ELEVATION = -6
+
+
+def getSunElevation(latitude, longitude, timestamp):
+    """Calculate the elevation angle of the sun above the horizon
+
+    Args:
+        latitude (float): latitude of the observer (degrees, north positive)
+        longitude (float): longitude of the observer (degrees, east positive)
+        timestamp (int): time.time() value for time of interest
+
+    Returns:
+        Elevation of the sun in degrees (negative values are below the horizon)
+    """
+    dt = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+    dayOfYear = dt.timetuple().tm_yday
+    hours = dt.hour + dt.minute/60 + dt.second/3600
+    # fractional year in radians
+    gamma = 2*math.pi/365 * (dayOfYear - 1 + (hours - 12)/24)
+    # equation of time (minutes) and solar declination (radians)
+    eqTime = 229.18*(0.000075 + 0.001868*math.cos(gamma) - 0.032077*math.sin(gamma)
+                     - 0.014615*math.cos(2*gamma) - 0.040849*math.sin(2*gamma))
+    decl = (0.006918 - 0.399912*math.cos(gamma) + 0.070257*math.sin(gamma)
+            - 0.006758*math.cos(2*gamma) + 0.000907*math.sin(2*gamma)
+            - 0.002697*math.cos(3*gamma) + 0.00148*math.sin(3*gamma))
+    trueSolarMinutes = hours*60 + eqTime + 4*longitude
+    hourAngle = math.radians(trueSolarMinutes/4 - 180)
+    latRad = math.radians(latitude)
+    cosZenith = (math.sin(latRad)*math.sin(decl) +
+                 math.cos(latRad)*math.cos(decl)*math.cos(hourAngle))
+    cosZenith = min(max(cosZenith, -1), 1) # guard against rounding errors
+    return 90 - math.degrees(math.acos(cosZenith))
+
+
+def isNight(latitude, longitude, timestamp):
+    """Check if the sun is far enough below horizon to consider it night time
+
+    Args:
+        latitude (float): latitude of the observer
+        longitude (float): longitude of the observer
+        timestamp (int): time.time() value for time of interest
+
+    Returns:
+        True if it is night at given location and time
+    """
+    return getSunElevation(latitude, longitude, timestamp) < NIGHT_ELEVATION
+
+
+def updateCameraNight(camera, timestamp):
+    """Update the 'isNight' flag of given camera if its location is known
+
+    Args:
+        camera (dict): camera information (with optional latitude and longitude)
+        timestamp (int): time.time() value for time of interest
+
+    Returns:
+        True if it is night at the camera (False if location is unknown)
+    """
+    if 'latitude' not in camera:
+        return False
+    camera['isNight'] = isNight(camera['latitude'], camera['longitude'], timestamp)
+    return camera['isNight']
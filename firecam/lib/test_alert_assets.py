@@ -0,0 +1,81 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test alert_assets
+
+"""
+
+from firecam.lib import settings # settings must be imported before goog_helper (circular import)
+from firecam.lib import alert_assets
+from firecam.lib import img_archive
+import os
+import time
+import threading
+import pytest
+
+ALERT_TIME = 1600000000
+
+
+def makeFetcher(calls):
+    lock = threading.Lock()
+    def fetchFunc(outputDir, cameraID, desiredDT):
+        unixTime = int(time.mktime(desiredDT.timetuple()))
+        with lock:
+            calls.append(unixTime)
+        imgPath = img_archive.getImgPath(outputDir, cameraID, unixTime)
+        with open(imgPath, 'wb') as f:
+            f.write(b'archive')
+        return [imgPath]
+    return fetchFunc
+
+
+def testFetchOnceForAllConsumers():
+    calls = []
+    cache = alert_assets.AlertAssetCache(makeFetcher(calls))
+    clipImages = cache.getImages('cam1', ALERT_TIME, 5, 1)
+    emailImages = cache.getImages('cam1', ALERT_TIME, 3, 1)
+    assert sorted(calls) == [ALERT_TIME - minutes*60 for minutes in range(5, 0, -1)]
+    assert len(clipImages) == 5
+    assert emailImages == clipImages[2:]
+    times = [img_archive.parseFilename(x)['unixTime'] for x in clipImages]
+    assert times == sorted(times)
+
+
+def testRingBufferSkipsFetch():
+    calls = []
+    ringBuffer = alert_assets.FrameRingBuffer(10*60)
+    for minutes in range(6, 0, -1):
+        ringBuffer.add('cam1', ALERT_TIME - minutes*60 + 10, b'buffered')
+    cache = alert_assets.AlertAssetCache(makeFetcher(calls), ringBuffer)
+    images = cache.getImages('cam1', ALERT_TIME, 5, 1)
+    assert calls == []
+    assert len(images) == 5
+    with open(images[0], 'rb') as f:
+        assert f.read() == b'buffered'
+    # frames of other cameras are not used
+    assert len(cache.getImages('cam2', ALERT_TIME, 5, 1)) == 5
+    assert len(calls) == 5
+
+
+def testEvictAfterBudget():
+    cache = alert_assets.AlertAssetCache(makeFetcher([]), budgetSeconds=60)
+    images = cache.getImages('cam1', ALERT_TIME, 5, 1)
+    assert os.path.isfile(images[0])
+    cache.evict(time.time() + 30)
+    assert os.path.isfile(images[0])
+    cache.evict(time.time() + 120)
+    assert not os.path.isfile(images[0])
+    assert cache.entries == {}
@@ -0,0 +1,72 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test alert_timings
+
+"""
+
+from firecam.lib import alert_timings
+from firecam.lib import db_manager
+import io
+import concurrent.futures
+import datetime
+import pytest
+from PIL import Image
+
+
+def testCaptureTimeHttp():
+    (captureTime, source) = alert_timings.getCaptureTime(lastModified='Wed, 21 Oct 2015 07:28:00 GMT')
+    assert captureTime == 1445412480
+    assert source == 'http'
+
+
+def testCaptureTimeExif():
+    exif = Image.Exif()
+    exif[306] = '2020:06:01 12:30:00' # DateTime
+    imgBytes = io.BytesIO()
+    Image.new('RGB', (16, 16)).save(imgBytes, format='JPEG', exif=exif)
+    (captureTime, source) = alert_timings.getCaptureTime(imgBytes.getvalue(), 'garbage')
+    assert captureTime == datetime.datetime(2020, 6, 1, 12, 30).timestamp()
+    assert source == 'exif'
+    assert alert_timings.getCaptureTime() == (None, None)
+
+
+def testSaveAndReport(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    alertTimer = alert_timings.AlertTimer('cam1', 1000, 900.0, 'http', 1000.0, 1010.0)
+    alertTimer.markChannel('db')
+    alertTimer.markChannel('email')
+    alertTimer.channels = [('db', 1012.0), ('email', 1030.0)]
+    alertTimer.save(dbManager)
+    timingRows = dbManager.query('SELECT * FROM alert_timings')
+    stats = alert_timings.getLatencyStats(timingRows, 'channel')
+    assert stats['email']['p50'] == 130
+    assert stats['db']['capture'] == 100
+    assert stats['db']['detect'] == 10
+    assert alert_timings.getLatencyStats(timingRows, 'cameraname')['cam1']['count'] == 2
+
+
+def testSavePendingTimers(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    alertTimer = alert_timings.AlertTimer('cam1', 1000, 900.0, 'http', 1000.0, 1010.0)
+    alertTimer.markChannel('db')
+    neverDone = concurrent.futures.Future()
+    alertTimer.addPending([neverDone])
+    pendingTimers = [alertTimer]
+    alert_timings.savePendingTimers(pendingTimers, dbManager, timeout=0.1)
+    assert pendingTimers == []
+    timingRows = dbManager.query('SELECT * FROM alert_timings')
+    assert [x['channel'] for x in timingRows] == ['db']
@@ -0,0 +1,56 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test annotate
+
+"""
+
+from firecam.lib import annotate
+import pytest
+from PIL import Image, ImageDraw
+
+
+def testFontAndLayerCache():
+    assert annotate.getFont(32) is annotate.getFont(32)
+    layer = annotate.getTextLayer(annotate.WATERMARK_TEXT, 32, 'orange')
+    assert layer is annotate.getTextLayer(annotate.WATERMARK_TEXT, 32, 'orange')
+    assert layer.mode == 'RGBA'
+
+
+def testOutline():
+    layer = annotate.getTextLayer('2020', 32, 'orange', outlineColor='black', outlineWidth=2)
+    colors = set(color for (count, color) in layer.getcolors(layer.size[0] * layer.size[1]) if color[3] == 255)
+    assert (0, 0, 0, 255) in colors
+    assert (255, 165, 0, 255) in colors
+
+
+def testDrawMatchesImageDraw():
+    # compositing the cached layer gives same result as drawing text directly
+    expected = Image.new('RGB', (600, 100), 'white')
+    ImageDraw.Draw(expected).text((10, 20), annotate.WATERMARK_TEXT, font=annotate.getFont(32), fill='orange')
+    img = Image.new('RGB', (600, 100), 'white')
+    annotate.drawText(img, (10, 20), annotate.WATERMARK_TEXT, 32, 'orange')
+    diffs = [abs(a - b) for (a, b) in zip(img.tobytes(), expected.tobytes())]
+    assert max(diffs) <= 2
+
+
+def testTimestampAndWatermark():
+    img = Image.new('RGB', (600, 400), 'white')
+    annotate.drawTimestamp(img, 1600000000)
+    annotate.drawWatermark(img)
+    assert img.getpixel((0, 0)) == (255, 255, 255)
+    assert img.crop((0, 0, 400, 40)).convert('L').getextrema()[0] < 10 # black outline
+    assert img.crop((0, 340, 600, 400)).convert('L').getextrema()[0] < 255
@@ -0,0 +1,120 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test camera_health
+
+"""
+
+from firecam.lib import camera_health
+from firecam.lib import db_manager
+from firecam.lib import sun_position
+import calendar
+import datetime
+import pytest
+from PIL import Image
+
+
+def testBackoff():
+    assert camera_health.getBackoffSeconds(1) == 0
+    assert camera_health.getBackoffSeconds(camera_health.UNHEALTHY_FAILURES) == camera_health.BACKOFF_BASE_SECONDS
+    assert camera_health.getBackoffSeconds(camera_health.UNHEALTHY_FAILURES + 2) == 4*camera_health.BACKOFF_BASE_SECONDS
+    assert camera_health.getBackoffSeconds(100) == camera_health.BACKOFF_MAX_SECONDS
+
+
+def testFailuresAndRecovery(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    health = camera_health.CameraHealth(dbManager)
+    for i in range(camera_health.UNHEALTHY_FAILURES):
+        assert health.isDue('cam1', 1000 + i)
+        health.recordFailure('cam1', 1000 + i, "fetch error: can't connect")
+    assert not health.isDue('cam1', 1010)
+    assert health.isDue('cam2', 1010)
+
+    # state is persisted for other processes and restarts
+    reloaded = camera_health.CameraHealth(dbManager)
+    assert reloaded.states['cam1']['status'] == 'unhealthy'
+    assert reloaded.states['cam1']['failures'] == camera_health.UNHEALTHY_FAILURES
+    assert not reloaded.isDue('cam1', 1010)
+
+    reloaded.recordSuccess('cam1', 2000)
+    assert reloaded.isDue('cam1', 2001)
+    rows = dbManager.query("SELECT * FROM camera_health WHERE CameraName = 'cam1'")
+    assert len(rows) == 1
+    assert rows[0]['status'] == 'healthy'
+    assert rows[0]['failures'] == 0
+
+
+def testSharedAcrossProcesses(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    healthA = camera_health.CameraHealth(dbManager)
+    healthB = camera_health.CameraHealth(dbManager)
+    # failures recorded by either process add up
+    for i in range(camera_health.UNHEALTHY_FAILURES):
+        health = healthA if i % 2 else healthB
+        health.recordFailure('cam1', 1000 + i, 'fetch error')
+    rows = dbManager.query("SELECT * FROM camera_health WHERE CameraName = 'cam1'")
+    assert len(rows) == 1
+    assert rows[0]['failures'] == camera_health.UNHEALTHY_FAILURES
+
+    # backoff becomes visible to other process once its state is refreshed
+    healthA.lastRefresh -= camera_health.REFRESH_SECONDS
+    assert not healthA.isDue('cam1', 1010)
+    assert not healthB.isDue('cam1', 1010)
+
+
+def testImageChecks(tmp_path):
+    uniformPath = str(tmp_path / 'uniform.jpg')
+    Image.new('RGB', (800, 600), (0, 0, 0)).save(uniformPath, format='JPEG')
+    assert 'uniform' in camera_health.checkImageStats(camera_health.getImageStats(uniformPath))
+
+    smallPath = str(tmp_path / 'small.jpg')
+    Image.effect_noise((200, 100), 64).convert('RGB').save(smallPath, format='JPEG')
+    assert 'resolution' in camera_health.checkImageStats(camera_health.getImageStats(smallPath))
+
+    validPath = str(tmp_path / 'valid.jpg')
+    Image.effect_noise((800, 600), 64).convert('RGB').save(validPath, format='JPEG')
+    imgStats = camera_health.getImageStats(validPath)
+    assert imgStats['size'] == (800, 600)
+    assert camera_health.checkImageStats(imgStats) == None
+
+
+def testDuplicateRows(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    for (failures, lastFailure) in [(4, 1200), (2, 1100)]:
+        dbManager.add_data('camera_health', {'CameraName': 'cam1', 'Status': 'unhealthy', 'Reason': 'x',
+                                             'Failures': failures, 'LastSuccess': 0, 'LastFailure': lastFailure,
+                                             'NextCheck': lastFailure + 600})
+    health = camera_health.CameraHealth(dbManager)
+    assert health.states['cam1']['failures'] == 4
+    assert not health.isDue('cam1', 1500)
+    health.recordFailure('cam1', 1300, 'fetch error')
+    rows = dbManager.query("SELECT * FROM camera_health WHERE CameraName = 'cam1'")
+    assert len(rows) == 1
+    assert rows[0]['failures'] == 5
+
+
+def testDarkNightImage(tmp_path):
+    # without night scan throttling, night is still detected for cameras with known location
+    camera = {'name': 'cam1', 'latitude': 32.7, 'longitude': -117.16}
+    nightTime = calendar.timegm(datetime.datetime(2020, 6, 21, 7, 50).timetuple())
+    assert sun_position.updateCameraNight(camera, nightTime)
+    darkPath = str(tmp_path / 'dark.jpg')
+    Image.new('RGB', (800, 600), (3, 3, 3)).save(darkPath, format='JPEG')
+    imgStats = camera_health.getImageStats(darkPath)
+    assert camera_health.isDarkNightImage(imgStats, camera['isNight'])
+    # same image during the day is a malfunction
+    assert not camera_health.isDarkNightImage(imgStats, False)
+    assert 'uniform' in camera_health.checkImageStats(imgStats)
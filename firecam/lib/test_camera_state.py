@@ -0,0 +1,56 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test camera_state
+
+"""
+
+from firecam.lib import camera_state
+import pytest
+
+
+def testRestoreAfterRestart(tmp_path):
+    stateFile = str(tmp_path / 'state.db')
+    store = camera_state.CameraStateStore(stateFile, flushSeconds=1000)
+    camera = {'name': 'cam1', 'url': 'http://x/y.jpg'}
+    store.track(camera)
+    camera['md5'] = 'abc'
+    camera['etag'] = '"123"'
+    camera['unrelated'] = 'not saved'
+    store.flush()
+
+    # new store simulates process restart
+    restarted = camera_state.CameraStateStore(stateFile, flushSeconds=1000)
+    cameraNew = {'name': 'cam1', 'url': 'http://x/y.jpg'}
+    restarted.track(cameraNew)
+    assert cameraNew['md5'] == 'abc'
+    assert cameraNew['etag'] == '"123"'
+    assert 'unrelated' not in cameraNew
+
+    otherCamera = {'name': 'cam2'}
+    restarted.track(otherCamera)
+    assert 'md5' not in otherCamera
+
+
+def testFlushOnlyChanges(tmp_path):
+    store = camera_state.CameraStateStore(str(tmp_path / 'state.db'), flushSeconds=1000)
+    camera = {'name': 'cam1'}
+    store.track(camera)
+    store.flush()
+    assert store._getConn().execute('SELECT count(*) FROM camera_state').fetchone()[0] == 0
+    camera['md5'] = 'abc'
+    store.flush()
+    assert store._getConn().execute('SELECT count(*) FROM camera_state').fetchone()[0] == 1
@@ -0,0 +1,30 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test db_manager
+
+"""
+
+from firecam.lib import db_manager
+import pytest
+
+
+def testConfigVersion(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    assert dbManager.getConfigVersion() == 0
+    assert dbManager.bumpConfigVersion() == 1
+    assert dbManager.bumpConfigVersion() == 2
+    assert dbManager.getConfigVersion() == 2
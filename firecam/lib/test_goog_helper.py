@@ -0,0 +1,80 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test goog_helper
+
+"""
+
+from firecam.lib import settings # settings must be imported before goog_helper (circular import)
+from firecam.lib import goog_helper
+import json
+import time
+import concurrent.futures
+import pytest
+
+
+class FlakyPublisher(goog_helper.FilePublisher):
+    def __init__(self, filePath, numFailures):
+        super().__init__(filePath)
+        self.numFailures = numFailures
+
+    def publish(self, topicPath, data):
+        if self.numFailures > 0:
+            self.numFailures -= 1
+            future = concurrent.futures.Future()
+            future.set_exception(Exception('unavailable'))
+            return future
+        return super().publish(topicPath, data)
+
+
+def testAsyncPublisher(tmp_path):
+    msgFile = str(tmp_path / 'msgs.jsonl')
+    client = FlakyPublisher(msgFile, 1)
+    publisher = goog_helper.AsyncPublisher(client, client.topic_path('proj', 'topic'), maxInFlight=2, retrySeconds=0.05)
+    delivered = publisher.publish({'id': 1})
+    assert len(publisher.failed) == 1
+    assert not delivered.done()
+    publisher.publish({'id': 2})
+    # first message is retried in the background without further publish calls
+    for i in range(100):
+        if publisher.numPublished == 2:
+            break
+        time.sleep(0.05)
+    publisher.publish({'id': 3})
+    assert publisher.flush(timeout=5)
+    assert publisher.numPublished == 3
+    assert not publisher.failed
+    assert delivered.result(timeout=5)
+    with open(msgFile) as f:
+        messages = [json.loads(line) for line in f]
+    assert messages[0]['topic'] == 'projects/proj/topics/topic'
+    assert sorted(json.loads(x['data'])['id'] for x in messages) == [1, 2, 3]
+
+
+def testAsyncPublisherClose(tmp_path):
+    msgFile = str(tmp_path / 'msgs.jsonl')
+    client = FlakyPublisher(msgFile, 1)
+    publisher = goog_helper.AsyncPublisher(client, client.topic_path('proj', 'topic'), retrySeconds=3600)
+    publisher.publish({'id': 1})
+    assert len(publisher.failed) == 1
+    publisher.close(timeout=5) # final retry at shutdown
+    assert not publisher.failed
+    assert publisher.numPublished == 1
+
+    client.numFailures = 2
+    dropped = publisher.publish({'id': 2})
+    publisher.close(timeout=5)
+    assert dropped.exception(timeout=5)
@@ -0,0 +1,73 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test image_cache
+
+"""
+
+from firecam.lib import image_cache
+import os
+import time
+import pytest
+
+
+def makeFetcher(calls, size=100):
+    def fetchFunc(filePath):
+        calls.append(filePath)
+        with open(filePath, 'wb') as f:
+            f.write(b'x' * size)
+    return fetchFunc
+
+
+def testFetchOnce(tmp_path):
+    cache = image_cache.ImageCache(str(tmp_path / 'cache'), 10000)
+    calls = []
+    destPath = str(tmp_path / 'out.jpg')
+    assert cache.copyTo('cam1', 1600000000, makeFetcher(calls), destPath) == destPath
+    assert cache.copyTo('cam1', 1600000000, makeFetcher(calls), str(tmp_path / 'out2.jpg'))
+    assert len(calls) == 1
+    assert os.path.getsize(str(tmp_path / 'out2.jpg')) == 100
+    # new cache object (e.g. another process) sees the same files
+    otherCache = image_cache.ImageCache(str(tmp_path / 'cache'), 10000)
+    assert otherCache.get('cam1', 1600000000)
+    assert not otherCache.get('cam2', 1600000000)
+
+
+def testFailedFetch(tmp_path):
+    cache = image_cache.ImageCache(str(tmp_path / 'cache'), 10000)
+    def failingFetch(filePath):
+        with open(filePath, 'wb') as f:
+            f.write(b'partial')
+        return False
+    assert cache.put('cam1', 1600000000, failingFetch) == None
+    assert not cache.get('cam1', 1600000000)
+    assert os.listdir(os.path.join(str(tmp_path / 'cache'), 'cam1')) == []
+
+
+def testLruEviction(tmp_path):
+    cache = image_cache.ImageCache(str(tmp_path / 'cache'), 1000)
+    calls = []
+    for i in range(9):
+        cachePath = cache.put('cam1', i, makeFetcher(calls))
+        oldTime = time.time() - 1000 + i
+        os.utime(cachePath, (oldTime, oldTime))
+    cache.get('cam1', 0) # recently used, so it survives eviction
+    cache.put('cam1', 9, makeFetcher(calls))
+    cache.put('cam1', 10, makeFetcher(calls))
+    assert cache.totalBytes <= 900
+    assert cache.get('cam1', 0)
+    assert not cache.get('cam1', 1)
+    assert cache.get('cam1', 10)
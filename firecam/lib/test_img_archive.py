@@ -0,0 +1,383 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test img_archive
+
+"""
+
+from firecam.lib import settings # settings must be imported before goog_helper (circular import)
+from firecam.lib import img_archive
+import os
+import time
+import datetime
+import array
+import random
+import shutil
+import subprocess
+import pytest
+from firecam.lib import image_cache
+from firecam.lib import rect_to_squares
+import numpy as np
+from PIL import Image, ImageStat, ImageMath
+
+DIR_HTML = '<html><a href="1600000000.jpg">a</a><a href="1600000060.jpg">b</a><a href="Q1.mp4">c</a></html>'
+
+
+class FakeResp(object):
+    def __init__(self, html):
+        self.html = html
+
+    def read(self):
+        return self.html.encode('utf-8')
+
+
+@pytest.fixture
+def fetchCounter(tmp_path, monkeypatch):
+    monkeypatch.setattr(img_archive, 'listingCacheDir', str(tmp_path / 'listings'))
+    calls = []
+    def fakeFetch(url, verboseLogs):
+        calls.append(url)
+        if 'missing' in url:
+            return (None, 404)
+        if 'timeout' in url:
+            return (None, None)
+        return ('dir', FakeResp(DIR_HTML))
+    monkeypatch.setattr(img_archive, 'fetchImgOrDir', fakeFetch)
+    return calls
+
+
+def testSaveImageData(tmp_path):
+    imgPath = str(tmp_path / 'img.jpg')
+    img_archive.saveImageData(imgPath, None)
+    assert not os.path.isfile(imgPath)
+    img_archive.saveImageData(imgPath, b'abc')
+    img_archive.saveImageData(imgPath, b'xyz') # existing file is kept
+    with open(imgPath, 'rb') as f:
+        assert f.read() == b'abc'
+
+
+def testListingCache(fetchCounter):
+    urlParts = ['http://c1.hpwren.ucsd.edu/archive', 'cam', 'large', '20200101', 'Q1']
+    times = img_archive.listTimesinQ(urlParts, False)
+    assert times == [{'time': 1600000000}, {'time': 1600000060}]
+    assert img_archive.listTimesinQ(urlParts, False) == times
+    assert len(fetchCounter) == 1
+    # different file type of same URL is cached separately
+    assert img_archive.readUrlDir(urlParts, False, '.mp4') == ['Q1.mp4']
+    assert len(fetchCounter) == 2
+
+
+def testListingCacheExpiry(fetchCounter):
+    todayDir = datetime.date.today().strftime('%Y%m%d')
+    urlParts = ['http://c1.hpwren.ucsd.edu/archive', 'cam', 'large', todayDir, 'Q1']
+    img_archive.listTimesinQ(urlParts, False)
+    cachePath = img_archive.getListingCachePath('/'.join(urlParts), '.jpg')
+    oldTime = time.time() - img_archive.LISTING_TTL_RECENT - 10
+    os.utime(cachePath, (oldTime, oldTime))
+    img_archive.listTimesinQ(urlParts, False)
+    assert len(fetchCounter) == 2
+
+
+def testListingCacheMissingDir(fetchCounter):
+    pastParts = ['http://c1.hpwren.ucsd.edu/archive', 'cam', 'large', 'missing', '20200101', 'Q1']
+    assert img_archive.listTimesinQ(pastParts, False) == None
+    assert img_archive.listTimesinQ(pastParts, False) == None
+    assert len(fetchCounter) == 1
+    todayParts = ['http://c1.hpwren.ucsd.edu/archive', 'cam', 'large', 'missing', datetime.date.today().strftime('%Y%m%d')]
+    img_archive.readUrlDir(todayParts, False, '.mp4')
+    img_archive.readUrlDir(todayParts, False, '.mp4')
+    assert len(fetchCounter) == 3
+    # transient errors are never cached
+    timeoutParts = ['http://c1.hpwren.ucsd.edu/archive', 'cam', 'large', 'timeout', '20200101', 'Q1']
+    assert img_archive.listTimesinQ(timeoutParts, False) == None
+    assert img_archive.listTimesinQ(timeoutParts, False) == None
+    assert len(fetchCounter) == 5
+
+
+def testListingTtl():
+    assert img_archive.getListingTtl('http://x/archive/cam/large/20200101/Q1') == img_archive.LISTING_TTL_PAST
+    todayDir = datetime.date.today().strftime('%Y%m%d')
+    assert img_archive.getListingTtl('http://x/archive/cam/large/' + todayDir) == img_archive.LISTING_TTL_RECENT
+    assert img_archive.getListingTtl('http://x/archive/cam/large') == img_archive.LISTING_TTL_RECENT
+
+
+def testClosestIndex():
+    rand = random.Random(0)
+    times = sorted(rand.sample(range(1000000), 200))
+    sortedTimes = array.array('q', times)
+    for desiredTime in [-10, 0, 999999, 2000000] + [rand.randrange(1000000) for i in range(500)]:
+        expected = min(times, key=lambda x: abs(x - desiredTime))
+        assert times[img_archive.getClosestIndex(sortedTimes, desiredTime)] == expected
+    # ties go to the earlier time, like min()
+    assert img_archive.getClosestIndex(array.array('q', [10, 20]), 15) == 0
+
+
+def testDownloadFilesForDate(monkeypatch):
+    baseTime = int(time.mktime(datetime.datetime(2020, 1, 1, 10, 0).timetuple()))
+    monkeypatch.setattr(img_archive, 'listTimesinQ',
+                        lambda urlPartsQ, verboseLogs: [{'time': baseTime + i*60 + 5} for i in range(60)])
+    calls = []
+    def fakeDownload(outputDir, urlPartsQ, cameraID, closestTime, verboseLogs):
+        calls.append(closestTime)
+        if closestTime == baseTime + 2*60 + 5:
+            raise Exception('connection reset')
+        return 'img%d' % closestTime
+    monkeypatch.setattr(img_archive, 'downloadHttpFileAtTime', fakeDownload)
+    hpwrenSource = {
+        'cameraID': 'cam1',
+        'urlParts': ['http://c1.hpwren.ucsd.edu/archive', 'cam', 'large'],
+        'startTimeDT': datetime.datetime(2020, 1, 1, 10, 0),
+        'endTimeDT': datetime.datetime(2020, 1, 1, 10, 5),
+    }
+    files = img_archive.downloadFilesForDate(None, None, '/tmp', hpwrenSource, 1, False)
+    # failed download is skipped, and the rest are in time order
+    assert files == ['img%d' % (baseTime + i*60 + 5) for i in [0, 1, 3, 4, 5]]
+    assert sorted(calls) == [baseTime + i*60 + 5 for i in range(6)]
+
+
+def testRunDownloadsOncePerTime():
+    calls = []
+    def download(name):
+        calls.append(name)
+        return name
+    downloads = [(1, lambda: download('a')), (1, lambda: download('a')), (2, lambda: download('b'))]
+    assert img_archive.runDownloads(downloads, False) == ['a', 'a', 'b']
+    assert sorted(calls) == ['a', 'b']
+
+
+def testTimeChunks():
+    startDT = datetime.datetime(2020, 1, 1, 22, 30)
+    chunks = img_archive.getTimeChunks(startDT, datetime.datetime(2020, 1, 2, 1, 0), 1)
+    assert chunks == [
+        (datetime.datetime(2020, 1, 1, 22, 30), datetime.datetime(2020, 1, 1, 23, 29)),
+        (datetime.datetime(2020, 1, 1, 23, 30), datetime.datetime(2020, 1, 1, 23, 59)),
+        (datetime.datetime(2020, 1, 2, 0, 0), datetime.datetime(2020, 1, 2, 0, 59)),
+        (datetime.datetime(2020, 1, 2, 1, 0), datetime.datetime(2020, 1, 2, 1, 0)),
+    ]
+    # gaps between images are kept across chunks
+    chunks = img_archive.getTimeChunks(startDT, datetime.datetime(2020, 1, 2, 0, 30), 7)
+    assert chunks[1][0] - chunks[0][1] == datetime.timedelta(minutes=7)
+    assert chunks[-1][1] <= datetime.datetime(2020, 1, 2, 0, 30)
+
+
+def testIterateHpwrenImages(monkeypatch):
+    def fakeGetImages(googleServices, settings, outputDir, camArchives, cameraID, startTimeDT, endTimeDT, gapMinutes):
+        if cameraID == 'missing':
+            return None
+        assert startTimeDT.date() == endTimeDT.date()
+        times = [startTimeDT.timestamp(), endTimeDT.timestamp()]
+        return [img_archive.getImgPath(outputDir, cameraID, x) for x in times]
+    monkeypatch.setattr(img_archive, 'getHpwrenImages', fakeGetImages)
+    startDT = datetime.datetime(2020, 1, 1, 23, 0)
+    endDT = datetime.datetime(2020, 1, 3, 1, 0)
+    results = list(img_archive.iterateHpwrenImages(None, None, '/tmp', img_archive.CameraArchiveRegistry(), ['cam1', 'missing', 'cam2'], startDT, endDT, 1))
+    assert len(results) == 2 * 2 * len(img_archive.getTimeChunks(startDT, endDT, 1))
+    assert results[0] == ('cam1', int(startDT.timestamp()), img_archive.getImgPath('/tmp', 'cam1', startDT.timestamp()))
+    assert results[-1][:2] == ('cam2', int(endDT.timestamp()))
+    cam1Times = [x[1] for x in results if x[0] == 'cam1']
+    assert cam1Times == sorted(cam1Times)
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') == None, reason='ffmpeg is not installed')
+def testExtractMp4Frames(tmp_path, monkeypatch):
+    # video with one frame per second, each with different brightness
+    for i in range(10):
+        Image.new('RGB', (64, 48), (i*25, i*25, i*25)).save(str(tmp_path / ('src-%02d.png' % i)))
+    mp4Path = str(tmp_path / 'Q1.mp4')
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-framerate', '1', '-i', str(tmp_path / 'src-%02d.png'),
+                    '-pix_fmt', 'yuv420p', '-r', '1', mp4Path], check=True)
+    outputDir = tmp_path / 'frames'
+    outputDir.mkdir()
+    assert img_archive.getMp4FrameRate(mp4Path) == 1
+    frames = img_archive.extractMp4Frames(mp4Path, [7, 2, 0, 20], str(outputDir))
+    assert sorted(frames.keys()) == [0, 2, 7]
+    for frameIndex in [0, 2, 7]:
+        brightness = ImageStat.Stat(Image.open(frames[frameIndex]).convert('L')).mean[0]
+        assert brightness == pytest.approx(frameIndex*25, abs=6)
+
+    # frames selected by number when the frame rate is unknown
+    monkeypatch.setattr(img_archive, 'getMp4FrameRate', lambda x: None)
+    shutil.rmtree(str(outputDir))
+    outputDir.mkdir()
+    frames = img_archive.extractMp4Frames(mp4Path, [7, 2, 20], str(outputDir))
+    assert sorted(frames.keys()) == [2, 7]
+    brightness = ImageStat.Stat(Image.open(frames[7]).convert('L')).mean[0]
+    assert brightness == pytest.approx(7*25, abs=6)
+
+
+class FakeMp4Resp(object):
+    status_code = 200
+
+    def iter_content(self, chunk_size):
+        return [b'mp4data']
+
+    def close(self):
+        pass
+
+
+def testGetMp4Frames(tmp_path, monkeypatch):
+    monkeypatch.setattr(img_archive, 'mp4Cache', image_cache.ImageCache(str(tmp_path / 'mp4'), 10000, fileExt='.mp4'))
+    monkeypatch.setattr(img_archive, 'imageCache', image_cache.ImageCache(str(tmp_path / 'images'), 10000))
+    urls = []
+    class FakeSession(object):
+        def get(self, url, stream):
+            urls.append(url)
+            return FakeMp4Resp()
+    monkeypatch.setattr(img_archive, 'getHttpSession', lambda: FakeSession())
+    extracted = []
+    def fakeExtract(mp4Path, frameIndexes, outputDir):
+        extracted.append(sorted(frameIndexes))
+        frames = {}
+        for frameIndex in frameIndexes:
+            frames[frameIndex] = os.path.join(outputDir, 'frame%d.jpg' % frameIndex)
+            with open(frames[frameIndex], 'wb') as f:
+                f.write(b'frame%d' % frameIndex)
+        return frames
+    monkeypatch.setattr(img_archive, 'extractMp4Frames', fakeExtract)
+
+    qStartTime = 1600000000
+    outputDir = tmp_path / 'out'
+    outputDir.mkdir()
+    images = img_archive.getMp4Frames(str(outputDir), 'cam1', 'http://x/Q1.mp4', qStartTime, [qStartTime + 120, qStartTime + 600])
+    assert extracted == [[2, 10]]
+    with open(images[qStartTime + 600], 'rb') as f:
+        assert f.read() == b'frame10'
+    # cached frames and video are reused in another output dir
+    otherDir = tmp_path / 'other'
+    otherDir.mkdir()
+    images = img_archive.getMp4Frames(str(otherDir), 'cam1', 'http://x/Q1.mp4', qStartTime, [qStartTime + 120, qStartTime + 180])
+    assert extracted == [[2, 10], [3]]
+    assert urls == ['http://x/Q1.mp4']
+    assert images[qStartTime + 120] == img_archive.getImgPath(str(otherDir), 'cam1', qStartTime + 120)
+    assert os.path.isfile(images[qStartTime + 120])
+
+
+def testDownloadFilesForDateMp4(monkeypatch):
+    monkeypatch.setattr(img_archive, 'ffmpegPath', '/usr/bin/ffmpeg')
+    monkeypatch.setattr(img_archive, 'listTimesinQ', lambda urlPartsQ, verboseLogs: None)
+    monkeypatch.setattr(img_archive, 'getMp4Url', lambda urlPartsDate, qNum, verboseLogs: 'http://x/MP4/Q%d.mp4' % qNum)
+    requested = []
+    def fakeGetMp4Frames(outputDir, cameraID, mp4Url, qStartTime, frameTimes):
+        requested.append((mp4Url, qStartTime, frameTimes))
+        return {x: 'img%d' % x for x in frameTimes}
+    monkeypatch.setattr(img_archive, 'getMp4Frames', fakeGetMp4Frames)
+    hpwrenSource = {
+        'cameraID': 'cam1',
+        'urlParts': ['http://c1.hpwren.ucsd.edu/archive', 'cam', 'large'],
+        'startTimeDT': datetime.datetime(2020, 1, 1, 10, 0, 20),
+        'endTimeDT': datetime.datetime(2020, 1, 1, 10, 3, 20),
+    }
+    files = img_archive.downloadFilesForDate(None, None, '/tmp', hpwrenSource, 1, False)
+    qStartTime = int(time.mktime(datetime.datetime(2020, 1, 1, 9, 0).timetuple()))
+    frameTimes = [qStartTime + 60*60 + i*60 for i in range(4)]
+    assert requested == [('http://x/MP4/Q4.mp4', qStartTime, frameTimes)]
+    assert files == ['img%d' % x for x in frameTimes]
+
+
+ARCHIVES_DATA = """Rm-W-mobo-c c1/rm-w-mobo-c/large/
+Rm-W-mobo-c-pre-2018 c2/rm-w-mobo-c-old/large/
+Bm-N-mobo-c c1/bm-n-mobo-c/large/
+Bm-N-mobo-c2 c2/bm-n-mobo-c/large/
+bad entry with columns
+Sp-E-axis c1/sp-e-axis/large/
+"""
+
+
+@pytest.fixture
+def archivesFile(tmp_path, monkeypatch):
+    monkeypatch.setattr(img_archive, 'archivesCacheDir', str(tmp_path / 'archives_cache'))
+    archivesPath = tmp_path / 'archives.txt'
+    archivesPath.write_text(ARCHIVES_DATA)
+    return str(archivesPath)
+
+
+def testCameraArchiveRegistry(archivesFile):
+    camArchives = img_archive.getHpwrenCameraArchives(archivesFile)
+    assert len(camArchives) == 3
+    assert camArchives.getDirs('rm-w-mobo-c') == ['c1/rm-w-mobo-c/large/', 'c2/rm-w-mobo-c-old/large/']
+    assert camArchives.getDirs('bm-n-mobo-c') == ['c1/bm-n-mobo-c/large/', 'c2/bm-n-mobo-c/large/']
+    assert img_archive.findCameraInArchive(camArchives, 'sp-e-axis') == ['c1/sp-e-axis/large/']
+    assert img_archive.findCameraInArchive(camArchives, 'unknown') == []
+    assert camArchives.getDirSource('c2/rm-w-mobo-c-old/large/') == ('c2', 'rm-w-mobo-c-old')
+
+
+def testCameraArchiveRegistryCache(archivesFile, monkeypatch):
+    camArchives = img_archive.getHpwrenCameraArchives(archivesFile)
+    reads = []
+    monkeypatch.setattr(img_archive.goog_helper, 'readFile', lambda filePath: reads.append(filePath) or ARCHIVES_DATA)
+    cached = img_archive.getHpwrenCameraArchives(archivesFile)
+    assert reads == []
+    assert cached.toDict() == camArchives.toDict()
+    # modified file is parsed again
+    newTime = time.time() + 10
+    os.utime(archivesFile, (newTime, newTime))
+    img_archive.getHpwrenCameraArchives(archivesFile)
+    assert reads == [archivesFile]
+
+
+def diffImagesImageMath(imgA, imgB):
+    # original implementation of img_archive.diffImages
+    bandsImgA = imgA.split()
+    bandsImgB = imgB.split()
+    bandsImgOut = []
+    for bandNum in range(len(bandsImgA)):
+        out = ImageMath.unsafe_eval("convert(128+a-b,'L')", a=bandsImgA[bandNum], b=bandsImgB[bandNum])
+        bandsImgOut.append(out)
+    return Image.merge('RGB', bandsImgOut)
+
+
+def randomImage(rand, size):
+    return Image.fromarray(rand.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+def testDiffImagesEquivalence():
+    rand = np.random.default_rng(0)
+    imgA = randomImage(rand, (320, 240))
+    imgB = randomImage(rand, (320, 240))
+    expected = diffImagesImageMath(imgA, imgB)
+    imgDiff = img_archive.diffImages(imgA, imgB)
+    assert imgDiff.mode == 'RGB'
+    assert np.array_equal(np.asarray(imgDiff), np.asarray(expected))
+    # extremes are clipped
+    black = Image.new('RGB', (4, 4), (0, 0, 0))
+    white = Image.new('RGB', (4, 4), (255, 255, 255))
+    assert np.array_equal(np.asarray(img_archive.diffImages(black, white)), np.asarray(diffImagesImageMath(black, white)))
+    assert img_archive.diffImages(white, black).getextrema() == ((255, 255),) * 3
+    arrDiff = img_archive.diffImages(imgA, imgB, asArray=True)
+    assert arrDiff.dtype == np.uint8
+    assert np.array_equal(arrDiff, np.asarray(expected))
+
+
+def testDiffImagesBatch():
+    rand = np.random.default_rng(1)
+    samePairs = [(randomImage(rand, (50, 40)), randomImage(rand, (50, 40))) for i in range(5)]
+    mixedPairs = samePairs + [(randomImage(rand, (30, 20)), randomImage(rand, (30, 20)))]
+    for pairs in [samePairs, mixedPairs]:
+        diffs = img_archive.diffImagesBatch(pairs, asArray=True)
+        assert len(diffs) == len(pairs)
+        for (diff, (imgA, imgB)) in zip(diffs, pairs):
+            assert np.array_equal(diff, np.asarray(diffImagesImageMath(imgA, imgB)))
+    assert img_archive.diffImagesBatch(samePairs)[0].size == (50, 40)
+    assert img_archive.diffImagesBatch([]) == []
+
+
+def testTileDiffArray():
+    rand = np.random.default_rng(2)
+    (imgA, imgB) = (randomImage(rand, (700, 400)), randomImage(rand, (700, 400)))
+    (cropsImg, segmentsImg) = rect_to_squares.cutBoxesArray(img_archive.diffImages(imgA, imgB))
+    (cropsArr, segmentsArr) = rect_to_squares.cutBoxesArray(img_archive.diffImages(imgA, imgB, asArray=True))
+    assert segmentsArr == segmentsImg
+    assert np.array_equal(cropsArr, cropsImg)
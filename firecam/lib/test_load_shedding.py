@@ -0,0 +1,61 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test load_shedding
+
+"""
+
+from firecam.lib import load_shedding
+import pytest
+
+
+def testLevels():
+    shedder = load_shedding.LoadShedder(60)
+    assert shedder.updateSweep(50, []) == load_shedding.NONE
+    assert shedder.updateSweep(70, []) == load_shedding.DROP_STALE
+    assert shedder.updateSweep(150, []) == load_shedding.SUBSAMPLE_TILES
+    # hysteresis keeps level until sweep is clearly below threshold
+    assert shedder.updateSweep(115, []) == load_shedding.SUBSAMPLE_TILES
+    assert shedder.updateSweep(100, []) == load_shedding.REDUCE_REVISITS
+    assert shedder.updateSweep(30, []) == load_shedding.NONE
+
+
+def testStale():
+    shedder = load_shedding.LoadShedder(60)
+    assert not shedder.isStale('cam1', 1000, 2000)
+    shedder.updateSweep(70, [])
+    assert shedder.isStale('cam1', 1000, 2000)
+    assert not shedder.isStale('cam1', 1900, 2000)
+    assert not shedder.isStale('cam1', None, 2000)
+
+
+def testLowRiskCameras():
+    shedder = load_shedding.LoadShedder(60)
+    lowRisk = {'name': 'cam1'}
+    highRisk = {'name': 'cam2'}
+    shedder.updateSweep(150, [lowRisk, highRisk])
+    shedder.afterFrame(lowRisk, 1000, 0.1, 150)
+    shedder.afterFrame(highRisk, 1000, 0.8, 150)
+    assert lowRisk['nextShedScan'] == 1300
+    assert 'nextShedScan' not in highRisk
+    assert shedder.getTileSampling(highRisk) == (1, 0)
+    assert shedder.getTileSampling(lowRisk) == (2, 0)
+    assert shedder.getTileSampling(lowRisk) == (2, 1)
+
+    # recovering clears deferred scans
+    shedder.updateSweep(30, [lowRisk, highRisk])
+    assert 'nextShedScan' not in lowRisk
+    assert shedder.getTileSampling(lowRisk) == (1, 0)
@@ -0,0 +1,59 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test memory_monitor
+
+"""
+
+from firecam.lib import memory_monitor
+from firecam.lib import metrics
+import pytest
+
+
+def testRss():
+    assert memory_monitor.getRssBytes() > 1024 * 1024
+
+
+def testNoGcUnderBudget():
+    monitor = memory_monitor.MemoryMonitor(budgetMB=1024*1024)
+    monitor.startIteration()
+    assert not monitor.endIteration()
+    monitor = memory_monitor.MemoryMonitor()
+    monitor.startIteration()
+    assert not monitor.endIteration()
+
+
+def testGcOverBudget():
+    monitor = memory_monitor.MemoryMonitor(budgetMB=1)
+    monitor.startIteration()
+    assert monitor.endIteration()
+    # GC can't get RSS under 1MB, so trigger is raised to avoid collecting every iteration
+    assert monitor.gcTriggerBytes > monitor.budgetBytes
+    assert not monitor.endIteration()
+
+
+def testStageGrowth():
+    monitor = memory_monitor.MemoryMonitor(traceTop=5)
+    try:
+        monitor.startIteration()
+        data = [bytearray(1000) for i in range(1000)]
+        monitor.markStage('detect')
+        assert monitor.stageGrowth['detect'] >= 1000 * 1000
+        monitor.endIteration()
+        growth = metrics.registry.gauge('firecam_memory_growth_bytes').toDict()
+        assert {'labels': {'stage': 'detect'}, 'value': monitor.stageGrowth['detect']} in growth
+    finally:
+        memory_monitor.tracemalloc.stop()
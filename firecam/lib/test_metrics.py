@@ -0,0 +1,55 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test metrics
+
+"""
+
+from firecam.lib import metrics
+import pytest
+
+
+def testPercentile():
+    values = list(range(1, 101))
+    assert metrics.getPercentile(values, 50) == 50
+    assert metrics.getPercentile(values, 95) == 95
+    assert metrics.getPercentile(values, 99) == 99
+    assert metrics.getPercentile([], 50) == None
+
+
+def testHistogram():
+    registry = metrics.MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'test latency')
+    for i in range(1, 101):
+        histogram.observe(i/100, {'stage': 'infer'})
+    percentiles = histogram.getPercentiles({'stage': 'infer'})
+    assert percentiles['p95'] == pytest.approx(0.95)
+    lines = registry.formatPrometheus().split('\n')
+    assert '# TYPE test_seconds histogram' in lines
+    assert 'test_seconds_bucket{stage="infer",le="0.5"} 50' in lines
+    assert 'test_seconds_bucket{stage="infer",le="+Inf"} 100' in lines
+    assert 'test_seconds_count{stage="infer"} 100' in lines
+
+
+def testCounterAndGauge():
+    registry = metrics.MetricsRegistry()
+    registry.counter('frames_total', 'frames').inc({'camera': 'cam1'})
+    registry.counter('frames_total', 'frames').inc({'camera': 'cam1'}, 2)
+    registry.gauge('sweep_seconds', 'sweep').set(12.5)
+    text = registry.formatPrometheus()
+    assert 'frames_total{camera="cam1"} 3' in text
+    assert 'sweep_seconds 12.5' in text
+    assert registry.toDict()['frames_total'] == [{'labels': {'camera': 'cam1'}, 'value': 3}]
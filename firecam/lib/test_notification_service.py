@@ -0,0 +1,68 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test notification_service
+
+"""
+
+from firecam.lib import notification_service
+from firecam.lib import db_manager
+import time
+import pytest
+
+
+def testBackoff():
+    for attempt in range(1, 10):
+        delay = notification_service.getBackoffSeconds(attempt)
+        assert 0 <= delay <= notification_service.BACKOFF_MAX_SECONDS
+
+
+def testCallOnce():
+    calls = []
+    wrapper = notification_service.callOnce(lambda: calls.append(1))
+    for i in range(3):
+        wrapper()
+    assert calls == [1]
+
+
+def testRecipientCache(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    timeNow = int(time.time())
+    dbManager.add_data('notifications', {'Name': 'a', 'Email': 'a@x.com', 'EmailStartTime': timeNow - 10,
+                                         'EmailEndTime': timeNow + 1000, 'Phone': '+1555', 'PhoneStartTime': 0,
+                                         'PhoneEndTime': timeNow - 10})
+    recipients = notification_service.RecipientCache(dbManager, ttlSeconds=1000)
+    assert recipients.getEmails() == ['a@x.com']
+    assert recipients.getPhones() == []
+    dbManager.add_data('notifications', {'Name': 'b', 'Email': 'b@x.com', 'EmailStartTime': 0, 'EmailEndTime': timeNow + 1000})
+    assert recipients.getEmails() == ['a@x.com'] # still cached
+
+
+def testRetries(monkeypatch):
+    monkeypatch.setattr(notification_service, 'BACKOFF_BASE_SECONDS', 0.001)
+    service = notification_service.NotificationService(maxAttempts=3)
+    attempts = []
+    sent = []
+    done = []
+    def flakySend():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Exception('busy')
+        return 'ok'
+    assert service.submit('sms', flakySend, onSuccess=lambda: sent.append(1), onDone=lambda: done.append(1)).result()
+    assert (len(attempts), len(sent), len(done)) == (3, 1, 1)
+    assert not service.submit('email', lambda: None, onSuccess=lambda: sent.append(1), onDone=lambda: done.append(1)).result()
+    assert (len(sent), len(done)) == (1, 2)
@@ -0,0 +1,50 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test profiler
+
+"""
+
+from firecam.lib import profiler
+import os
+import time
+import pstats
+import pytest
+
+
+def getNextImage():
+    time.sleep(0.01)
+
+
+def testProfileAndRotate(tmp_path):
+    loopProfiler = profiler.SamplingProfiler(1.0, str(tmp_path), maxFiles=2)
+    for i in range(3):
+        loopProfiler.start()
+        getNextImage()
+        loopProfiler.stop()
+    files = sorted(os.listdir(str(tmp_path)))
+    assert len(files) == 2
+    assert files[-1].endswith('000003.pstats')
+    stats = pstats.Stats(str(tmp_path / files[-1]))
+    assert profiler.getStageTimes(stats)['getNextImage'] >= 0.005
+
+
+def testNoSampling(tmp_path):
+    loopProfiler = profiler.SamplingProfiler(0, str(tmp_path))
+    loopProfiler.start()
+    getNextImage()
+    loopProfiler.stop()
+    assert os.listdir(str(tmp_path)) == []
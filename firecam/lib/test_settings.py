@@ -0,0 +1,46 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test settings
+
+"""
+
+from firecam.lib import settings
+import os
+import json
+import pytest
+
+
+def testReloadIfChanged(tmp_path, monkeypatch):
+    settingsFile = str(tmp_path / 'settings.json')
+    newSettings = dict(settings.settingsJson)
+    newSettings['detectionPolicy'] = 'always'
+    with open(settingsFile, 'w') as f:
+        json.dump(newSettings, f)
+    monkeypatch.setattr(settings, 'settingsPath', settingsFile)
+    monkeypatch.setattr(settings, 'settingsMtime', 0)
+    monkeypatch.setattr(settings, 'detectionPolicy', settings.detectionPolicy)
+
+    assert settings.reloadIfChanged() == ['detectionPolicy']
+    assert settings.detectionPolicy == 'always'
+    assert settings.reloadIfChanged() == [] # unchanged mtime
+
+    # partially written file is ignored
+    with open(settingsFile, 'w') as f:
+        f.write('{"detectionPolicy": ')
+    os.utime(settingsFile, (1000, 1000))
+    assert settings.reloadIfChanged() == []
+    assert settings.detectionPolicy == 'always'
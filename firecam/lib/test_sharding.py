@@ -0,0 +1,118 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test sharding
+
+"""
+
+from firecam.lib import sharding
+from firecam.lib import db_manager
+import pytest
+import time
+
+cameraIDs = ['cam%d' % i for i in range(200)]
+
+
+def testRingBalanceAndStability():
+    ring = sharding.HashRing(['w1', 'w2', 'w3'])
+    assignments = {cameraID: ring.getWorker(cameraID) for cameraID in cameraIDs}
+    for workerID in ['w1', 'w2', 'w3']:
+        assert 30 < list(assignments.values()).count(workerID) < 110
+
+    # only cameras of the removed worker move
+    ring2 = sharding.HashRing(['w1', 'w3'])
+    for cameraID in cameraIDs:
+        if assignments[cameraID] != 'w2':
+            assert ring2.getWorker(cameraID) == assignments[cameraID]
+    assert sharding.HashRing([]).getWorker('cam1') == None
+
+
+def testMembership(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    cameras = [{'name': cameraID} for cameraID in cameraIDs]
+    worker1 = sharding.WorkerMembership(dbManager, 'w1')
+    worker2 = sharding.WorkerMembership(dbManager, 'w2')
+    assert worker1.refresh(1000)
+    assert len(worker1.filterCameras(cameras)) == len(cameras)
+    assert not worker1.refresh(1001) # not due yet
+
+    assert worker2.refresh(1010)
+    assert worker1.refresh(1000 + sharding.HEARTBEAT_SECONDS)
+    cameras1 = worker1.filterCameras(cameras)
+    cameras2 = worker2.filterCameras(cameras)
+    assert len(cameras1) + len(cameras2) == len(cameras)
+    assert not set(x['name'] for x in cameras1) & set(x['name'] for x in cameras2)
+
+    # worker2 dies, so worker1 takes over all cameras
+    assert worker1.refresh(1010 + sharding.DEAD_SECONDS + 1)
+    assert len(worker1.filterCameras(cameras)) == len(cameras)
+
+
+def testHeartbeatThread(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharding, 'HEARTBEAT_SECONDS', 0.05)
+    dbFile = str(tmp_path / 'test.db')
+    worker1 = sharding.WorkerMembership(db_manager.DbManager(sqliteFile=dbFile), 'w1')
+    assert worker1.refresh()
+    worker1.startHeartbeat(lambda: db_manager.DbManager(sqliteFile=dbFile))
+    worker2 = sharding.WorkerMembership(db_manager.DbManager(sqliteFile=dbFile), 'w2')
+    assert worker2.refresh()
+    for i in range(100):
+        if worker1.checkChanged():
+            break
+        time.sleep(0.05)
+    assert worker1.ring.workerIDs == ['w1', 'w2']
+    assert not worker1.checkChanged()
+
+    # no more heartbeats after leaving
+    worker1.leave()
+    time.sleep(0.2)
+    assert worker2.getLiveWorkers(int(time.time())) == ['w2']
+
+
+class FlakyDbManager(db_manager.DbManager):
+    failures = 0
+
+    def execute(self, sqlCmd, commit=True):
+        if FlakyDbManager.failures:
+            FlakyDbManager.failures -= 1
+            raise Exception('connection lost')
+        super().execute(sqlCmd, commit)
+
+
+def testHeartbeatRecovers(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharding, 'HEARTBEAT_SECONDS', 0.05)
+    monkeypatch.setattr(FlakyDbManager, 'failures', 1)
+    dbFile = str(tmp_path / 'test.db')
+    rollbacks = []
+    monkeypatch.setattr(sharding, '_rollback', lambda dbManager: rollbacks.append(1) or dbManager)
+    worker = sharding.WorkerMembership(db_manager.DbManager(sqliteFile=dbFile), 'w1')
+    worker.startHeartbeat(lambda: FlakyDbManager(sqliteFile=dbFile))
+    # heartbeats resume after the failed one is rolled back
+    checker = sharding.WorkerMembership(db_manager.DbManager(sqliteFile=dbFile), 'w2')
+    for i in range(100):
+        if checker.getLiveWorkers(int(time.time())) == ['w1']:
+            break
+        time.sleep(0.05)
+    assert checker.getLiveWorkers(int(time.time())) == ['w1']
+    assert rollbacks == [1]
+    worker.leave()
+
+
+def testRollback(tmp_path):
+    dbManager = db_manager.DbManager(sqliteFile=str(tmp_path / 'test.db'))
+    assert sharding._rollback(dbManager) is dbManager
+    dbManager.conn.close() # broken connection must be recreated
+    assert sharding._rollback(dbManager) == None
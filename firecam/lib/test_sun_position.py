@@ -0,0 +1,65 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test sun_position
+
+"""
+
+from firecam.lib import sun_position
+import calendar
+import datetime
+import pytest
+
+# Mount Laguna area in San Diego county
+latitude = 32.7
+longitude = -117.16
+
+def utcTimestamp(year, month, day, hour, minute):
+    return calendar.timegm(datetime.datetime(year, month, day, hour, minute).timetuple())
+
+
+def testSummerNoon():
+    # solar noon in San Diego is around 19:50 UTC
+    elevation = sun_position.getSunElevation(latitude, longitude, utcTimestamp(2020, 6, 21, 19, 50))
+    assert elevation == pytest.approx(90 - (latitude - 23.44), abs=0.5)
+
+
+def testWinterNoon():
+    elevation = sun_position.getSunElevation(latitude, longitude, utcTimestamp(2020, 12, 21, 19, 50))
+    assert elevation == pytest.approx(90 - (latitude + 23.44), abs=0.5)
+
+
+def testMidnight():
+    timestamp = utcTimestamp(2020, 6, 21, 7, 50)
+    assert sun_position.getSunElevation(latitude, longitude, timestamp) < -30
+    assert sun_position.isNight(latitude, longitude, timestamp)
+
+
+def testUpdateCameraNight():
+    camera = {'name': 'cam1', 'latitude': latitude, 'longitude': longitude}
+    assert sun_position.updateCameraNight(camera, utcTimestamp(2020, 6, 21, 7, 50))
+    assert camera['isNight']
+    assert not sun_position.updateCameraNight(camera, utcTimestamp(2020, 6, 21, 19, 50))
+    assert not camera['isNight']
+    unlocated = {'name': 'cam2'}
+    assert not sun_position.updateCameraNight(unlocated, utcTimestamp(2020, 6, 21, 7, 50))
+    assert 'isNight' not in unlocated
+
+
+def testDawn():
+    # sunrise is around 12:40 UTC in late June, so twilight ends well before 13:30
+    assert sun_position.isNight(latitude, longitude, utcTimestamp(2020, 6, 21, 11, 30))
+    assert not sun_position.isNight(latitude, longitude, utcTimestamp(2020, 6, 21, 13, 30))
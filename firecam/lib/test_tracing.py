@@ -0,0 +1,60 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Test tracing
+
+"""
+
+from firecam.lib import tracing
+from firecam.lib import metrics
+import json
+import pytest
+
+
+def testNestedSpans(tmp_path):
+    jsonlPath = str(tmp_path / 'traces.jsonl')
+    tracing.setExporter(tracing.JsonlExporter(jsonlPath))
+    try:
+        for i in range(2):
+            with tracing.span('frame'):
+                tracing.setAttribute('camera', 'cam%d' % i)
+                with metrics.stageTimer('infer'):
+                    pass
+    finally:
+        tracing.setExporter(None)
+    with open(jsonlPath) as jsonlFile:
+        spans = [json.loads(line) for line in jsonlFile]
+    assert [x['name'] for x in spans] == ['infer', 'frame', 'infer', 'frame']
+    assert spans[0]['parentId'] == spans[1]['spanId']
+    assert spans[0]['traceId'] == spans[1]['traceId']
+    assert spans[1]['traceId'] != spans[3]['traceId']
+    assert spans[1]['parentId'] == None
+    assert spans[3]['attributes'] == {'camera': 'cam1'}
+    assert tracing.currentTraceId() == None
+
+    chromePath = str(tmp_path / 'chrome.json')
+    tracing.convertToChromeTrace(jsonlPath, chromePath)
+    with open(chromePath) as chromeFile:
+        events = json.load(chromeFile)['traceEvents']
+    assert len(events) == 4
+    assert events[1]['ph'] == 'X'
+    assert events[1]['args']['camera'] == 'cam0'
+
+
+def testDisabled():
+    with tracing.span('frame') as frameSpan:
+        assert frameSpan.record == None
+        assert tracing.currentTraceId() == None
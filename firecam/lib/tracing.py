@@ -0,0 +1,182 @@
+# Copyright 2020 Open Climate Tech Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+
+Lightweight tracing with nested spans.  Each top level span (e.g. one frame
+in detect_fire) gets a new trace ID that is shared by all spans nested
+within it in the same thread.  Finished spans are written as JSON lines by
+the exporter, and convertToChromeTrace() turns them into the Chrome trace
+event format that can be loaded in chrome://tracing or ui.perfetto.dev.
+Spans are no-ops until an exporter is set.
+
+Usage:
+    tracing.setExporter(tracing.JsonlExporter('/tmp/traces.jsonl'))
+    with tracing.span('frame', camera=cameraID):
+        with tracing.span('infer'):
+            classify()
+
+"""
+
+import os
+import threading
+import time
+import json
+import uuid
+
+_local = threading.local()
+_exporter = None
+
+
+def setExporter(exporter):
+    """Set the exporter for finished spans (None disables tracing)
+
+    Args:
+        exporter: object with export(spanRecord) method (e.g., JsonlExporter)
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def _getStack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _newId():
+    return uuid.uuid4().hex[:16]
+
+
+class span(object):
+    def __init__(self, name, **attributes):
+        """Span timing a named operation.  Use as context manager or call start() and end()
+
+        Args:
+            name (str): name of the operation
+            attributes: optional key/value pairs to record with the span
+        """
+        self.name = name
+        self.attributes = attributes
+        self.record = None
+
+    def start(self):
+        if not _exporter:
+            return self
+        stack = _getStack()
+        parent = stack[-1] if stack else None
+        self.record = {
+            'traceId': parent['traceId'] if parent else _newId(),
+            'spanId': _newId(),
+            'parentId': parent['spanId'] if parent else None,
+            'name': self.name,
+            'start': time.time(),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'attributes': self.attributes,
+        }
+        stack.append(self.record)
+        return self
+
+    def end(self, error=None):
+        if not self.record:
+            return
+        self.record['duration'] = time.time() - self.record['start']
+        if error:
+            self.record['error'] = error
+        stack = _getStack()
+        if self.record in stack:
+            # also drop any children that were never ended
+            del stack[stack.index(self.record):]
+        exporter = _exporter
+        if exporter:
+            exporter.export(self.record)
+        self.record = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.end(str(excValue) if excValue else None)
+        return False
+
+
+def setAttribute(key, value):
+    """Set attribute on the innermost active span in current thread
+
+    Args:
+        key (str): attribute name
+        value: JSON serializable value
+    """
+    stack = _getStack()
+    if stack:
+        stack[-1]['attributes'][key] = value
+
+
+def currentTraceId():
+    """Get trace ID of the active span in current thread (None if not tracing)
+    """
+    stack = _getStack()
+    return stack[-1]['traceId'] if stack else None
+
+
+class JsonlExporter(object):
+    def __init__(self, filePath):
+        """Append finished spans as JSON lines to given local file
+
+        Args:
+            filePath (str): path of the JSONL file
+        """
+        self.filePath = filePath
+        self.lock = threading.Lock()
+        self.file = open(filePath, 'a')
+
+    def export(self, spanRecord):
+        line = json.dumps(spanRecord) + '\n'
+        with self.lock:
+            self.file.write(line)
+            if not spanRecord['parentId']:
+                self.file.flush() # flush once per trace to keep overhead low
+
+
+def convertToChromeTrace(jsonlPath, outPath):
+    """Convert spans from JsonlExporter file into Chrome trace event format
+
+    Args:
+        jsonlPath (str): path of the JSONL file with spans
+        outPath (str): path for the output JSON file
+    """
+    events = []
+    with open(jsonlPath) as jsonlFile:
+        for line in jsonlFile:
+            if not line.strip():
+                continue
+            spanRecord = json.loads(line)
+            eventArgs = dict(spanRecord['attributes'])
+            eventArgs.update({'traceId': spanRecord['traceId'], 'spanId': spanRecord['spanId'],
+                              'parentId': spanRecord['parentId']})
+            if 'error' in spanRecord:
+                eventArgs['error'] = spanRecord['error']
+            events.append({
+                'name': spanRecord['name'],
+                'cat': 'firecam',
+                'ph': 'X',
+                'ts': int(spanRecord['start'] * 1e6),
+                'dur': int(spanRecord['duration'] * 1e6),
+                'pid': spanRecord['pid'],
+                'tid': spanRecord['tid'],
+                'args': eventArgs,
+            })
+    with open(outPath, 'w') as outFile:
+        json.dump({'traceEvents': events}, outFile)
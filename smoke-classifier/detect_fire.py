@@ -22,7 +22,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import os, sys
+import os, sys, io
 from firecam.lib import settings
 from firecam.lib import collect_args
 from firecam.lib import goog_helper
@@ -34,65 +34,264 @@ from firecam.lib import tf_helper
 from firecam.lib import db_manager
 from firecam.lib import email_helper
 from firecam.lib import sms_helper
+from firecam.lib import sun_position
+from firecam.lib import camera_health
+from firecam.lib import camera_state
+from firecam.lib import metrics
+from firecam.lib import profiler
+from firecam.lib import memory_monitor
+from firecam.lib import alert_timings
+from firecam.lib import tracing
+from firecam.lib import load_shedding
+from firecam.lib import sharding
+from firecam.lib import notification_service
+from firecam.lib import annotate
+from firecam.lib import alert_assets
 from firecam.detection_policies import policies
 
 import logging
 import pathlib
 import tempfile
+import atexit
+import signal
 import shutil
 import time, datetime, dateutil.parser
 import random
 import math
 import re
 import hashlib
-import gc
-from urllib.request import urlretrieve
+import requests
 import tensorflow as tf
-from PIL import Image, ImageFile, ImageDraw, ImageFont
+from PIL import Image, ImageFile, ImageDraw
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 import ffmpeg
 
+# seconds between checks for changes to cameras (config version) and settings file
+CONFIG_CHECK_SECONDS = 30
+# frame rate of alert clips. Source images are a minute apart, so show each one for a second
+CLIP_FPS = 1
 
-def getNextImage(dbManager, cameras, cameraID=None):
+
+def addCameraLocations(dbManager, cameras):
+    """Add latitude and longitude from the cameras table to the given cameras
+
+    Args:
+        dbManager (DbManager):
+        cameras (list): list of cameras
+    """
+    locations = dbManager.getCameraLocations()
+    for camera in cameras:
+        if camera['name'] in locations:
+            (camera['latitude'], camera['longitude']) = locations[camera['name']]
+    numLocated = len(list(filter(lambda x: 'latitude' in x, cameras)))
+    logging.warning('Found locations for %d of %d cameras', numLocated, len(cameras))
+
+
+def mergeCameras(oldCameras, newCameras, cameraState=None):
+    """Merge freshly read list of cameras into the current list
+
+    Cameras that are still configured keep their existing dicts (with all the
+    runtime state and caches), updated with the new DB values.  Cameras that
+    were removed stop being tracked by cameraState.
+
+    Args:
+        oldCameras (list): current list of cameras
+        newCameras (list): cameras just read from DB via get_sources
+        cameraState (CameraStateStore): optional persistent state store
+
+    Returns:
+        merged list of cameras (in order of newCameras)
+    """
+    oldByName = {camera['name']: camera for camera in oldCameras}
+    merged = []
+    for newCamera in newCameras:
+        camera = oldByName.pop(newCamera['name'], None)
+        if camera:
+            camera.update(newCamera)
+        else:
+            camera = newCamera
+        merged.append(camera)
+    if cameraState:
+        for cameraID in oldByName:
+            cameraState.untrack(cameraID)
+    logging.warning('Reloaded cameras: %d total, %d added, %d removed', len(merged),
+                    len(merged) - (len(oldCameras) - len(oldByName)), len(oldByName))
+    return merged
+
+
+def isCameraDue(camera, timestamp, nightScanMinutes, cameraHealth=None):
+    """Check if given camera should be scanned at given time
+
+    Unhealthy cameras are skipped until their backoff period expires, and
+    cameras deferred by load shedding are skipped until their next scheduled scan.
+    The camera's isNight flag is updated whenever its location is known (so dark
+    night images are never counted as failures).  During the night (sun below
+    horizon at the camera location), each camera is scanned only once every
+    nightScanMinutes.  Cameras without known location are always scanned at full rate.
+
+    Args:
+        camera (dict): camera information (with optional latitude and longitude)
+        timestamp (int): time.time() value for current time
+        nightScanMinutes (int): minutes between scans at night (0 disables throttling)
+        cameraHealth (CameraHealth): optional health tracker
+
+    Returns:
+        True if camera should be scanned now
+    """
+    if cameraHealth and not cameraHealth.isDue(camera['name'], timestamp):
+        return False
+    if timestamp < camera.get('nextShedScan', 0):
+        return False
+    if not sun_position.updateCameraNight(camera, timestamp) or not nightScanMinutes:
+        return True
+    return timestamp >= camera.get('nextNightScan', 0)
+
+
+def fetchCameraImage(camera, conditional=True):
+    """Download the current image from given camera unless it hasn't changed
+
+    Remembers the ETag, Last-Modified, and Content-Length headers for each camera,
+    and sends them back as conditional request headers.  Servers that ignore the
+    conditional headers still return the same validators for unchanged images, so
+    the response headers are checked before reading the body, and the transfer is
+    abandoned if they match.  Servers that don't return validators always get a
+    full download, and callers should fall back to comparing md5 of the data.
+    The image is kept in memory, so nothing is written to disk.
+
+    Args:
+        camera (dict): camera information (validators are stored here)
+        conditional (bool): if False, always download the image
+
+    Returns:
+        bytes with the image data, or None if image is unchanged
+    """
+    if not fetchCameraImage.session:
+        fetchCameraImage.session = requests.Session()
+    headers = {}
+    if conditional and camera.get('etag'):
+        headers['If-None-Match'] = camera['etag']
+    if conditional and camera.get('lastModified'):
+        headers['If-Modified-Since'] = camera['lastModified']
+    resp = fetchCameraImage.session.get(camera['url'], headers=headers, stream=True, timeout=60)
+    if resp.status_code == 304:
+        resp.close()
+        return None
+    resp.raise_for_status()
+    etag = resp.headers.get('ETag')
+    lastModified = resp.headers.get('Last-Modified')
+    contentLength = resp.headers.get('Content-Length')
+    if conditional and ((etag and (etag == camera.get('etag'))) or
+                        (lastModified and (lastModified == camera.get('lastModified')) and
+                         (contentLength == camera.get('contentLength')))):
+        resp.close()
+        return None
+    imgData = resp.content
+    resp.close()
+    camera['etag'] = etag
+    camera['lastModified'] = lastModified
+    camera['contentLength'] = contentLength
+    return imgData
+fetchCameraImage.session = None
+
+
+def getNextImage(dbManager, cameras, cameraID=None, nightScanMinutes=0, cameraHealth=None, cameraState=None,
+                 localCounter=False):
     """Gets the next image to check for smoke
 
     Uses a shared counter being updated by all cooperating detection processes
-    to index into the list of cameras to download the image to a local
-    temporary directory
+    to index into the list of cameras currently due for checking to download the
+    image into memory.  The returned filepath in the local temporary directory
+    is only written to when needed (see img_archive.saveImageData).  Dark images
+    from cameras where the sun is down are skipped without counting as failures,
+    and if nightScanMinutes is set, those cameras are scanned at the reduced rate.
+    If cameraHealth is given, fetch errors and frozen, uniform, or undersized
+    images are recorded as failures and unhealthy cameras are skipped.
+    If cameraState is given, the camera's saved state (e.g. last md5) is restored
+    the first time it is selected, and later changes are saved in the background.
+    If localCounter is set (e.g. because cameras are sharded across workers), the
+    cameras are cycled through with a per-process counter instead of the shared one.
 
     Args:
         dbManager (DbManager):
         cameras (list): list of cameras
         cameraID (str): optional specific camera to get image from
+        nightScanMinutes (int): optional minutes between scans of cameras at night
+        cameraHealth (CameraHealth): optional health tracker
+        cameraState (CameraStateStore): optional persistent state store
+        localCounter (bool): use per-process counter instead of shared DB counter
 
     Returns:
-        Tuple containing camera name, current timestamp, and filepath of the image
+        Tuple containing camera name, current timestamp, filepath for the image, md5, and image data
     """
     if getNextImage.tmpDir == None:
         getNextImage.tmpDir = tempfile.TemporaryDirectory()
         logging.warning('TempDir %s', getNextImage.tmpDir.name)
 
+    timestamp = int(time.time())
     if cameraID:
         camera = list(filter(lambda x: x['name'] == cameraID, cameras))[0]
+        if cameraState:
+            cameraState.track(camera)
     else:
-        index = dbManager.getNextSourcesCounter() % len(cameras)
-        camera = cameras[index]
-    timestamp = int(time.time())
+        if cameraState:
+            for camera in cameras:
+                cameraState.track(camera)
+        dueCameras = list(filter(lambda x: isCameraDue(x, timestamp, nightScanMinutes, cameraHealth), cameras))
+        metrics.registry.gauge('firecam_cameras_due', 'Cameras currently due for checking').set(len(dueCameras))
+        if not dueCameras:
+            time.sleep(5) # every camera is waiting for its next night scan or health check
+            return (None, None, None, None, None)
+        # index only into the due cameras so every counter increment yields an image to check
+        if localCounter:
+            getNextImage.counter += 1
+            index = getNextImage.counter % len(dueCameras)
+        else:
+            index = dbManager.getNextSourcesCounter() % len(dueCameras)
+        camera = dueCameras[index]
+        if camera.get('isNight'):
+            camera['nextNightScan'] = timestamp + nightScanMinutes*60
     imgPath = img_archive.getImgPath(getNextImage.tmpDir.name, camera['name'], timestamp)
-    # logging.warning('urlr %s %s', camera['url'], imgPath)
     try:
-        urlretrieve(camera['url'], imgPath)
+        imgData = fetchCameraImage(camera, conditional=not cameraID)
     except Exception as e:
         logging.error('Error fetching image from %s %s', camera['name'], str(e))
-        return getNextImage(dbManager, cameras)
-    md5 = hashlib.md5(open(imgPath, 'rb').read()).hexdigest()
-    if ('md5' in camera) and (camera['md5'] == md5) and not cameraID:
+        metrics.registry.counter('firecam_fetch_errors_total', 'Image fetch errors').inc({'camera': camera['name']})
+        if cameraHealth:
+            cameraHealth.recordFailure(camera['name'], timestamp, 'fetch error: ' + str(e))
+        return getNextImage(dbManager, cameras, nightScanMinutes=nightScanMinutes, cameraHealth=cameraHealth,
+                            cameraState=cameraState, localCounter=localCounter)
+    md5 = hashlib.md5(memoryview(imgData)).hexdigest() if imgData else None
+    if (not imgData) or (('md5' in camera) and (camera['md5'] == md5) and not cameraID):
         logging.warning('Camera %s image unchanged', camera['name'])
+        metrics.registry.counter('firecam_unchanged_total', 'Unchanged images skipped').inc({'camera': camera['name']})
+        if cameraHealth and (timestamp - camera.setdefault('md5Time', timestamp) > camera_health.FROZEN_SECONDS):
+            cameraHealth.recordFailure(camera['name'], timestamp, 'frozen image')
         # skip to next camera
-        return getNextImage(dbManager, cameras)
+        return getNextImage(dbManager, cameras, nightScanMinutes=nightScanMinutes, cameraHealth=cameraHealth,
+                            cameraState=cameraState, localCounter=localCounter)
     camera['md5'] = md5
-    return (camera['name'], timestamp, imgPath, md5)
+    camera['md5Time'] = timestamp
+    if cameraHealth or camera.get('isNight'):
+        imgStats = camera_health.getImageStats(io.BytesIO(imgData))
+        # dark images are expected at night, so they are skipped without counting as failures
+        if not cameraID and camera_health.isDarkNightImage(imgStats, camera.get('isNight')):
+            logging.warning('Camera %s image too dark at night', camera['name'])
+            metrics.registry.counter('firecam_dark_total', 'Dark night images skipped').inc({'camera': camera['name']})
+            return getNextImage(dbManager, cameras, nightScanMinutes=nightScanMinutes, cameraHealth=cameraHealth,
+                            cameraState=cameraState, localCounter=localCounter)
+        failureReason = camera_health.checkImageStats(imgStats)
+        if cameraHealth and failureReason:
+            logging.warning('Camera %s malfunctioning: %s', camera['name'], failureReason)
+            metrics.registry.counter('firecam_malfunctions_total', 'Invalid images skipped').inc({'camera': camera['name']})
+            cameraHealth.recordFailure(camera['name'], timestamp, failureReason)
+            return getNextImage(dbManager, cameras, nightScanMinutes=nightScanMinutes, cameraHealth=cameraHealth,
+                            cameraState=cameraState, localCounter=localCounter)
+        if cameraHealth:
+            cameraHealth.recordSuccess(camera['name'], timestamp)
+    return (camera['name'], timestamp, imgPath, md5, imgData)
 getNextImage.tmpDir = None
+getNextImage.counter = 0
+
 
 # XXXXX Use a fixed stable directory for testing
 # from collections import namedtuple
@@ -126,19 +325,14 @@ def stretchBounds(minOrig, maxOrig, limit):
     return (minNew, maxNew)
 
 
-def drawRect(imgDraw, x0, y0, x1, y1, width, color):
-    for i in range(width):
-        imgDraw.rectangle((x0 + i, y0 + i, x1 - i, y1 -i), outline=color)
-
-
 def drawFireBox(img, destPath, fireSegment, x0, y0, x1, y1, timestamp=None, writeScores=False):
     """Draw bounding box with fire detection and optionally write scores
 
-    Also watermarks the image and stores the resulting annotated image as new file
+    Also watermarks the image and optionally stores the resulting annotated image as new file
 
     Args:
         img (Image): Image object to draw on
-        destPath (str): filepath where to write the output image
+        destPath (str): filepath where to write the output image (None to only draw)
         fireSegment (dict): dict describing segment with fire
         x0, y0, x1, y1 (int): coordinates of fire segment
         writeScores (bool): if set to True, the scores are written on the image as well
@@ -147,47 +341,29 @@ def drawFireBox(img, destPath, fireSegment, x0, y0, x1, y1, timestamp=None, writ
 
     lineWidth=3
     color = "red"
-    drawRect(imgDraw, x0, y0, x1, y1, lineWidth, color)
+    annotate.drawRect(imgDraw, x0, y0, x1, y1, lineWidth, color)
 
-    fontPath = os.path.join(str(pathlib.Path(__file__).parent.parent), 'firecam/data/Roboto-Regular.ttf')
     if writeScores:
         # Write ML score above towards left of the fire box
-        color = "red"
         fontSize=70
-        font = ImageFont.truetype(fontPath, size=fontSize)
         scoreStr = '%.2f' % fireSegment['score']
-        textSize = imgDraw.textsize(scoreStr, font=font)
-        imgDraw.text((x0, y0 - textSize[1]), scoreStr, font=font, fill=color)
+        textSize = annotate.getTextSize(scoreStr, fontSize)
+        annotate.drawText(img, (x0, y0 - textSize[1]), scoreStr, fontSize, "red")
 
         # Write historical max value above towards right of the fire box
-        color = "blue"
         fontSize=60
-        font = ImageFont.truetype(fontPath, size=fontSize)
         scoreStr = '%.2f' % fireSegment['HistMax']
-        textSize = imgDraw.textsize(scoreStr, font=font)
-        imgDraw.text((x1 - textSize[0], y0 - textSize[1]), scoreStr, font=font, fill=color)
+        textSize = annotate.getTextSize(scoreStr, fontSize)
+        annotate.drawText(img, (x1 - textSize[0], y0 - textSize[1]), scoreStr, fontSize, "blue")
 
     if timestamp:
-        fontSize=32
-        font = ImageFont.truetype(fontPath, size=fontSize)
-        timeStr = datetime.datetime.fromtimestamp(timestamp).isoformat()
-        # first little bit of black outline
-        color = "black"
-        for i in range(0,5):
-            for j in range(0,5):
-                imgDraw.text((i, j), timeStr, font=font, fill=color)
-
-        # now actual data in orange
-        color = "orange"
-        imgDraw.text((2, 2), timeStr, font=font, fill=color)
+        annotate.drawTimestamp(img, timestamp)
 
     # "watermark" the image
-    color = "orange"
-    fontSize=32
-    font = ImageFont.truetype(fontPath, size=fontSize)
-    imgDraw.text((20, img.size[1] - fontSize - 20), "Open Climate Tech - Wildfire", font=font, fill=color)
+    annotate.drawWatermark(img)
 
-    img.save(destPath, format="JPEG")
+    if destPath:
+        img.save(destPath, format="JPEG")
     del imgDraw
 
 
@@ -213,32 +389,41 @@ def genAnnotatedImages(constants, cameraID, timestamp, imgPath, fireSegment):
 
     (cropX0, cropX1) = stretchBounds(x0, x1, img.size[0])
     (cropY0, cropY1) = stretchBounds(y0, y1, img.size[1])
+    # yuv420p requires even dimensions, but stretchBounds returns odd sizes when clamped to odd image sizes
+    cropX1 = cropX0 + (cropX1 - cropX0)//2*2
+    cropY1 = cropY0 + (cropY1 - cropY0)//2*2
     cropCoords = (cropX0, cropY0, cropX1, cropY1)
+    moviePath = filePathParts[0] + '_AnnCrop_' + 'x'.join(list(map(lambda x: str(x), cropCoords))) + '.mp4'
     # get images spanning a few minutes so reviewers can evaluate based on progression
-    startTimeDT = datetime.datetime.fromtimestamp(timestamp - 5*60)
-    endTimeDT = datetime.datetime.fromtimestamp(timestamp - 1*60)
-
-    with tempfile.TemporaryDirectory() as tmpDirName:
-        oldImages = img_archive.getHpwrenImages(constants['googleServices'], settings, tmpDirName,
-                                                constants['camArchives'], cameraID, startTimeDT, endTimeDT, 1)
-        imgSequence = oldImages or []
-        imgSequence.append(imgPath)
-        for (i, imgFile) in enumerate(imgSequence):
+    imgSequence = constants['alertAssets'].getImages(cameraID, timestamp, 5, 1)
+    imgSequence.append(imgPath)
+    # stream the raw cropped frames into ffmpeg to make the movie without intermediate JPEG files
+    clipSize = (cropX1 - cropX0, cropY1 - cropY0)
+    encoder = (
+        ffmpeg.input('pipe:', format='rawvideo', pix_fmt='rgb24', s='%dx%d' % clipSize, framerate=CLIP_FPS)
+            .output(moviePath, pix_fmt='yuv420p', r=CLIP_FPS)
+            .global_args('-loglevel', 'error')
+            .overwrite_output()
+            .run_async(pipe_stdin=True)
+    )
+    try:
+        for imgFile in imgSequence:
             imgParsed = img_archive.parseFilename(imgFile)
-            cropName = 'img' + ("%03d" % i) + filePathParts[1]
-            croppedPath = os.path.join(tmpDirName, cropName)
             imgSeq = Image.open(imgFile)
-            croppedImg = imgSeq.crop(cropCoords)
-            drawFireBox(croppedImg, croppedPath, fireSegment, x0 - cropX0, y0 - cropY0, x1 - cropX0, y1 - cropY0, timestamp=imgParsed['unixTime'])
+            croppedImg = imgSeq.crop(cropCoords).convert('RGB')
+            drawFireBox(croppedImg, None, fireSegment, x0 - cropX0, y0 - cropY0, x1 - cropX0, y1 - cropY0, timestamp=imgParsed['unixTime'])
+            encoder.stdin.write(croppedImg.tobytes())
             imgSeq.close()
             croppedImg.close()
-        # now make movie from this sequence of cropped images
-        moviePath = filePathParts[0] + '_AnnCrop_' + 'x'.join(list(map(lambda x: str(x), cropCoords))) + '.mp4'
-        (
-            ffmpeg.input(os.path.join(tmpDirName, 'img%03d.jpg'), framerate=1)
-                .filter('fps', fps=25, round='up')
-                .output(moviePath, pix_fmt='yuv420p').run()
-        )
+        encoder.stdin.close()
+        returnCode = encoder.wait()
+    finally:
+        if encoder.poll() == None: # failed while writing frames, so don't leave ffmpeg running
+            encoder.stdin.close()
+            encoder.kill()
+            encoder.wait()
+    if returnCode != 0:
+        raise Exception('ffmpeg failed to encode %s' % moviePath)
 
     annotatedPath = filePathParts[0] + '_Ann' + filePathParts[1]
     drawFireBox(img, annotatedPath, fireSegment, x0, y0, x1, y1)
@@ -247,6 +432,22 @@ def genAnnotatedImages(constants, cameraID, timestamp, imgPath, fireSegment):
     return (moviePath, annotatedPath)
 
 
+def fetchArchiveImage(constants, outputDir, cameraID, desiredDT):
+    """Download the HPWREN archive image of given camera closest to given time
+
+    Args:
+        constants (dict): "global" contants
+        outputDir (str): Output directory path
+        cameraID (str): camera name
+        desiredDT (datetime): desired time
+
+    Returns:
+        List of local filesystem paths to downloaded images
+    """
+    return img_archive.getHpwrenImages(constants['googleServices'], settings, outputDir,
+                                       constants['camArchives'], cameraID, desiredDT, desiredDT, 1)
+
+
 def isDuplicateAlert(dbManager, cameraID, timestamp):
     """Check if alert has been recently sent out for given camera
 
@@ -295,13 +496,17 @@ def pubsubFireNotification(cameraID, timestamp, croppedUrl, annotatedUrl, fireSe
     """Send a pubsub notification for a potential new fire
 
     Sends pubsub message with information about the camera and fire score includeing
-    image attachments
+    image attachments.  The message is published in the background without waiting
+    for acknowledgement, and failed messages are retried by the publisher.
 
     Args:
         cameraID (str): camera name
         timestamp (int): time.time() value when image was taken
         annotatedUrl: Public URL for annotated iamge
         fireSegment (dictionary): dictionary with information for the segment with fire/smoke
+
+    Returns:
+        Future that completes once the message is delivered (None if pubsub is not configured)
     """
     message = {
         'timestamp': timestamp,
@@ -312,14 +517,16 @@ def pubsubFireNotification(cameraID, timestamp, croppedUrl, annotatedUrl, fireSe
         'croppedUrl': croppedUrl,
         'annotatedUrl': annotatedUrl
     }
-    goog_helper.publish(message)
+    return goog_helper.publishAsync(message)
 
 
-def emailFireNotification(constants, cameraID, timestamp, imgPath, annotatedFile, fireSegment):
+def emailFireNotification(constants, cameraID, timestamp, imgPath, annotatedFile, fireSegment, onSent=None):
     """Send an email alert for a potential new fire
 
     Send email with information about the camera and fire score includeing
-    image attachments
+    image attachments.  The email is sent in the background by the notification
+    service, so the given files are copied first.  The archive images are shared
+    with the alert clip through the alert asset cache.
 
     Args:
         constants (dict): "global" contants
@@ -328,72 +535,102 @@ def emailFireNotification(constants, cameraID, timestamp, imgPath, annotatedFile
         imgPath: filepath of the original image
         annotatedFile: filepath of the annotated image
         fireSegment (dictionary): dictionary with information for the segment with fire/smoke
+        onSent: optional function called once email is sent
+
+    Returns:
+        list of futures for the pending notifications
     """
-    dbManager = constants['dbManager']
     subject = 'Possible (%d%%) fire in camera %s' % (int(fireSegment['score']*100), cameraID)
     body = 'Please check the attached images for fire.'
 
     # emails are sent from settings.fuegoEmail and bcc to everyone with active emails in notifications SQL table
-    dbResult = dbManager.getNotifications(filterActiveEmail = True)
-    emails = [x['email'] for x in dbResult]
-    if len(emails) > 0:
+    emails = constants['recipients'].getEmails()
+    if len(emails) == 0:
+        return []
+    tmpDir = tempfile.TemporaryDirectory()
+    attachments = [shutil.copy(imgPath, tmpDir.name)]
+    if annotatedFile:
+        attachments.append(shutil.copy(annotatedFile, tmpDir.name))
+    def sendFunc():
         # attach images spanning a few minutes so reviewers can evaluate based on progression
-        startTimeDT = datetime.datetime.fromtimestamp(timestamp - 3*60)
-        endTimeDT = datetime.datetime.fromtimestamp(timestamp - 1*60)
-        with tempfile.TemporaryDirectory() as tmpDirName:
-            oldImages = img_archive.getHpwrenImages(constants['googleServices'], settings, tmpDirName,
-                                                    constants['camArchives'], cameraID, startTimeDT, endTimeDT, 1)
-            attachments = oldImages or []
-            attachments.append(imgPath)
-            if annotatedFile:
-                attachments.append(annotatedFile)
-            email_helper.sendEmail(constants['googleServices']['mail'], settings.fuegoEmail, emails, subject, body, attachments)
+        oldImages = constants['alertAssets'].getImages(cameraID, timestamp, 3, 1)
+        return email_helper.sendEmail(constants['googleServices']['mail'], settings.fuegoEmail, emails, subject, body,
+                                      oldImages + attachments, retries=1)
+    return [constants['notificationService'].submit('email', sendFunc, onSuccess=onSent, onDone=tmpDir.cleanup)]
 
 
-def smsFireNotification(dbManager, cameraID):
-    """Send an sms (phone text message) alert for a potential new fire
+def smsFireNotification(constants, cameraID, onSent=None):
+    """Send an sms (phone text message) alert for a potential new fire to all active phones in parallel
 
     Args:
-        dbManager (DbManager):
+        constants (dict): "global" contants
         cameraID (str): camera name
+        onSent: optional function called once the first message is sent
+
+    Returns:
+        list of futures for the pending notifications
     """
     message = 'Firecam fire notification in camera %s. Please check email for details' % cameraID
-    dbResult = dbManager.getNotifications(filterActivePhone = True)
-    phones = [x['phone'] for x in dbResult]
-    if len(phones) > 0:
-        for phone in phones:
-            sms_helper.sendSms(settings, phone, message)
+    if onSent:
+        onSent = notification_service.callOnce(onSent) # one sms timing per alert, not per recipient
+    futures = []
+    for phone in constants['recipients'].getPhones():
+        sendFunc = lambda phone=phone: sms_helper.sendSms(settings, phone, message, retries=1)
+        futures.append(constants['notificationService'].submit('sms', sendFunc, onSuccess=onSent))
+    return futures
 
 
-def alertFire(constants, cameraID, timestamp, imgPath, fireSegment):
+def alertFire(constants, cameraID, timestamp, imgPath, fireSegment, alertTimer=None):
     """Update Alerts DB and send alerts about given fire through all channels (pubsub, email, and sms)
 
+    Pubsub, email, and sms notifications are sent in the background, and the returned
+    futures complete once they are sent (or given up)
+
     Args:
         constants (dict): "global" contants
         cameraID (str): camera name
         timestamp (int): time.time() value when image was taken
         imgPath: filepath of the original image
         fireSegment (dictionary): dictionary with information for the segment with fire/smoke
+        alertTimer (AlertTimer): optional tracker of completion time of each channel
+
+    Returns:
+        list of futures for the pending notifications
     """
-    (croppedPath, annotatedPath) = genAnnotatedImages(constants, cameraID, timestamp, imgPath, fireSegment)
+    markChannel = alertTimer.markChannel if alertTimer else lambda channel: None
+    with tracing.span('genAnnotatedImages'):
+        (croppedPath, annotatedPath) = genAnnotatedImages(constants, cameraID, timestamp, imgPath, fireSegment)
 
     # copy annotated image to publicly accessible settings.noticationsDir
-    alertsDateDir = goog_helper.dateSubDir(settings.noticationsDir)
-    croppedID = goog_helper.copyFile(croppedPath, alertsDateDir)
-    annotatedID = goog_helper.copyFile(annotatedPath, alertsDateDir)
+    with tracing.span('upload'):
+        alertsDateDir = goog_helper.dateSubDir(settings.noticationsDir)
+        croppedID = goog_helper.copyFile(croppedPath, alertsDateDir)
+        annotatedID = goog_helper.copyFile(annotatedPath, alertsDateDir)
     # convert fileIDs into URLs usable by web UI
     croppedUrl = croppedID.replace('gs://', 'https://storage.googleapis.com/')
     annotatedUrl = annotatedID.replace('gs://', 'https://storage.googleapis.com/')
 
     dbManager = constants['dbManager']
-    updateAlertsDB(dbManager, cameraID, timestamp, croppedUrl, annotatedUrl, fireSegment)
-    pubsubFireNotification(cameraID, timestamp, croppedUrl, annotatedUrl, fireSegment)
-    emailFireNotification(constants, cameraID, timestamp, imgPath, annotatedPath, fireSegment)
-    smsFireNotification(dbManager, cameraID)
+    with tracing.span('notify', channel='db'):
+        updateAlertsDB(dbManager, cameraID, timestamp, croppedUrl, annotatedUrl, fireSegment)
+    markChannel('db')
+    futures = []
+    with tracing.span('notify', channel='pubsub'):
+        pubsubFuture = pubsubFireNotification(cameraID, timestamp, croppedUrl, annotatedUrl, fireSegment)
+    if pubsubFuture:
+        # channel completes when the message is delivered, not when it's handed to the publisher
+        pubsubFuture.add_done_callback(lambda x: x.exception() or markChannel('pubsub'))
+        futures.append(pubsubFuture)
+    with tracing.span('notify', channel='email'):
+        futures += emailFireNotification(constants, cameraID, timestamp, imgPath, annotatedPath, fireSegment,
+                                        onSent=lambda: markChannel('email'))
+    with tracing.span('notify', channel='sms'):
+        futures += smsFireNotification(constants, cameraID, onSent=lambda: markChannel('sms'))
 
     # remove both temporary files
     os.remove(croppedPath)
     os.remove(annotatedPath)
+    return futures
 
 
 def deleteImageFiles(imgPath, origImgPath):
@@ -403,8 +640,9 @@ def deleteImageFiles(imgPath, origImgPath):
         imgPath: filepath of the processed image
         origImgPath: filepath of the original image
     """
-    os.remove(imgPath)
-    if imgPath != origImgPath:
+    if os.path.isfile(imgPath): # in-memory images may never have been written
+        os.remove(imgPath)
+    if (imgPath != origImgPath) and os.path.isfile(origImgPath):
         os.remove(origImgPath)
     # ppath = pathlib.PurePath(imgPath)
     # leftoverFiles = os.listdir(str(ppath.parent))
@@ -458,11 +696,14 @@ def updateTimeTracker(timeTracker, processingTime):
     """Update the time tracker data with given time to process current image
 
     If enough samples new samples have been reorded, resets the history and
-    updates the average timePerSample
+    updates the average timePerSample (also exported as a metrics gauge)
 
     Args:
         timeTracker (dict): tracks recent image processing times
         processingTime (float): number of seconds needed to process current image
+
+    Returns:
+        True if timePerSample was updated
     """
     timeTracker['totalTime'] += processingTime
     timeTracker['numSamples'] += 1
@@ -472,7 +713,9 @@ def updateTimeTracker(timeTracker, processingTime):
         timeTracker['timePerSample'] = timeTracker['totalTime'] / timeTracker['numSamples']
         timeTracker['totalTime'] = 0
         timeTracker['numSamples'] = 0
-        logging.warning('New timePerSample %.2f', timeTracker['timePerSample'])
+        metrics.registry.gauge('firecam_time_per_sample_seconds', 'Average seconds to process one image').set(timeTracker['timePerSample'])
+        return True
+    return False
 
 
 def initializeTimeTracker():
@@ -505,6 +748,9 @@ def getArchivedImages(constants, cameras, startTimeDT, timeRangeSeconds, minusMi
         getArchivedImages.tmpDir = tempfile.TemporaryDirectory()
         logging.warning('TempDir %s', getArchivedImages.tmpDir.name)
 
+    if not cameras:
+        time.sleep(5) # no cameras assigned to this worker
+        return (None, None, None, None)
     cameraID = cameras[int(len(cameras)*random.random())]['name']
     timeDT = startTimeDT + datetime.timedelta(seconds = random.random()*timeRangeSeconds)
     if minusMinutes:
@@ -543,21 +789,54 @@ def main():
     optArgs = [
         ["b", "heartbeat", "filename used for heartbeating check"],
         ["c", "collectPositves", "collect positive segments for training data"],
-        ["t", "time", "Time breakdown for processing images"],
+        ["t", "time", "Log percentiles of time spent in each processing stage"],
         ["m", "minusMinutes", "(optional) subtract images from given number of minutes ago"],
         ["r", "restrictType", "Only process images from cameras of given type"],
         ["s", "startTime", "(optional) performs search with modifiedTime > startTime"],
         ["e", "endTime", "(optional) performs search with modifiedTime < endTime"],
+        ["n", "nightScanMinutes", "(optional) minutes between scans of each camera when sun is down", int],
+        ["P", "metricsPort", "(optional) local port for HTTP endpoint with Prometheus metrics", int],
+        ["j", "metricsJson", "(optional) file path where to periodically dump metrics as JSON"],
+        ["p", "profile", "(optional) fraction (0-1) of iterations to profile with cProfile", float],
+        ["o", "profileDir", "(optional) directory for profile output (default: temp dir)"],
+        ["M", "memoryBudgetMB", "(optional) run garbage collection when RSS exceeds given MB", int],
+        ["A", "traceAllocations", "(optional) log given number of top allocators via tracemalloc", int],
+        ["T", "traceFile", "(optional) JSONL file to write tracing spans of every frame"],
+        ["W", "workerID", "(optional) unique name of this worker. Enables sharding cameras across workers"],
+        ["L", "loadShedInterval", "(optional) camera upload interval (seconds) that enables load shedding when exceeded by sweep time", int],
+        ["R", "ringBufferMinutes", "(optional) minutes of recent images to keep in memory for alert clips and emails", int],
     ]
     args = collect_args.collectArgs([], optionalArgs=optArgs, parentParsers=[goog_helper.getParentParser()])
     minusMinutes = int(args.minusMinutes) if args.minusMinutes else 0
     # TODO: Fix googleServices auth to resurrect email alerts
     # googleServices = goog_helper.getGoogleServices(settings, args)
     googleServices = None
-    dbManager = db_manager.DbManager(sqliteFile=settings.db_file,
-                                    psqlHost=settings.psqlHost, psqlDb=settings.psqlDb,
-                                    psqlUser=settings.psqlUser, psqlPasswd=settings.psqlPasswd)
-    cameras = dbManager.get_sources(activeOnly=True, restrictType=args.restrictType)
+    newDbManager = lambda: db_manager.DbManager(sqliteFile=settings.db_file,
+                                                psqlHost=settings.psqlHost, psqlDb=settings.psqlDb,
+                                                psqlUser=settings.psqlUser, psqlPasswd=settings.psqlPasswd)
+    dbManager = newDbManager()
+    allCameras = dbManager.get_sources(activeOnly=True, restrictType=args.restrictType)
+    addCameraLocations(dbManager, allCameras) # for night detection even without nightScanMinutes
+    cameras = allCameras
+    # systemd stops the service with SIGTERM, which skips atexit handlers unless it exits via SystemExit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    pendingAlertTimers = []
+    # registered before closing the publisher, so it runs after pubsub deliveries are done
+    atexit.register(alert_timings.savePendingTimers, pendingAlertTimers, dbManager)
+    atexit.register(goog_helper.closeAsyncPublisher) # deliver (or retry) pending pubsub alerts
+    membership = None
+    if args.workerID:
+        membership = sharding.WorkerMembership(dbManager, args.workerID)
+        membership.refresh()
+        cameras = membership.filterCameras(allCameras)
+        logging.warning('Worker %s assigned %d of %d cameras', membership.workerID, len(cameras), len(allCameras))
+        membership.startHeartbeat(newDbManager)
+        atexit.register(membership.leave)
+    cameraHealth = camera_health.CameraHealth(dbManager)
+    cameraState = None
+    if getattr(settings, 'cameraStateFile', None):
+        cameraState = camera_state.CameraStateStore(settings.cameraStateFile)
+        atexit.register(cameraState.flush) # save changes since the last periodic flush
     startTimeDT = dateutil.parser.parse(args.startTime) if args.startTime else None
     endTimeDT = dateutil.parser.parse(args.endTime) if args.endTime else None
     timeRangeSeconds = None
@@ -570,7 +849,31 @@ def main():
         'googleServices': googleServices,
         'camArchives': camArchives,
         'dbManager': dbManager,
+        'notificationService': notification_service.NotificationService(),
+        'recipients': notification_service.RecipientCache(dbManager),
     }
+    ringBuffer = None
+    if args.ringBufferMinutes:
+        ringBuffer = alert_assets.FrameRingBuffer(args.ringBufferMinutes*60)
+    constants['alertAssets'] = alert_assets.AlertAssetCache(
+        lambda outputDir, cameraID, desiredDT: fetchArchiveImage(constants, outputDir, cameraID, desiredDT), ringBuffer)
+
+    if args.metricsPort:
+        metrics.startHttpServer(args.metricsPort)
+    if args.metricsJson:
+        metrics.startJsonDump(args.metricsJson)
+    loopProfiler = None
+    if args.profile:
+        profileDir = args.profileDir or os.path.join(tempfile.gettempdir(), 'firecam_profiles')
+        loopProfiler = profiler.SamplingProfiler(args.profile, profileDir)
+    memoryMonitor = memory_monitor.MemoryMonitor(args.memoryBudgetMB or 0, args.traceAllocations or 0)
+    if args.traceFile:
+        tracing.setExporter(tracing.JsonlExporter(args.traceFile))
+    loadShedder = None
+    if args.loadShedInterval:
+        loadShedder = load_shedding.LoadShedder(args.loadShedInterval)
+    configVersion = dbManager.getConfigVersion()
+    nextConfigCheck = time.time() + CONFIG_CHECK_SECONDS
 
     if startTimeDT or endTimeDT:
         assert startTimeDT and endTimeDT
@@ -583,42 +886,116 @@ def main():
     processingTimeTracker = initializeTimeTracker()
     while True:
         classifyImgPath = None
+        imgData = None
+        if loopProfiler:
+            loopProfiler.start()
+        memoryMonitor.startIteration()
+        camerasChanged = False
+        if time.time() > nextConfigCheck:
+            nextConfigCheck = time.time() + CONFIG_CHECK_SECONDS
+            newConfigVersion = dbManager.getConfigVersion()
+            if newConfigVersion != configVersion:
+                configVersion = newConfigVersion
+                newCameras = dbManager.get_sources(activeOnly=True, restrictType=args.restrictType)
+                allCameras = mergeCameras(allCameras, newCameras, cameraState)
+                addCameraLocations(dbManager, allCameras)
+                camerasChanged = True
+            changedSettings = settings.reloadIfChanged()
+            if 'hpwrenArchives' in changedSettings:
+                constants['camArchives'] = img_archive.getHpwrenCameraArchives(settings.hpwrenArchives)
+            if 'detectionPolicy' in changedSettings:
+                logging.warning('Switching detection policy to %s', settings.detectionPolicy)
+                DetectionPolicyClass = policies.get_policies()[settings.detectionPolicy]
+                detectionPolicy = DetectionPolicyClass(args, dbManager, minusMinutes, stateless=useArchivedImages)
+        if membership and (membership.checkChanged() or camerasChanged):
+            cameras = membership.filterCameras(allCameras)
+            logging.warning('Worker %s assigned %d of %d cameras', membership.workerID, len(cameras), len(allCameras))
+        elif camerasChanged:
+            cameras = allCameras
+        frameSpan = tracing.span('frame').start()
         timeStart = time.time()
-        if useArchivedImages:
-            (cameraID, timestamp, imgPath, classifyImgPath) = \
-                getArchivedImages(constants, cameras, startTimeDT, timeRangeSeconds, minusMinutes)
-        # elif minusMinutes: to be resurrected using archive functionality
-        else: # regular (non diff mode), grab image and process
-            (cameraID, timestamp, imgPath, md5) = getNextImage(dbManager, cameras)
-            classifyImgPath = imgPath
+        with tracing.span('getNextImage'):
+            if useArchivedImages:
+                (cameraID, timestamp, imgPath, classifyImgPath) = \
+                    getArchivedImages(constants, cameras, startTimeDT, timeRangeSeconds, minusMinutes)
+            # elif minusMinutes: to be resurrected using archive functionality
+            else: # regular (non diff mode), grab image and process
+                (cameraID, timestamp, imgPath, md5, imgData) = getNextImage(dbManager, cameras, nightScanMinutes=args.nightScanMinutes,
+                                                                   cameraHealth=cameraHealth, cameraState=cameraState,
+                                                                   localCounter=bool(membership))
+                classifyImgPath = imgPath
         if not cameraID:
+            frameSpan.end()
+            if loopProfiler:
+                loopProfiler.stop()
             continue # skip to next camera
+        tracing.setAttribute('camera', cameraID)
+        if ringBuffer and imgData:
+            ringBuffer.add(cameraID, timestamp, imgData)
+        tracing.setAttribute('timestamp', timestamp)
         timeFetch = time.time()
+        metrics.observeStage('fetch', timeFetch - timeStart)
+        memoryMonitor.markStage('fetch')
+        metrics.registry.counter('firecam_frames_total', 'Images checked for smoke').inc({'camera': cameraID})
 
+        camera = list(filter(lambda x: x['name'] == cameraID, cameras))[0]
         image_spec = [{}]
         image_spec[-1]['path'] = classifyImgPath
+        image_spec[-1]['data'] = imgData
         image_spec[-1]['timestamp'] = timestamp
         image_spec[-1]['cameraID'] = cameraID
 
-        detectionResult = detectionPolicy.detect(image_spec)
+        isStale = False
+        if loadShedder:
+            (captureTime, _) = alert_timings.getCaptureTime(lastModified=camera.get('lastModified'))
+            isStale = loadShedder.isStale(cameraID, captureTime, timestamp)
+            image_spec[-1]['tileSampling'] = loadShedder.getTileSampling(camera)
+        if isStale:
+            detectionResult = {'fireSegment': None}
+        else:
+            with tracing.span('detect'):
+                detectionResult = detectionPolicy.detect(image_spec)
         timeDetect = time.time()
+        metrics.observeStage('detect', timeDetect - timeFetch)
+        memoryMonitor.markStage('detect')
         if detectionResult['fireSegment']:
             if not isDuplicateAlert(dbManager, cameraID, timestamp):
-                alertFire(constants, cameraID, timestamp, imgPath, detectionResult['fireSegment'])
+                img_archive.saveImageData(imgPath, imgData) # alerts need the image file for uploads and attachments
+                (captureTime, captureSource) = alert_timings.getCaptureTime(imgData, camera.get('lastModified'))
+                alertTimer = alert_timings.AlertTimer(cameraID, timestamp, captureTime, captureSource, timeFetch, timeDetect)
+                with metrics.stageTimer('alert'):
+                    notificationFutures = alertFire(constants, cameraID, timestamp, imgPath, detectionResult['fireSegment'], alertTimer)
+                alertTimer.addPending(notificationFutures)
+                pendingAlertTimers.append(alertTimer)
+                metrics.registry.counter('firecam_alerts_total', 'Alerts sent').inc({'camera': cameraID})
+                memoryMonitor.markStage('alert')
+        if loadShedder and detectionResult.get('segments'):
+            loadShedder.afterFrame(camera, timestamp, detectionResult['segments'][0]['score'],
+                                   processingTimeTracker['timePerSample'] * len(cameras))
+        # save timings of alerts once all their background notifications are done
+        for doneTimer in list(filter(lambda x: x.isDone(), pendingAlertTimers)):
+            doneTimer.save(dbManager)
+            pendingAlertTimers.remove(doneTimer)
         deleteImageFiles(imgPath, imgPath)
         if (args.heartbeat):
             heartBeat(args.heartbeat)
 
         timePost = time.time()
-        updateTimeTracker(processingTimeTracker, timePost - timeStart)
-        if args.time:
-            if not detectionResult['timeMid']:
-                detectionResult['timeMid'] = timeDetect
-            logging.warning('Timings: fetch=%.2f, detect0=%.2f, detect1=%.2f post=%.2f',
-                timeFetch-timeStart, detectionResult['timeMid']-timeFetch, timeDetect-detectionResult['timeMid'], timePost-timeDetect)
-        # free all memory for current iteration and trigger GC to prevent memory growth
+        metrics.observeStage('total', timePost - timeStart)
+        if updateTimeTracker(processingTimeTracker, timePost - timeStart):
+            sweepSeconds = processingTimeTracker['timePerSample'] * len(cameras)
+            metrics.registry.gauge('firecam_sweep_seconds', 'Estimated seconds to check every camera once').set(sweepSeconds)
+            if loadShedder:
+                loadShedder.updateSweep(sweepSeconds, cameras)
+            if args.time:
+                logging.warning('Timings: %s', metrics.formatStageSummary())
+        frameSpan.end()
+        if loopProfiler:
+            loopProfiler.stop()
+        # free memory for current iteration, and collect garbage only when over memory budget
         detectionResult = None
-        gc.collect()
+        imgData = None
+        memoryMonitor.endIteration()
 
 if __name__=="__main__":
     main()